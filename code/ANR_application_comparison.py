@@ -2,7 +2,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from utils import palette, letter_annotation, cashflows_color_map 
+from utils import palette, letter_annotation, cashflows_color_map, read_excel_cached
 import warnings
 import pp_industrial_hydrogen
 
@@ -13,7 +13,7 @@ color_map = {'Industrial Hydrogen':'blue', 'Process Heat':'red', 'Total':'Green'
 
 def load_elec_results(anr_tag):
   elec_results_path = f'./results/price_taker_{anr_tag}_MidCase.xlsx'
-  elec_df = pd.read_excel(elec_results_path)
+  elec_df = read_excel_cached(elec_results_path)
   elec_df['Annual Net Revenues (M$/MWe/y)'] = elec_df['Annual Net Revenues ($/year/MWe)']/1e6
   # Only keep the best design for each state and year
   df = elec_df.loc[elec_df.groupby('state')['Annual Net Revenues (M$/MWe/y)'].transform(max) == elec_df['Annual Net Revenues (M$/MWe/y)']]
@@ -28,7 +28,7 @@ def load_h2_results(anr_tag, cogen_tag, with_PTC=True):
   industries = ['refining','steel','ammonia']
   list_df = []
   for ind in industries:
-    df = pd.read_excel(h2_results_path, sheet_name=ind, index_col='id')
+    df = read_excel_cached(h2_results_path, sheet_name=ind, index_col='id')
     list_cols = ['state', 'latitude', 'longitude','H2 Dem. (kg/day)','Net Revenues with H2 PTC ($/year)',\
                  'Net Revenues ($/year)','Electricity revenues ($/y)','IRR w PTC', 'IRR wo PTC',\
                   'Net Annual Revenues with H2 PTC ($/MWe/y)', 'HTSE', 'Depl. ANR Cap. (MWe)', 'ANR type', \
@@ -66,7 +66,7 @@ def load_h2_results(anr_tag, cogen_tag, with_PTC=True):
 def load_heat_results(anr_tag, cogen_tag, with_PTC=True):
   """Loads direct process heat results and returns them sorted by breakeven prices"""
   heat_results_path = f'./results/process_heat/best_pathway_{anr_tag}_{cogen_tag}_PTC_{with_PTC}.xlsx'
-  heat_df = pd.read_excel(heat_results_path, index_col='FACILITY_ID')
+  heat_df = read_excel_cached(heat_results_path, index_col='FACILITY_ID')
   heat_df['Annual Net Revenues (M$/MWe/y)']  = heat_df['Pathway Net Ann. Rev. (M$/y)']/heat_df['Depl. ANR Cap. (MWe)']
   heat_df['Annual Net Revenues (M$/y)'] = heat_df['Pathway Net Ann. Rev. (M$/y)']
   heat_df.sort_values(by=['Breakeven NG price ($/MMBtu)', 'Annual Net Revenues (M$/MWe/y)'], inplace=True)
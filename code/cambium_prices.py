@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+import glob
+import hashlib
+import json
+import os
+from utils import conversion_2021usd_to_2020usd
+
+"""Hourly Cambium electricity prices stored once in a single float32 cube indexed by (scenario, year, state, hour).
+The cube is built from the per-state csv files by build_price_cube and opened read-only with mmap by open_price_cube,
+so all processes share the same pages and each state series is a zero-copy slice.
+Prices in the cube are converted to 2020 USD."""
+
+CUBE_PATH = './input_data/cambium_price_cube.npy'
+CUBE_INDEX_PATH = './input_data/cambium_price_cube.json'
+HOURS = 8760
+
+_cube = None
+_cube_index = None
+
+
+def get_price_folder(scenario):
+  return f'./input_data/cambium_{scenario.lower()}_state_hourly_electricity_prices'
+
+
+def list_price_files(scenario):
+  """Lists the Cambium csv files available for a scenario
+  Args:
+    scenario (str): Cambium scenario, e.g. 'MidCase'
+  Returns:
+    files (dict): (year, state) to csv path
+  """
+  files = {}
+  for file in glob.glob(get_price_folder(scenario)+f'/Cambium22_{scenario}_hourly_*.csv'):
+    state, year = os.path.splitext(os.path.basename(file))[0].split('_')[-2:]
+    files[(int(year), state)] = file
+  return files
+
+
+def get_source_fingerprint(scenario):
+  """Fingerprint of the Cambium csv files of a scenario: sha256 of the sorted file names with their size and
+  modification time, so adding, removing or editing a file changes it"""
+  stats = []
+  for (year, state), file in sorted(list_price_files(scenario).items()):
+    stat = os.stat(file)
+    stats.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+  return hashlib.sha256(json.dumps(stats).encode()).hexdigest()
+
+
+def build_price_cube(scenarios, cube_path=CUBE_PATH, index_path=CUBE_INDEX_PATH):
+  """Reads all Cambium csv files of the scenarios once and stores the prices in 2020 USD in a float32 .npy cube.
+  Missing (scenario, year, state) combinations are filled with NaN, scenarios without files are not in the cube but
+  their fingerprint is stored so that they do not trigger a rebuild.
+  Each build is stored next to cube_path under a name of its own, and the index json, replaced last, names the cube
+  file of its build: concurrent builds do not share files and readers never pair a cube with the labels of another one.
+  Args:
+    scenarios (list[str]): Cambium scenarios to ingest
+    cube_path (str): path to the .npy cube, the cube of a build is stored as <cube_path without .npy>.<build>.npy
+    index_path (str): path to the json file with the labels of the cube axes
+  Returns:
+    None
+  """
+  files = {scenario:list_price_files(scenario) for scenario in scenarios}
+  sources = {scenario:get_source_fingerprint(scenario) for scenario in scenarios}
+  scenarios = [scenario for scenario in scenarios if files[scenario]]
+  years = sorted({year for scenario in scenarios for (year, state) in files[scenario]})
+  states = sorted({state for scenario in scenarios for (year, state) in files[scenario]})
+  root = os.path.splitext(cube_path)[0]
+  build = hashlib.sha256(json.dumps(sources, sort_keys=True).encode()).hexdigest()[:16]
+  build_path = f'{root}.{build}.npy'
+  tmp_path = f'{build_path}.{os.getpid()}.tmp.npy'
+  cube = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(scenarios), len(years), len(states), HOURS))
+  cube[:] = np.nan
+  for s, scenario in enumerate(scenarios):
+    for (year, state), file in files[scenario].items():
+      prices = pd.read_csv(file, skiprows=5, usecols=['energy_cost_enduse'])['energy_cost_enduse'].to_numpy()
+      assert len(prices) == HOURS, f'{file}: {len(prices)} hourly prices instead of {HOURS}'
+      cube[s, years.index(year), states.index(state)] = prices*conversion_2021usd_to_2020usd
+  cube.flush()
+  del cube
+  os.replace(tmp_path, build_path)
+  tmp_index_path = f'{index_path}.{os.getpid()}.tmp'
+  with open(tmp_index_path, 'w') as f:
+    json.dump({'scenarios':scenarios, 'years':years, 'states':states, 'usd_year':2020, 'sources':sources,
+               'cube':os.path.basename(build_path)}, f, indent=1)
+  os.replace(tmp_index_path, index_path)
+  # Cubes of the previous builds, the processes that mapped them keep their pages
+  for old_path in glob.glob(glob.escape(root)+'*.npy'):
+    if old_path != build_path and '.tmp.' not in os.path.basename(old_path):
+      try:
+        os.remove(old_path)
+      except FileNotFoundError:
+        pass
+  global _cube, _cube_index
+  _cube, _cube_index = None, None
+
+
+def _read_cube_index(cube_path, index_path):
+  """Index of the price cube and path of its cube file, (None, None) if there is no cube"""
+  if not os.path.isfile(index_path):
+    return None, None
+  with open(index_path) as f:
+    cube_index = json.load(f)
+  # Cubes built before the index named its cube file are stored at cube_path
+  build_path = os.path.join(os.path.dirname(cube_path), cube_index['cube']) if 'cube' in cube_index else cube_path
+  return (cube_index, build_path) if os.path.isfile(build_path) else (None, None)
+
+
+def ensure_price_cube(scenarios, cube_path=CUBE_PATH, index_path=CUBE_INDEX_PATH):
+  """Builds the price cube if it does not exist yet, misses one of the scenarios or the csv files of one of the scenarios
+  changed since it was built (see get_source_fingerprint)"""
+  cube_index, _ = _read_cube_index(cube_path, index_path)
+  sources = {} if cube_index is None else cube_index.get('sources', {})
+  if cube_index is None or any(sources.get(scenario) != get_source_fingerprint(scenario) for scenario in scenarios):
+    known = [] if cube_index is None else cube_index['scenarios']+list(sources)
+    build_price_cube(list(dict.fromkeys(known+list(scenarios))), cube_path, index_path)
+
+
+def open_price_cube(cube_path=CUBE_PATH, index_path=CUBE_INDEX_PATH):
+  """Opens the price cube read-only with mmap, once per process (also used as Pool initializer)
+  Returns:
+    cube (np.memmap): prices in $2020/MWhe with shape (scenario, year, state, hour)
+    cube_index (dict): labels of the scenario, year and state axes
+  """
+  global _cube, _cube_index
+  if _cube is None:
+    # A concurrent build can replace the cube between the two reads, the index is then read again
+    for attempt in range(2):
+      cube_index, build_path = _read_cube_index(cube_path, index_path)
+      assert cube_index is not None, f'Price cube not found: {cube_path}, build it with cambium_prices.build_price_cube'
+      try:
+        _cube = np.load(build_path, mmap_mode='r')
+        break
+      except FileNotFoundError:
+        if attempt == 1:
+          raise
+    _cube_index = cube_index
+  return _cube, _cube_index
+
+
+def get_hourly_prices(scenario, year, state):
+  """Zero-copy view of the hourly prices of a state
+  Args:
+    scenario (str): Cambium scenario
+    year (int): year
+    state (str): abbreviation of the state name
+  Returns:
+    prices (np.ndarray): read-only float32 array of 8760 prices in $2020/MWhe
+  """
+  cube, cube_index = open_price_cube()
+  try:
+    prices = cube[cube_index['scenarios'].index(scenario), cube_index['years'].index(int(year)), cube_index['states'].index(state)]
+  except ValueError:
+    raise KeyError(f'No Cambium prices for {scenario}, {year}, {state} in {CUBE_PATH}')
+  # Combinations of the axes without a csv file are filled with NaN
+  if np.isnan(prices).all():
+    raise KeyError(f'No Cambium prices for {scenario}, {year}, {state} in {CUBE_PATH}')
+  return prices
+
+
+def get_average_prices(scenario, year):
+  """Average hourly price of each state available for a scenario and year
+  Returns:
+    avg_prices (Series): average price in $2020/MWhe indexed by state
+  """
+  cube, cube_index = open_price_cube()
+  year_prices = cube[cube_index['scenarios'].index(scenario), cube_index['years'].index(int(year))]
+  avg_prices = pd.Series(year_prices.mean(axis=-1, dtype=np.float64), index=pd.Index(cube_index['states'], name='state'))
+  return avg_prices.dropna()
+
+
+if __name__ == '__main__':
+  os.chdir(os.path.dirname(os.path.abspath(__file__)))
+  build_price_cube(['MidCase', 'MidCaseTCExpire', 'LowRECost', 'LowRECostTCExpire', 'HighRECost', 'HighNGPrice', 'LowNGPrice'])
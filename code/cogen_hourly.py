@@ -0,0 +1,268 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from multiprocessing import Pool, cpu_count
+import utils
+import demand_registry
+import deployment_model
+import solver_config
+import representative_periods
+import electricity_price_taker
+
+"""Hourly co-optimization of HTSE hydrogen production and grid electricity sales at the industrial sites.
+The ANR modules run at full output, each hour the electricity not used by the plant goes to the HTSE modules or is sold
+at the Cambium price of the state (or curtailed). A hydrogen storage decouples production from the delivery requirement
+of the plant: hourly (constant flow), daily or annual. For each ANR design the MILP (number of ANR and HTSE modules,
+storage capacity, hourly operation) is built as sparse arrays and solved with HiGHS through scipy, the cheapest design
+is kept. Screening runs use representative days (or weeks) of the prices.
+The power balance is at the site level: the H2 modules are not packed in the individual ANR modules as in the
+opt_deployment_* models."""
+
+H2_TECH = 'HTSE'
+H2_STORAGE_CAPEX = 500 # $/kg, compressed gas vessels
+H2_STORAGE_FOM = 0.02 # fraction of CAPEX per year
+H2_STORAGE_LIFE = 30 # years
+DELIVERY_MODES = ('hourly', 'daily', 'annual')
+INDUSTRIES = demand_registry.INDUSTRIES
+COGEN_HOURLY_RESULTS = './results/cogen_hourly'
+
+
+def get_storage_cost(wacc=utils.WACC):
+  """Annualized cost of the hydrogen storage ($/kg-year)"""
+  return H2_STORAGE_CAPEX*(deployment_model.compute_crf(wacc, H2_STORAGE_LIFE)+H2_STORAGE_FOM)
+
+
+def build_cogen_matrix(params, g, prices, weights, block_hours, h2_dem_kg_per_day, elec_dem_MWe, max_modules,
+                       delivery='daily'):
+  """Builds the co-optimization MILP of an ANR design as sparse arrays
+  Variables: number of ANR modules, number of HTSE modules, storage capacity (kg), then for each hour electrolysis
+  (MWe), grid sales (MWe), storage level (kg) and delivery (kg/h).
+  Args:
+    params (dict): from deployment_model.get_deployment_params
+    g (int): index of the ANR design
+    prices (ndarray): electricity prices of the modeled hours ($/MWhe), shape (T,)
+    weights (ndarray): hours of the year represented by each modeled hour, shape (T,)
+    block_hours (int): length of the cyclic storage blocks, T for a full year, the period length for representative periods
+    h2_dem_kg_per_day (float): hydrogen demand (kg/day)
+    elec_dem_MWe (float): electricity demand of the plant (MWe)
+    max_modules (int): maximum number of ANR modules
+    delivery (str): 'hourly', 'daily' or 'annual' delivery requirement
+  Returns:
+    matrix (dict): c, A, b_l, b_u, lb, ub, integrality and offsets of the hourly variables
+  """
+  assert delivery in DELIVERY_MODES, f'Unknown delivery {delivery}, expected one of {DELIVERY_MODES}'
+  T = len(prices)
+  h = params['H'].index(H2_TECH)
+  C = params['anr_cap'][g]
+  cap_elec = params['h2_cap_elec'][h,g]
+  eta = params['h2_cap_h2'][h]/cap_elec # kg/MWhe
+  iE, iS, iL, iD = 3, 3+T, 3+2*T, 3+3*T
+  n_vars = 3+4*T
+  t = np.arange(T)
+  rows, cols, values, b_l, b_u = [], [], [], [], []
+  def add_rows(row_ids, col_ids, vals):
+    rows.append(row_ids)
+    cols.append(col_ids)
+    values.append(np.broadcast_to(vals, np.shape(row_ids)).astype(float))
+  # Power balance: electrolysis + sales <= ANR output - plant demand
+  add_rows(t, iE+t, 1)
+  add_rows(t, iS+t, 1)
+  add_rows(t, np.zeros(T, dtype=int), -C)
+  b_l.append(np.full(T, -np.inf))
+  b_u.append(np.full(T, -elec_dem_MWe))
+  # Electrolysis capacity
+  add_rows(T+t, iE+t, 1)
+  add_rows(T+t, np.ones(T, dtype=int), -cap_elec)
+  b_l.append(np.full(T, -np.inf))
+  b_u.append(np.zeros(T))
+  # Storage balance, cyclic over each block
+  prev = np.where(t % block_hours == 0, t+block_hours-1, t-1)
+  add_rows(2*T+t, iL+t, 1)
+  add_rows(2*T+t, iL+prev, -1)
+  add_rows(2*T+t, iE+t, -eta)
+  add_rows(2*T+t, iD+t, 1)
+  b_l.append(np.zeros(T))
+  b_u.append(np.zeros(T))
+  # Storage capacity
+  add_rows(3*T+t, iL+t, 1)
+  add_rows(3*T+t, np.full(T, 2), -1)
+  b_l.append(np.full(T, -np.inf))
+  b_u.append(np.zeros(T))
+  n_rows = 4*T
+  if delivery == 'daily':
+    assert T % representative_periods.HOURS_PER_DAY == 0, 'Daily delivery requires whole days'
+    days = T//representative_periods.HOURS_PER_DAY
+    add_rows(n_rows+t//representative_periods.HOURS_PER_DAY, iD+t, 1)
+    b_l.append(np.full(days, h2_dem_kg_per_day))
+    b_u.append(np.full(days, h2_dem_kg_per_day))
+    n_rows += days
+  elif delivery == 'annual':
+    add_rows(np.full(T, n_rows), iD+t, weights)
+    b_l.append(np.array([h2_dem_kg_per_day*365]))
+    b_u.append(np.array([h2_dem_kg_per_day*365]))
+    n_rows += 1
+  A = sp.csr_array((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(n_rows, n_vars))
+
+  c = np.zeros(n_vars)
+  c[0] = params['module_cost'][g]
+  c[1] = cap_elec*(params['h2_capex'][h]*(1-utils.ITC_H2)*params['h2_crf'][h]+params['h2_fom'][h])
+  c[2] = get_storage_cost(params['wacc'])
+  c[iE:iS] = weights*params['h2_vom'][h]
+  c[iS:iL] = -weights*prices
+  lb = np.zeros(n_vars)
+  ub = np.full(n_vars, np.inf)
+  # Valid lower bounds from the average H2 production and electricity use, they tighten the LP relaxation
+  h2_MWe = h2_dem_kg_per_day/representative_periods.HOURS_PER_DAY/eta
+  lb[0] = min(np.ceil((h2_MWe+elec_dem_MWe)/C-1e-9), max_modules)
+  lb[1] = np.ceil(h2_MWe/cap_elec-1e-9)
+  ub[0] = max_modules
+  ub[1] = np.ceil(max_modules*C/cap_elec)
+  ub[iE:iL] = max_modules*C
+  if delivery == 'hourly':
+    lb[iD:] = ub[iD:] = h2_dem_kg_per_day/representative_periods.HOURS_PER_DAY
+  integrality = np.zeros(n_vars)
+  integrality[:2] = 1
+  return {'c':c, 'A':A, 'b_l':np.concatenate(b_l), 'b_u':np.concatenate(b_u), 'lb':lb, 'ub':ub,
+          'integrality':integrality, 'offsets':(iE, iS, iL, iD), 'T':T}
+
+
+def solve_cogen_design(params, g, prices, weights, block_hours, h2_dem_kg_per_day, elec_dem_MWe, max_modules,
+                       delivery='daily', options=None):
+  """Solves the co-optimization MILP of an ANR design
+  Returns:
+    solution (dict): objective ($/year), modules, storage capacity and hourly operation, None if infeasible
+  """
+  from scipy.optimize import milp, LinearConstraint, Bounds
+  matrix = build_cogen_matrix(params, g, prices, weights, block_hours, h2_dem_kg_per_day, elec_dem_MWe, max_modules,
+                              delivery)
+  res = milp(matrix['c'], constraints=LinearConstraint(matrix['A'], matrix['b_l'], matrix['b_u']),
+             integrality=matrix['integrality'], bounds=Bounds(matrix['lb'], matrix['ub']), options=options or {})
+  if res.x is None or res.status not in (0, 1):
+    return None
+  iE, iS, iL, iD = matrix['offsets']
+  x = res.x
+  return {'objective':res.fun, '# ANR modules':int(round(x[0])), 'HTSE modules':int(round(x[1])),
+          'storage (kg)':x[2], 'electrolysis':x[iE:iS], 'sales':np.maximum(x[iS:iL], 0), 'level':x[iL:iD],
+          'delivery':x[iD:]}
+
+
+def solve_site(industry, plant, ANR_data, H2_data, year=2024, scenario=None, delivery='daily', periods=None,
+               period_hours=representative_periods.HOURS_PER_DAY, solver='highs', wacc=utils.WACC):
+  """Co-optimizes HTSE hydrogen and grid sales at a site over all ANR designs
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant (str): plant id
+    ANR_data, H2_data (DataFrame): ANR and H2 data
+    year (int): year of the Cambium prices
+    scenario (str): Cambium scenario, default scenario of electricity_price_taker if None
+    delivery (str): 'hourly', 'daily' or 'annual' delivery requirement
+    periods (int): number of representative periods, None for the full year
+    period_hours (int): hours per representative period
+    solver (str): solver preset for the time limit and MIP gap
+    wacc (float): weighted average cost of capital
+  Returns:
+    results_ref (dict): results of the compile_*_results function of the industry with the hourly operation fields,
+      None if no design is feasible
+    hourly_df (DataFrame): hourly operation of the chosen design, on the representative hours if periods is set
+  """
+  start = time.time()
+  site = demand_registry.get_site(industry, plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  h = params['H'].index(H2_TECH)
+  prices = electricity_price_taker.get_electricity_prices(site['state'], year, scenario)['price'].to_numpy()
+  if periods:
+    clusters = representative_periods.cluster_periods(prices, periods, period_hours=period_hours)
+    prices, weights, block_hours = clusters['values'].ravel(), clusters['weights'].ravel(), period_hours
+  else:
+    weights, block_hours = np.ones(len(prices)), len(prices)
+  options = solver_config.get_scipy_options(solver)
+
+  best, best_g = None, None
+  for g in range(len(params['G'])):
+    if np.isnan(params['h2_cap_elec'][h,g]):
+      continue
+    solution = solve_cogen_design(params, g, prices, weights, block_hours, site['H2 demand (kg/day)'],
+                                  site['Electricity demand (MWe)'], site['max modules'], delivery, options)
+    if solution is not None and (best is None or solution['objective'] < best['objective']):
+      best, best_g = solution, g
+  if best is None:
+    print(f'{industry} {plant}: no feasible design')
+    return None, None
+
+  deployment = {'ANR type':params['G'][best_g], '# ANR modules':best['# ANR modules'],
+                'H2 modules':{tech:(best['HTSE modules'] if tech == H2_TECH else 0) for tech in params['H']}}
+  cap_elec = params['h2_cap_elec'][h,best_g]
+  sales = np.sum(weights*prices*best['sales'])
+  storage_costs = get_storage_cost(wacc)*best['storage (kg)']
+  # compile_*_results charges the H2 VOM at full load, replaced by the VOM of the hourly electrolysis
+  h2_vom_adjustment = params['h2_vom'][h]*(best['HTSE modules']*cap_elec*deployment_model.HOURS_PER_YEAR
+                                           -np.sum(weights*best['electrolysis']))
+  results_ref = site['compile results'](plant, ANR_data, H2_data, deployment, wacc=wacc,
+                                        other_revenues=sales-storage_costs+h2_vom_adjustment)
+  results_ref['Electricity sales ($/year)'] = sales
+  results_ref['H2 storage capacity (kg)'] = best['storage (kg)']
+  results_ref['H2 storage costs ($/year)'] = storage_costs
+  results_ref['H2 VOM adjustment ($/year)'] = h2_vom_adjustment
+  electrolysis_cap = best['HTSE modules']*cap_elec
+  results_ref['Electrolysis capacity factor'] = np.sum(weights*best['electrolysis'])/(electrolysis_cap*weights.sum())\
+                                                if electrolysis_cap > 0 else 0
+  results_ref['Delivery'] = delivery
+  results_ref['Periods'] = periods or 0
+  results_ref['Solve time (s)'] = time.time()-start
+  hourly_df = pd.DataFrame({'price ($/MWhe)':prices, 'weight (h)':weights, 'Electrolysis (MWe)':best['electrolysis'],
+                            'Grid sales (MWe)':best['sales'],
+                            'H2 production (kg/h)':best['electrolysis']*params['h2_cap_h2'][h]/cap_elec,
+                            'H2 delivery (kg/h)':best['delivery'], 'H2 storage (kg)':best['level']},
+                           index=pd.RangeIndex(len(prices), name='t'))
+  return results_ref, hourly_df
+
+
+def main(industries=INDUSTRIES, anr_tag='FOAK', year=2024, scenario=None, delivery='daily', periods=None,
+         period_hours=representative_periods.HOURS_PER_DAY, solver='highs', workers=None, save_hourly=True):
+  """Co-optimizes all sites of the industries, results in COGEN_HOURLY_RESULTS
+  Returns:
+    results (dict): industry to results DataFrame
+  """
+  ANR_data, H2_data = utils.load_data(anr_tag=anr_tag)
+  registry = demand_registry.get_registry(list(industries))
+  tasks = [(industry, plant, ANR_data, H2_data, year, scenario, delivery, periods, period_hours, solver)
+           for industry in industries for plant in demand_registry.get_plant_ids(industry)]
+  start = time.time()
+  with Pool(workers or cpu_count(), initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+    outputs = pool.starmap(solve_site, tasks)
+  print(f'{len(tasks)} sites solved in {time.time()-start:.1f} s')
+
+  os.makedirs(COGEN_HOURLY_RESULTS, exist_ok=True)
+  label = f'{anr_tag}_{scenario or electricity_price_taker.cambium_scenario}_{year}_{delivery}'+(f'_{periods}p' if periods else '')
+  results, hourly = {}, []
+  for industry in industries:
+    results[industry] = pd.DataFrame([results_ref for task, (results_ref, _) in zip(tasks, outputs)
+                                      if task[0] == industry and results_ref is not None])
+  with pd.ExcelWriter(os.path.join(COGEN_HOURLY_RESULTS, f'results_{label}.xlsx')) as writer:
+    for industry, df in results.items():
+      df.to_excel(writer, sheet_name=industry, index=False)
+  if save_hourly:
+    for task, (_, hourly_df) in zip(tasks, outputs):
+      if hourly_df is not None:
+        hourly.append(hourly_df.reset_index().assign(industry=task[0], plant=str(task[1])))
+    pd.concat(hourly, ignore_index=True).to_parquet(os.path.join(COGEN_HOURLY_RESULTS, f'hourly_{label}.parquet'))
+  return results
+
+
+if __name__ == '__main__':
+  os.chdir(os.path.dirname(os.path.abspath(__file__)))
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-i', '--industries', nargs='+', default=INDUSTRIES, help='Industries to co-optimize')
+  parser.add_argument('-t', '--tag', default='FOAK', help='ANR tag: FOAK or NOAK')
+  parser.add_argument('-y', '--year', type=int, default=2024, help='Year of the Cambium prices')
+  parser.add_argument('--scenario', required=False, help='Cambium scenario')
+  parser.add_argument('-d', '--delivery', default='daily', choices=DELIVERY_MODES, help='H2 delivery requirement')
+  parser.add_argument('--periods', required=False, type=int, help='Screening run on k representative periods of the prices')
+  parser.add_argument('--period-hours', required=False, type=int, default=24, help='Hours per representative period: 24 (days) or 168 (weeks)')
+  parser.add_argument('-s', '--solver', default='highs', help='Solver preset for the time limit and MIP gap')
+  args = parser.parse_args()
+  main(industries=args.industries, anr_tag=args.tag, year=args.year, scenario=args.scenario, delivery=args.delivery,
+       periods=args.periods, period_hours=args.period_hours, solver=args.solver)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import utils
+import deployment_model
+
+"""Vectorized cost model of the ANR-H2 designs: learned CAPEX, CRF and LCOH computed at once on broadcast arrays over
+(ANR design, H2 technology, learning rate, cumulative number of units N, WACC), returned as labeled cubes.
+The learning curve is the one of utils.update_capex_costs: CAPEX(N) = CAPEX FOAK*N**log2(1-learning rate).
+The LCOH is the one of compute_plot_lcoh.ipynb: an ANR module and H2 modules of the same electric capacity, running
+all year."""
+
+DIMS = ['Reactor', 'H2 tech', 'LR (%)', 'N', 'WACC']
+
+
+def learned_capex(capex_foak, learning_rate, N=utils.N):
+  """CAPEX after N units with a learning rate (fraction of cost reduction per doubling), broadcast"""
+  return capex_foak*np.power(N, np.log2(1-np.asarray(learning_rate, dtype=np.float64)))
+
+
+def get_cost_arrays(ANR_data, H2_data):
+  """Cost parameters of the designs and H2 technologies as arrays
+  Returns:
+    arrays (dict): 'Reactor' (G,) and 'H2 tech' (H,) names, ANR 'Power in MWe', 'CAPEX $/MWe', 'FOPEX $/MWe-y',
+      'VOM in $/MWh-e', 'Life (y)' of shape (G,), H2 'CAPEX ($/MWe)', 'FOM ($/MWe-year)', 'VOM ($/MWhe)',
+      'H2 Life (y)' of shape (H,) and 'H2 eff (kgh2/MWhe)' of shape (H, G)
+  """
+  reactors = list(ANR_data.index)
+  techs = list(dict.fromkeys(H2_data.index.get_level_values(0)))
+  arrays = {'Reactor':reactors, 'H2 tech':techs}
+  for col in ['Power in MWe', 'CAPEX $/MWe', 'FOPEX $/MWe-y', 'VOM in $/MWh-e', 'Life (y)']:
+    arrays[col] = ANR_data[col].to_numpy(dtype=np.float64)
+  h2_tech_data = H2_data.groupby(level=0, sort=False).first().loc[techs]
+  for col in ['CAPEX ($/MWe)', 'FOM ($/MWe-year)', 'VOM ($/MWhe)']:
+    arrays[col] = h2_tech_data[col].to_numpy(dtype=np.float64)
+  arrays['H2 Life (y)'] = h2_tech_data['Life (y)'].to_numpy(dtype=np.float64)
+  efficiency = H2_data['H2Cap (kgh2/h)']/H2_data['H2Cap (MWe)']
+  arrays['H2 eff (kgh2/MWhe)'] = np.array([[efficiency.get((h, r), np.nan) for r in reactors] for h in techs])
+  return arrays
+
+
+def compute_cost_cubes(ANR_data, H2_data, learning_rates=(0.,), N=utils.N, wacc=utils.WACC, h2_learning_rate=0.):
+  """Learned CAPEX, CRF and LCOH over (Reactor, H2 tech, LR, N, WACC), all of 5 dimensions with size 1 on the
+  dimensions they do not depend on
+  Args:
+    ANR_data (DataFrame): ANR parameters
+    H2_data (DataFrame): H2 technologies parameters
+    learning_rates (array): learning rates of the ANR CAPEX
+    N (array): cumulative numbers of units
+    wacc (array): WACC
+    h2_learning_rate (float): learning rate of the H2 CAPEX, applied with the same N
+  Returns:
+    cubes (dict): 'coords' (dimension name to values), 'ANR CAPEX ($/MWe)', 'H2 CAPEX ($/MWe)', 'ANR CRF', 'H2 CRF',
+      'ANR cost ($/year)', 'H2 cost ($/year)' and 'LCOH ($/kg)' arrays
+  """
+  arrays = get_cost_arrays(ANR_data, H2_data)
+  coords = {'Reactor':arrays['Reactor'], 'H2 tech':arrays['H2 tech'],
+            'LR (%)':np.atleast_1d(np.asarray(learning_rates, dtype=np.float64)),
+            'N':np.atleast_1d(np.asarray(N, dtype=np.float64)), 'WACC':np.atleast_1d(np.asarray(wacc, dtype=np.float64))}
+  def on_axis(array, axis):
+    return np.asarray(array, dtype=np.float64).reshape((1,)*axis+(-1,)+(1,)*(len(DIMS)-1-axis))
+  lr, n, w = on_axis(coords['LR (%)'], 2), on_axis(coords['N'], 3), on_axis(coords['WACC'], 4)
+  power = on_axis(arrays['Power in MWe'], 0)
+
+  cubes = {'coords':coords}
+  cubes['ANR CAPEX ($/MWe)'] = learned_capex(on_axis(arrays['CAPEX $/MWe'], 0), lr, n)
+  cubes['H2 CAPEX ($/MWe)'] = learned_capex(on_axis(arrays['CAPEX ($/MWe)'], 1), h2_learning_rate, n)
+  cubes['ANR CRF'] = deployment_model.compute_crf(w, on_axis(arrays['Life (y)'], 0))
+  cubes['H2 CRF'] = deployment_model.compute_crf(w, on_axis(arrays['H2 Life (y)'], 1))
+  cubes['ANR cost ($/year)'] = power*(cubes['ANR CAPEX ($/MWe)']*cubes['ANR CRF']+on_axis(arrays['FOPEX $/MWe-y'], 0)
+                                      +on_axis(arrays['VOM in $/MWh-e'], 0)*deployment_model.HOURS_PER_YEAR)
+  cubes['H2 cost ($/year)'] = power*(cubes['H2 CAPEX ($/MWe)']*cubes['H2 CRF']+on_axis(arrays['FOM ($/MWe-year)'], 1)
+                                     +on_axis(arrays['VOM ($/MWhe)'], 1)*deployment_model.HOURS_PER_YEAR)
+  efficiency = arrays['H2 eff (kgh2/MWhe)'].T.reshape(len(coords['Reactor']), len(coords['H2 tech']), 1, 1, 1)
+  cubes['LCOH ($/kg)'] = (cubes['ANR cost ($/year)']+cubes['H2 cost ($/year)'])\
+                         /(efficiency*deployment_model.HOURS_PER_YEAR*power)
+  return cubes
+
+
+def label_cube(values, coords, name, as_frame=False):
+  """Labeled cube of an array broadcast to all the dimensions of coords
+  Args:
+    values (ndarray): array of len(coords) dimensions, broadcastable to the coords sizes
+    coords (dict): dimension name to values
+    name (str): name of the values
+    as_frame (bool): if True or xarray is not installed, DataFrame with one row per point and a MultiIndex
+  Returns:
+    cube (xarray.DataArray or DataFrame): labeled values
+  """
+  values = np.broadcast_to(values, tuple(len(v) for v in coords.values()))
+  if not as_frame:
+    try:
+      import xarray as xr
+      return xr.DataArray(values, coords=coords, dims=list(coords), name=name)
+    except ImportError:
+      pass
+  index = pd.MultiIndex.from_product(list(coords.values()), names=list(coords))
+  return pd.DataFrame({name:values.ravel()}, index=index)
+
+
+def compute_lcoh_cube(ANR_data, H2_data, learning_rates=(0.,), N=utils.N, wacc=utils.WACC, h2_learning_rate=0.,
+                      as_frame=False):
+  """Labeled LCOH ($/kg) cube over (Reactor, H2 tech, LR (%), N, WACC), see compute_cost_cubes and label_cube"""
+  cubes = compute_cost_cubes(ANR_data, H2_data, learning_rates, N, wacc, h2_learning_rate)
+  return label_cube(cubes['LCOH ($/kg)'], cubes['coords'], 'LCOH ($/kg)', as_frame=as_frame)
@@ -0,0 +1,96 @@
+from utils import read_excel_cached
+
+"""Registry of the processed plant-level demand sheets used by the opt_deployment_* scripts.
+Each sheet is parsed once per process and indexed by plant id, so that per-plant lookups do not re-read the workbooks.
+Pool workers receive the loaded registry through init_registry (used as Pool initializer)."""
+
+DEMAND_SHEET = 'processed'
+DEMAND_SOURCES = {'ammonia': {'path':'./h2_demand_ammonia_us_2022.xlsx', 'id_col':'id', 'state_col':'State'},
+                  'steel': {'path':'./h2_demand_bfbof_steel_us_2022.xlsx', 'id_col':'Plant', 'state_col':'STATE'},
+                  'refining': {'path':'./h2_demand_refineries.xlsx', 'id_col':'refinery_id', 'state_col':'state'}}
+INDUSTRIES = tuple(DEMAND_SOURCES)
+
+_registry = {}
+
+
+def load_demand(industry):
+  """Loads the processed demand sheet of an industry, only parsed at the first call in a process
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+  Returns:
+    demand_df (DataFrame): processed demand data indexed by plant id, in the order of the workbook
+  """
+  if industry not in _registry:
+    source = DEMAND_SOURCES[industry]
+    demand_df = read_excel_cached(source['path'], sheet_name=DEMAND_SHEET)
+    demand_df.set_index(source['id_col'], drop=False, inplace=True)
+    # Keep the first row for duplicated ids, as the previous per-plant lookups did
+    rows = demand_df[~demand_df.index.duplicated(keep='first')].to_dict(orient='index')
+    _registry[industry] = {'data':demand_df, 'rows':rows}
+  return _registry[industry]['data']
+
+
+def get_plant(industry, plant):
+  """Returns the demand data of one plant
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant (str): plant id
+  Returns:
+    row (dict): column name to value for the plant
+  """
+  load_demand(industry)
+  return _registry[industry]['rows'][plant]
+
+
+def get_plant_ids(industry):
+  """Returns the list of plant ids of an industry in the order of the workbook"""
+  return list(load_demand(industry)[DEMAND_SOURCES[industry]['id_col']])
+
+
+def get_states(industry):
+  """Returns the sorted abbreviations of the states with at least one plant of an industry"""
+  return sorted(set(load_demand(industry)[DEMAND_SOURCES[industry]['state_col']].dropna()))
+
+
+def get_site(industry, plant):
+  """Demand and results function of a site of an industry, the opt_deployment_* script of the industry is imported at the first call
+  Returns:
+    site (dict): 'H2 demand (kg/day)', 'Electricity demand (MWe)', 'state', 'max modules' and 'compile results', the
+      compile_*_results function of the industry
+  """
+  if industry == 'ammonia':
+    import opt_deployment_ammonia as module
+    _, h2_dem_kg_per_day, elec_dem_MWe, state, _, _ = module.get_ammonia_plant_demand(plant)
+    compile_results = module.compile_ammonia_results
+  elif industry == 'steel':
+    import opt_deployment_steel as module
+    _, h2_dem_kg_per_day, elec_dem_MWe = module.get_steel_plant_demand(plant)
+    state = module.get_state(plant)
+    compile_results = module.compile_steel_results
+  elif industry == 'refining':
+    import opt_deployment_refining as module
+    # No electricity demand at refineries, as in opt_deployment_refining
+    h2_dem_kg_per_day, elec_dem_MWe = module.get_refinery_demand(plant), 0
+    state = module.get_state(plant)
+    compile_results = module.compile_refinery_results
+  else:
+    raise ValueError(f'Unknown industry {industry}, expected one of {INDUSTRIES}')
+  return {'H2 demand (kg/day)':h2_dem_kg_per_day, 'Electricity demand (MWe)':elec_dem_MWe, 'state':state,
+          'max modules':module.MaxANRMod, 'compile results':compile_results}
+
+
+def get_registry(industries=None):
+  """Loads and returns the registry to pass to Pool workers through init_registry
+  Args:
+    industries (list[str]): industries to load, all by default
+  Returns:
+    registry (dict): loaded demand data per industry
+  """
+  for industry in (industries or DEMAND_SOURCES.keys()):
+    load_demand(industry)
+  return _registry
+
+
+def init_registry(registry):
+  """Pool initializer: installs a registry loaded in the parent process"""
+  _registry.update(registry)
@@ -0,0 +1,583 @@
+import numpy as np
+import pandas as pd
+import time
+import utils
+import solver_config
+
+"""Shared pieces of the ANR-H2 deployment models of the opt_deployment_* scripts:
+- techno-economic parameters of the designs as NumPy arrays,
+- costs of a deployment (ANR design, number of modules and number of H2 modules of each technology),
+- direct sparse matrix build of the deployment MILP, solved with HiGHS through scipy without Pyomo expressions."""
+
+HOURS_PER_YEAR = 365*24
+# 'slots': interchangeable module slots, 'ordered': built modules occupy the first slots (symmetry breaking)
+FORMULATIONS = ('slots', 'ordered')
+# Version of the deployment models and results, part of the results cache key with the hash of this file (see
+# results_cache.get_source_hashes): increase when the results change without a change of the hashed files
+FORMULATION_VERSION = 1
+
+
+def compute_crf(wacc, life):
+  return wacc / (1 - (1/(1+wacc)**life))
+
+
+def get_deployment_params(ANR_data, H2_data, wacc=utils.WACC):
+  """Collects the ANR and H2 parameters of the deployment models as arrays
+  Args:
+    ANR_data (DataFrame): ANR parameters indexed by design
+    H2_data (DataFrame): H2 technologies parameters indexed by (technology, design)
+    wacc (float): weighted average cost of capital
+  Returns:
+    params (dict): designs 'G' and H2 technologies 'H' labels, arrays indexed by g, h or (h,g), and annualized
+      costs per ANR module 'module_cost' (g) and per H2 module 'h2_unit_cost' (h,g)
+  """
+  G = list(ANR_data.index)
+  H = list(H2_data.index.unique(level=0))
+  # Positions of the rows of H2_data in the (h,g) arrays, per-technology values are taken from the last row
+  h_idx = pd.Index(H).get_indexer(H2_data.index.get_level_values(0))
+  g_idx = pd.Index(G).get_indexer(H2_data.index.get_level_values(1))
+  def h2_tech_array(col):
+    values = np.zeros(len(H))
+    values[h_idx] = H2_data[col].to_numpy(dtype=float)
+    return values
+  def h2_design_array(col):
+    values = np.full((len(H), len(G)), np.nan)
+    values[h_idx, g_idx] = H2_data[col].to_numpy(dtype=float)
+    return values
+  h2_life = np.bincount(h_idx, weights=H2_data['Life (y)'].to_numpy(dtype=float))/np.bincount(h_idx)
+  params = {'G':G, 'H':H, 'wacc':wacc}
+  params['anr_cap'] = ANR_data['Power in MWe'].to_numpy(dtype=float)
+  params['anr_th_eff'] = (ANR_data['Power in MWe']/ANR_data['Power in MWt']).to_numpy(dtype=float)
+  params['anr_capex'] = ANR_data['CAPEX $/MWe'].to_numpy(dtype=float)
+  params['anr_fom'] = ANR_data['FOPEX $/MWe-y'].to_numpy(dtype=float)
+  params['anr_vom'] = ANR_data['VOM in $/MWh-e'].to_numpy(dtype=float)
+  params['anr_crf'] = compute_crf(wacc, ANR_data['Life (y)'].to_numpy(dtype=float))
+  params['h2_cap_h2'] = h2_tech_array('H2Cap (kgh2/h)')
+  params['h2_capex'] = h2_tech_array('CAPEX ($/MWe)')
+  params['h2_fom'] = h2_tech_array('FOM ($/MWe-year)')
+  params['h2_vom'] = h2_tech_array('VOM ($/MWhe)')
+  params['h2_crf'] = compute_crf(wacc, h2_life)
+  params['h2_cap_elec'] = h2_design_array('H2Cap (MWe)')
+  params['h2_carbon_int'] = h2_design_array('Carbon intensity (kgCO2eq/kgH2)')
+  params['module_cost'] = params['anr_cap']*((params['anr_capex']*(1-utils.ITC_ANR)*params['anr_crf']+params['anr_fom'])\
+                                             +params['anr_vom']*HOURS_PER_YEAR)
+  params['h2_unit_cost'] = params['h2_cap_elec']*(params['h2_capex']*(1-utils.ITC_H2)*params['h2_crf']+params['h2_fom']\
+                                                  +params['h2_vom']*HOURS_PER_YEAR)[:,None]
+  return params
+
+
+def compute_deployment_costs(params, deployment):
+  """Annualized costs and characteristics of a deployment
+  Args:
+    params (dict): from get_deployment_params
+    deployment (dict): 'ANR type' (str), '# ANR modules' (int) and 'H2 modules' (dict, technology to number of modules)
+  Returns:
+    costs (dict): annualized ANR and H2 CAPEX and O&M ($/year), initial investments ($), deployed capacities (MWe),
+      H2 production emissions (kgCO2eq/year)
+  """
+  g = params['G'].index(deployment['ANR type'])
+  n = deployment['# ANR modules']
+  q = np.array([deployment['H2 modules'][h] for h in params['H']], dtype=float)
+  cap_elec = params['h2_cap_elec'][:,g]
+  costs = {}
+  costs['ANR CAPEX ($/MWe)'] = params['anr_capex'][g]
+  costs['ANR CRF'] = params['anr_crf'][g]
+  costs['ANR CAPEX ($/year)'] = n*params['anr_cap'][g]*params['anr_capex'][g]*(1-utils.ITC_ANR)*params['anr_crf'][g]
+  costs['ANR O&M ($/year)'] = n*params['anr_cap'][g]*(params['anr_fom'][g]+params['anr_vom'][g]*HOURS_PER_YEAR)
+  costs['H2 CAPEX ($/year)'] = np.sum(cap_elec*q*params['h2_capex']*(1-utils.ITC_H2)*params['h2_crf'])
+  costs['H2 O&M ($/year)'] = np.sum(cap_elec*q*(params['h2_fom']+params['h2_vom']*HOURS_PER_YEAR))
+  costs['ANR investment ($)'] = n*params['anr_cap'][g]*params['anr_capex'][g]*(1-utils.ITC_ANR)
+  costs['H2 investment ($)'] = np.sum(cap_elec*q*params['h2_capex']*(1-utils.ITC_H2))
+  costs['Depl. ANR Cap. (MWe)'] = n*params['anr_cap'][g]
+  costs['Depl H2 Cap. (MWe)'] = np.sum(cap_elec*q)
+  costs['H2 CO2 emissions (kgCO2eq/year)'] = np.sum(params['h2_carbon_int'][:,g]*q*params['h2_cap_h2']*24*365)
+  costs['Total costs ($/year)'] = costs['ANR CAPEX ($/year)']+costs['ANR O&M ($/year)']+costs['H2 CAPEX ($/year)']\
+                                  +costs['H2 O&M ($/year)']
+  return costs
+
+
+def extract_deployment(model):
+  """Reads the deployment from a solved slot-based Pyomo deployment model (variables vS, vM, vQ)
+  Returns:
+    deployment (dict): 'ANR type', '# ANR modules' and 'H2 modules', None if no design was chosen
+  """
+  from pyomo.environ import value
+  for g in model.G:
+    if round(value(model.vS[g])) >= 1:
+      built = [n for n in model.N if round(value(model.vM[n,g])) >= 1]
+      h2_modules = {h:int(sum(round(value(model.vQ[n,h,g])) for n in built)) for h in model.H}
+      return {'ANR type':g, '# ANR modules':len(built), 'H2 modules':h2_modules}
+  return None
+
+
+def add_symmetry_breaking(model):
+  """Adds ordering constraints on the module slots of a slot-based deployment model: the built modules of the chosen
+  design occupy the first slots. Any solution is a permutation of an ordered one, so the optimum is unchanged while the
+  equivalent permutations of the slots are cut off. Ordering the modules by load as well slows down the solvers.
+  Args:
+    model (ConcreteModel): deployment model with sets N, G and variable vM
+  Returns:
+    None
+  """
+  from pyomo.environ import Constraint
+  last_slot = max(model.N)
+
+  def order_modules(model, n, g):
+    if n == last_slot:
+      return Constraint.Skip
+    return model.vM[n+1,g] <= model.vM[n,g]
+  model.order_modules = Constraint(model.N, model.G, rule=order_modules)
+
+
+def build_deployment_matrix(params, h2_dem_kg_per_day, elec_dem_MWe, max_modules, plant_balance=True, formulation='slots'):
+  """Builds the slot-based deployment MILP of the opt_deployment_* scripts directly as sparse arrays.
+  Variables are ordered as vS[g], vM[n,g], vQ[n,h,g], the objective minimizes the annualized ANR-H2 costs.
+  Args:
+    params (dict): from get_deployment_params
+    h2_dem_kg_per_day (float): hydrogen demand (kg/day)
+    elec_dem_MWe (float): auxiliary electricity demand met by the ANRs (MWe)
+    max_modules (int): number of ANR module slots
+    plant_balance (bool): if True include the plant-level energy balance with auxiliary electricity demand
+    formulation (str): 'slots' or 'ordered' to add the ordering constraints of add_symmetry_breaking
+  Returns:
+    matrix (dict): cost vector 'c', constraint matrix 'A' (csr) with bounds 'b_l', 'b_u', variable bounds 'lb', 'ub',
+      'integrality', dimensions and build time 'build_time'
+  """
+  from scipy.sparse import coo_matrix
+  start = time.time()
+  nG, nH, nN = len(params['G']), len(params['H']), max_modules
+  n_g, g_n = np.meshgrid(np.arange(nN), np.arange(nG), indexing='ij')
+  n_q, h_q, g_q = np.meshgrid(np.arange(nN), np.arange(nH), np.arange(nG), indexing='ij')
+  n_g, g_n, n_q, h_q, g_q = n_g.ravel(), g_n.ravel(), n_q.ravel(), h_q.ravel(), g_q.ravel()
+  idx_s = np.arange(nG)
+  idx_m = nG + n_g*nG + g_n
+  idx_q = nG + nN*nG + (n_q*nH + h_q)*nG + g_q
+  n_vars = nG + nN*nG + nN*nH*nG
+
+  c = np.zeros(n_vars)
+  c[idx_m] = params['module_cost'][g_n]
+  c[idx_q] = params['h2_unit_cost'][h_q, g_q]
+
+  rows, cols, vals, b_l, b_u = [], [], [], [], []
+  def add_rows(row_ids, col_ids, values):
+    rows.append(row_ids); cols.append(col_ids); vals.append(np.broadcast_to(values, np.shape(col_ids)).astype(float))
+  # Meet hydrogen demand
+  add_rows(np.zeros(len(idx_q), dtype=int), idx_q, params['h2_cap_h2'][h_q]*24)
+  b_l.append([h2_dem_kg_per_day]); b_u.append([np.inf])
+  # Only one type of ANR deployed
+  add_rows(np.ones(nG, dtype=int), idx_s, 1)
+  b_l.append([-np.inf]); b_u.append([1])
+  # Only build ANR modules of the chosen type: vM[n,g] - vS[g] <= 0
+  first = 2
+  add_rows(first + np.arange(nN*nG), idx_m, 1)
+  add_rows(first + np.arange(nN*nG), idx_s[g_n], -1)
+  b_l.append(np.full(nN*nG, -np.inf)); b_u.append(np.zeros(nN*nG))
+  # Energy balance at the ANR module level
+  first += nN*nG
+  add_rows(first + n_q*nG + g_q, idx_q, params['h2_cap_elec'][h_q, g_q])
+  add_rows(first + np.arange(nN*nG), idx_m, -params['anr_cap'][g_n])
+  b_l.append(np.full(nN*nG, -np.inf)); b_u.append(np.zeros(nN*nG))
+  n_rows = first + nN*nG
+  # Energy balance at the plant level including auxiliary electricity demand
+  if plant_balance:
+    add_rows(n_rows + g_q, idx_q, params['h2_cap_elec'][h_q, g_q])
+    add_rows(n_rows + idx_s, idx_s, elec_dem_MWe)
+    add_rows(n_rows + g_n, idx_m, -params['anr_cap'][g_n])
+    b_l.append(np.full(nG, -np.inf)); b_u.append(np.zeros(nG))
+    n_rows += nG
+  # Symmetry breaking: vM[n+1,g] <= vM[n,g]
+  if formulation == 'ordered':
+    m_next = n_g < nN-1
+    row_ids = n_rows + n_g[m_next]*nG + g_n[m_next]
+    add_rows(row_ids, idx_m[m_next]+nG, 1)
+    add_rows(row_ids, idx_m[m_next], -1)
+    n_rows += (nN-1)*nG
+    b_l.append(np.full((nN-1)*nG, -np.inf)); b_u.append(np.zeros((nN-1)*nG))
+  else:
+    assert formulation == 'slots', f'Unknown formulation {formulation}, expected one of {FORMULATIONS}'
+
+  A = coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n_rows, n_vars)).tocsr()
+  ub = np.full(n_vars, np.inf)
+  ub[:nG + nN*nG] = 1
+  matrix = {'c':c, 'A':A, 'b_l':np.concatenate(b_l).astype(float), 'b_u':np.concatenate(b_u).astype(float),
+            'lb':np.zeros(n_vars), 'ub':ub, 'integrality':np.ones(n_vars), 'nG':nG, 'nH':nH, 'nN':nN,
+            'build_time':time.time()-start}
+  return matrix
+
+
+def solve_deployment_matrix(params, matrix, options=None):
+  """Solves a deployment MILP built by build_deployment_matrix with scipy's HiGHS interface
+  Args:
+    params (dict): from get_deployment_params
+    matrix (dict): from build_deployment_matrix
+    options (dict): options passed to scipy.optimize.milp, e.g. time_limit, mip_rel_gap
+  Returns:
+    deployment (dict): 'ANR type', '# ANR modules', 'H2 modules' and 'Solve time (s)', None if not solved to optimality
+  """
+  from scipy.optimize import milp, LinearConstraint, Bounds
+  start = time.time()
+  res = milp(matrix['c'], constraints=LinearConstraint(matrix['A'], matrix['b_l'], matrix['b_u']),
+             integrality=matrix['integrality'], bounds=Bounds(matrix['lb'], matrix['ub']), options=options or {})
+  solve_time = time.time()-start
+  if res.status != 0:
+    return None
+  nG, nH, nN = matrix['nG'], matrix['nH'], matrix['nN']
+  x = np.round(res.x)
+  vS = x[:nG]
+  vM = x[nG:nG+nN*nG].reshape(nN, nG)
+  vQ = x[nG+nN*nG:].reshape(nN, nH, nG)
+  if vS.max() < 1:
+    return None
+  g = int(np.argmax(vS))
+  built = vM[:,g] >= 1
+  h2_modules = {h:int(vQ[built, i, g].sum()) for i, h in enumerate(params['H'])}
+  return {'ANR type':params['G'][g], '# ANR modules':int(built.sum()), 'H2 modules':h2_modules, 'Solve time (s)':solve_time}
+
+
+def _max_fill_capacity(C, s_a, s_m, shape, n_bins, eps):
+  """Maximum number of modules of the main H2 technology that fit in k identical ANR modules of capacity C together
+  with every distribution of the other H2 modules, for k = 1..n_bins
+  Args:
+    C (float): ANR module capacity (MWe)
+    s_a (float): size of the main H2 module (MWe)
+    s_m (np.ndarray): sizes of the other H2 modules (MWe)
+    shape (tuple): numbers of other H2 modules considered + 1, per technology
+    n_bins (int): maximum number of ANR modules
+  Returns:
+    fill (list): fill[k] array of shape 'shape', -1 where the other modules do not fit in k ANR modules
+  """
+  grid = np.indices(shape).reshape(len(shape), -1).T
+  fits = grid@s_m <= C+eps
+  patterns, loads = grid[fits], grid[fits]@s_m
+  values = np.floor((C-loads)/s_a+eps)
+  F = np.full(shape, -np.inf)
+  F[(0,)*len(shape)] = 0
+  fill = [F]
+  for k in range(n_bins):
+    new_F = np.full(shape, -np.inf)
+    for u, v in zip(patterns, values):
+      dst = tuple(slice(int(x), None) for x in u)
+      src = tuple(slice(0, n-int(x)) for n, x in zip(shape, u))
+      np.maximum(new_F[dst], F[src]+v, out=new_F[dst])
+    F = new_F
+    fill.append(F)
+  return fill
+
+
+def fast_solve(params, h2_dem_kg_per_day, elec_dem_MWe, max_modules, eps=1e-9):
+  """Exact solution of the deployment MILP without a MILP solver, by enumeration of the ANR designs and numbers of modules.
+  For a design, the H2 technology with the lowest cost per kg is the main one. The numbers of modules of the other
+  technologies are bounded by their extra cost per kg and extra electricity per kg compared to the main one, and the
+  packing of the H2 modules in the ANR modules is checked exactly.
+  Args:
+    params (dict): from get_deployment_params
+    h2_dem_kg_per_day (float): hydrogen demand (kg/day)
+    elec_dem_MWe (float): auxiliary electricity demand met by the ANRs (MWe), 0 if there is no plant-level balance
+    max_modules (int): maximum number of ANR modules
+  Returns:
+    deployment (dict): 'ANR type', '# ANR modules', 'H2 modules' and 'Solve time (s)', None if infeasible
+  """
+  start = time.time()
+  D, E = h2_dem_kg_per_day, elec_dem_MWe
+  r = params['h2_cap_h2']*24
+  nH = len(params['H'])
+
+  # Upper bound on the costs with only the main H2 technology
+  U = np.inf
+  for g in range(len(params['G'])):
+    C, s, k = params['anr_cap'][g], params['h2_cap_elec'][:,g], params['h2_unit_cost'][:,g]
+    a = int(np.argmin(k/r))
+    q_a = max(0, np.ceil(D/r[a]-eps))
+    per_module = np.floor(C/s[a]+eps)
+    if per_module == 0:
+      continue
+    N = max(1, np.ceil(q_a/per_module), np.ceil((s[a]*q_a+E)/C-eps))
+    if N <= max_modules:
+      U = min(U, params['module_cost'][g]*N+k[a]*q_a)
+
+  best = None
+  for g in range(len(params['G'])):
+    C, s, k, k_g = params['anr_cap'][g], params['h2_cap_elec'][:,g], params['h2_unit_cost'][:,g], params['module_cost'][g]
+    a = int(np.argmin(k/r))
+    m = [h for h in range(nH) if h != a]
+    cost_slope = k[m]-k[a]*r[m]/r[a]
+    elec_slope = s[m]-s[a]*r[m]/r[a]
+    N_values = np.arange(max(1, np.ceil((E+D*np.min(s/r))/C-eps)), max_modules+1)
+    LB = k_g*N_values+k[a]*D/r[a]
+    N_values = N_values[LB <= U*(1+eps)]
+    if len(N_values) == 0:
+      continue
+    # Numbers of modules of the other technologies worth considering
+    bounds = np.minimum(np.ceil(D/r[m]), N_values[-1]*np.floor(C/s[m]+eps))
+    for j in range(len(m)):
+      # Electricity freed at most by the technologies using less electricity per kg than the main one
+      elec_credit = -np.sum(np.minimum(elec_slope, 0)*bounds)
+      n_max = np.zeros(len(N_values))
+      for i, N in enumerate(N_values):
+        n_max[i] = bounds[j]
+        if cost_slope[j] > 0 and U < np.inf:
+          n_max[i] = min(n_max[i], np.floor((U-k_g*N-k[a]*D/r[a])/cost_slope[j]*(1+eps)+eps))
+        if elec_slope[j] > 0:
+          n_max[i] = min(n_max[i], np.floor((N*C-E-s[a]*D/r[a]+elec_credit)/elec_slope[j]+eps))
+      bounds[j] = max(0, n_max.max())
+    shape = tuple(int(b)+1 for b in bounds)
+    fill = _max_fill_capacity(C, s[a], s[m], shape, int(N_values[-1]), eps)
+    grid = np.indices(shape).reshape(len(shape), -1).T
+    q_a = np.maximum(0, np.ceil((D-grid@r[m])/r[a]-eps))
+    h2_elec = s[a]*q_a+grid@s[m]
+    h2_costs = k[a]*q_a+grid@k[m]
+    for N in N_values:
+      feasible = (fill[int(N)].ravel() >= q_a) & (h2_elec+E <= N*C+eps)
+      if not feasible.any():
+        continue
+      costs = np.where(feasible, k_g*N+h2_costs, np.inf)
+      i = int(np.argmin(costs))
+      if best is None or costs[i] < best[0]*(1-eps):
+        q = np.zeros(nH, dtype=int)
+        q[a], q[m] = q_a[i], grid[i]
+        best = (costs[i], g, int(N), q)
+        U = min(U, costs[i])
+  if best is None:
+    return None
+  cost, g, N, q = best
+  return {'ANR type':params['G'][g], '# ANR modules':N, 'H2 modules':{h:int(q[i]) for i, h in enumerate(params['H'])},
+          'Solve time (s)':time.time()-start}
+
+
+def compare_results(results_ref, results_other, rel_tol=1e-6):
+  """Lists the differences between two results dictionaries of the same plant
+  Returns:
+    differences (list): (key, reference value, other value) for each differing entry
+  """
+  if results_ref is None or results_other is None:
+    return [] if results_ref is results_other else [('feasible', results_ref is not None, results_other is not None)]
+  differences = []
+  for key in results_ref.keys() | results_other.keys():
+    ref, other = results_ref.get(key), results_other.get(key)
+    if isinstance(ref, (int, float)) and isinstance(other, (int, float)):
+      if not np.isclose(ref, other, rtol=rel_tol, atol=1e-6):
+        differences.append((key, ref, other))
+    elif ref != other:
+      differences.append((key, ref, other))
+  return differences
+
+
+def report_differences(plant, results_ref, results_other, labels=('MILP', 'fast')):
+  """Prints the differences between the results of two solution methods for a plant
+  Returns:
+    differences (list): from compare_results
+  """
+  differences = compare_results(results_ref, results_other)
+  if differences:
+    print(f'{plant}: {len(differences)} differences between {labels[0]} and {labels[1]} results')
+    for key, ref, other in sorted(differences, key=lambda d: str(d[0])):
+      print(f'  {key}: {ref} ({labels[0]}) vs {other} ({labels[1]})')
+  return differences
+
+
+def build_sweep_model(params, h2_dem_kg_per_day, elec_dem_MWe, max_modules, plant_balance=True, formulation='ordered'):
+  """Slot-based deployment model with mutable cost and demand parameters, built once per plant and re-solved with a
+  persistent solver for each scenario of a sweep (see set_sweep_params)
+  Args:
+    params (dict): from get_deployment_params, for the first scenario
+    h2_dem_kg_per_day (float): hydrogen demand (kg/day)
+    elec_dem_MWe (float): auxiliary electricity demand met by the ANRs (MWe)
+    max_modules (int): number of ANR module slots
+    plant_balance (bool): if True include the plant-level energy balance with auxiliary electricity demand
+    formulation (str): 'slots' or 'ordered'
+  Returns:
+    model (ConcreteModel): deployment model
+  """
+  from pyomo.environ import ConcreteModel, Set, Param, Var, Binary, NonNegativeIntegers, Objective, Constraint, minimize
+  model = ConcreteModel()
+  G, H = params['G'], params['H']
+  model.N = Set(initialize=list(range(max_modules)))
+  model.H = Set(initialize=H)
+  model.G = Set(initialize=G)
+
+  model.vS = Var(model.G, within=Binary, doc='Chosen ANR type')
+  model.vM = Var(model.N, model.G, within=Binary, doc='Indicator of built ANR module')
+  model.vQ = Var(model.N, model.H, model.G, within=NonNegativeIntegers, doc='Nb of H2 module of type H for an ANR module of type g')
+
+  # Fixed parameters
+  model.pH2CapH2 = Param(model.H, initialize={h:params['h2_cap_h2'][i] for i, h in enumerate(H)})
+  model.pH2CapElec = Param(model.H, model.G, initialize={(h,g):params['h2_cap_elec'][i,j] for i, h in enumerate(H) for j, g in enumerate(G)})
+  model.pANRCap = Param(model.G, initialize={g:params['anr_cap'][j] for j, g in enumerate(G)})
+  # Parameters updated between scenarios
+  model.pH2Dem = Param(initialize=h2_dem_kg_per_day, mutable=True)
+  model.pElecDem = Param(initialize=elec_dem_MWe, mutable=True)
+  model.pITC_ANR = Param(initialize=utils.ITC_ANR, mutable=True)
+  model.pITC_H2 = Param(initialize=utils.ITC_H2, mutable=True)
+  for name in ['ANRCAPEX', 'ANRCRF', 'ANRFC', 'ANRVOM']:
+    setattr(model, 'p'+name, Param(model.G, initialize=0, mutable=True))
+  for name in ['H2CAPEX', 'H2CRF', 'H2FC', 'H2VOM']:
+    setattr(model, 'p'+name, Param(model.H, initialize=0, mutable=True))
+  set_sweep_params(model, params)
+
+  def annualized_costs_anr_h2(model):
+    return sum(sum(model.pANRCap[g]*model.vM[n,g]*((model.pANRCAPEX[g]*(1-model.pITC_ANR)*model.pANRCRF[g]+model.pANRFC[g])+model.pANRVOM[g]*HOURS_PER_YEAR) \
+      + sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2CAPEX[h]*(1-model.pITC_H2)*model.pH2CRF[h]+model.pH2FC[h]+model.pH2VOM[h]*HOURS_PER_YEAR) for h in model.H) for g in model.G) for n in model.N)
+  model.Costs = Objective(expr=annualized_costs_anr_h2, sense=minimize)
+
+  model.meet_h2_dem = Constraint(expr = model.pH2Dem <= sum(model.vQ[n,h,g]*model.pH2CapH2[h]*24 for n in model.N for h in model.H for g in model.G))
+  model.max_ANR_type = Constraint(expr = sum(model.vS[g] for g in model.G) <= 1)
+
+  def match_ANR_type(model, n, g):
+    return model.vM[n,g] <= model.vS[g]
+  model.match_ANR_type = Constraint(model.N, model.G, rule=match_ANR_type)
+
+  def energy_balance_module(model, n, g):
+    return sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) <= model.pANRCap[g]*model.vM[n,g]
+  model.energy_balance_module = Constraint(model.N, model.G, rule=energy_balance_module)
+
+  if plant_balance:
+    def energy_balance_plant(model, g):
+      return sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H for n in model.N) + model.pElecDem*model.vS[g] \
+              <= sum(model.pANRCap[g]*model.vM[n,g] for n in model.N)
+    model.energy_balance_plant = Constraint(model.G, rule=energy_balance_plant)
+
+  if formulation == 'ordered':
+    add_symmetry_breaking(model)
+  return model
+
+
+def set_sweep_params(model, params, h2_dem_kg_per_day=None, elec_dem_MWe=None):
+  """Updates the mutable parameters of a sweep model with the costs of a scenario, and the demand if given"""
+  for j, g in enumerate(params['G']):
+    model.pANRCAPEX[g] = params['anr_capex'][j]
+    model.pANRCRF[g] = params['anr_crf'][j]
+    model.pANRFC[g] = params['anr_fom'][j]
+    model.pANRVOM[g] = params['anr_vom'][j]
+  for i, h in enumerate(params['H']):
+    model.pH2CAPEX[h] = params['h2_capex'][i]
+    model.pH2CRF[h] = params['h2_crf'][i]
+    model.pH2FC[h] = params['h2_fom'][i]
+    model.pH2VOM[h] = params['h2_vom'][i]
+  if h2_dem_kg_per_day is not None:
+    model.pH2Dem = h2_dem_kg_per_day
+  if elec_dem_MWe is not None:
+    model.pElecDem = elec_dem_MWe
+
+
+def _set_highs_start(opt, model):
+  """Passes the current values of the model variables to HiGHS as MIP start, the pending updates are applied first.
+  appsi has no public MIP start, the start uses the HiGHS model of the persistent solver and is skipped if it is missing.
+  Returns:
+    set (bool): True if the start was set, the parameter updates are then disabled for the next solve
+  """
+  solver_model = getattr(opt, '_solver_model', None)
+  var_map = getattr(opt, '_pyomo_var_to_solver_var_map', None)
+  if solver_model is None or var_map is None or not hasattr(solver_model, 'setSolution'):
+    return False
+  opt.update()
+  from pyomo.environ import Var
+  try:
+    solution = solver_model.getSolution()
+    values = np.zeros(len(var_map))
+    for var in model.component_data_objects(ctype=Var):
+      if id(var) in var_map and var.value is not None:
+        values[var_map[id(var)]] = round(var.value) if var.is_integer() else var.value
+    solution.col_value = list(values)
+    solver_model.setSolution(solution)
+  except (AttributeError, TypeError):
+    return False
+  return True
+
+
+def solve_sweep_model(model, opt, warmstart=True):
+  """Solves a sweep model with a persistent solver, only the changed parameters are sent to the solver
+  Args:
+    model (ConcreteModel): from build_sweep_model
+    opt: persistent solver from solver_config.get_persistent_solver
+    warmstart (bool): if True and the model was solved before, start from the previous solution (HiGHS only)
+  Returns:
+    deployment (dict): 'ANR type', '# ANR modules', 'H2 modules', 'Solve time (s)' and 'Optimal', False if the time
+      limit stopped the solve with a feasible solution, None if no solution was found
+  """
+  from pyomo.contrib.appsi.base import TerminationCondition as AppsiTerminationCondition
+  start = time.time()
+  started = warmstart and getattr(model, '_solved', False) and _set_highs_start(opt, model)
+  # The parameters were sent by _set_highs_start, sending them again would discard the start. The other updates of
+  # the solve only act on changes of the model, there are none since.
+  update_params = opt.update_config.update_params
+  if started:
+    opt.update_config.update_params = False
+  try:
+    results = opt.solve(model)
+  finally:
+    opt.update_config.update_params = update_params
+  optimal = results.termination_condition == AppsiTerminationCondition.optimal
+  if not optimal and (results.termination_condition != AppsiTerminationCondition.maxTimeLimit \
+                      or results.best_feasible_objective is None):
+    return None
+  results.solution_loader.load_vars()
+  model._solved = True
+  deployment = extract_deployment(model)
+  if deployment is not None:
+    deployment['Solve time (s)'] = time.time()-start
+    deployment['Optimal'] = optimal
+    if not optimal:
+      print(f'Time limit reached, incumbent {results.best_feasible_objective:.6g}, bound {results.best_objective_bound}')
+  return deployment
+
+
+def load_sweep_scenarios(scenarios):
+  """Loads the ANR and H2 data of each scenario of a sweep
+  Args:
+    scenarios (list[dict]): scenarios with keys 'anr_tag' (default 'FOAK'), 'wacc' (default utils.WACC) and optionally
+      'learning_rate_anr_capex' and 'learning_rate_h2_capex' applied with utils.update_capex_costs
+  Returns:
+    scenario_data (list): (scenario, ANR_data, H2_data, wacc) for each scenario
+  """
+  scenario_data = []
+  for scenario in scenarios:
+    ANR_data, H2_data = utils.load_data(anr_tag=scenario.get('anr_tag', 'FOAK'))
+    if 'learning_rate_anr_capex' in scenario or 'learning_rate_h2_capex' in scenario:
+      ANR_data, H2_data = utils.update_capex_costs(ANR_data.copy(), scenario.get('learning_rate_anr_capex', 0),
+                                                   H2_data.copy(), scenario.get('learning_rate_h2_capex', 0))
+    scenario_data.append((scenario, ANR_data, H2_data, scenario.get('wacc', utils.WACC)))
+  return scenario_data
+
+
+def sweep_plant(plant, scenario_data, h2_dem_kg_per_day, elec_dem_MWe, max_modules, plant_balance, compile_results,
+                solver='highs', formulation='ordered', warmstart=True):
+  """Solves the deployment at a plant for each scenario of a sweep: the model is built once and kept in a persistent
+  solver, only the cost coefficients are updated between scenarios and each solve starts from the previous solution.
+  Args:
+    plant (str): plant id
+    scenario_data (list): from load_sweep_scenarios
+    h2_dem_kg_per_day (float): hydrogen demand (kg/day)
+    elec_dem_MWe (float): auxiliary electricity demand met by the ANRs (MWe)
+    max_modules (int): number of ANR module slots
+    plant_balance (bool): if True include the plant-level energy balance with auxiliary electricity demand
+    compile_results (function): compile_*_results function of the industry, called as (plant, ANR_data, H2_data, deployment, wacc)
+    solver (str): persistent solver preset
+    formulation (str): 'slots' or 'ordered'
+    warmstart (bool): start each solve from the solution of the previous scenario
+  Returns:
+    results (list[dict]): results of each scenario, with the scenario keys, 'Optimal' and 'Solve time (s)', None for
+      infeasible scenarios
+  """
+  opt = solver_config.get_persistent_solver(solver)
+  results, model = [], None
+  start = time.time()
+  for scenario, ANR_data, H2_data, wacc in scenario_data:
+    params = get_deployment_params(ANR_data, H2_data, wacc=wacc)
+    if model is None:
+      model = build_sweep_model(params, h2_dem_kg_per_day, elec_dem_MWe, max_modules, plant_balance, formulation)
+      build_time = time.time()-start
+    else:
+      set_sweep_params(model, params)
+    deployment = solve_sweep_model(model, opt, warmstart=warmstart)
+    if deployment is None:
+      print(f'{plant}: not feasible for scenario {scenario}')
+      results.append(None)
+      continue
+    results_ref = compile_results(plant, ANR_data, H2_data, deployment, wacc=wacc)
+    # Time limited incumbents are kept, flagged as not optimal
+    results_ref['Optimal'] = deployment['Optimal']
+    results_ref['Solve time (s)'] = deployment['Solve time (s)']
+    results_ref.update(scenario)
+    results.append(results_ref)
+  print(f'{plant}: {len(scenario_data)} scenarios solved (build {build_time:.3f} s, total {time.time()-start:.3f} s)')
+  return results
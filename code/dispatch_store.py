@@ -0,0 +1,86 @@
+import os
+import numpy as np
+
+"""Store of the hourly dispatch profiles of the price taker: parquet dataset partitioned by tag, scenario, year, state and
+design, one file per profile with float32 values in row groups of about a month.
+Profiles are written as they are solved, the readers are lazy: only the requested partitions and hours are read."""
+
+DISPATCH_STORE = './results/dispatch_profiles'
+PARTITIONS = ['tag', 'scenario', 'year', 'state', 'design']
+ROW_GROUP_HOURS = 730
+
+
+def get_profile_path(anr_tag, scenario, year, state, design, store=DISPATCH_STORE):
+  return os.path.join(store, f'tag={anr_tag}', f'scenario={scenario}', f'year={year}', f'state={state}', f'design={design}',
+                      'dispatch.parquet')
+
+
+def has_profile(anr_tag, scenario, year, state, design, store=DISPATCH_STORE):
+  return os.path.isfile(get_profile_path(anr_tag, scenario, year, state, design, store))
+
+
+def write_profile(dispatch, anr_tag, scenario, year, state, design, store=DISPATCH_STORE):
+  """Writes the hourly dispatch (MWe) of a design in a state, replacing the existing profile
+  Args:
+    dispatch (ndarray): hourly dispatch (MWe)
+    anr_tag, scenario, year, state, design: partition of the profile
+    store (str): path to the store
+  Returns:
+    None
+  """
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  path = get_profile_path(anr_tag, scenario, year, state, design, store)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  table = pa.table({'hour':np.arange(len(dispatch), dtype=np.int16), 'dispatch (MWe)':np.asarray(dispatch, dtype=np.float32)})
+  # Write then rename, readers never see a partial file and the dataset discovery ignores the '.'-prefixed temp file
+  tmp_path = os.path.join(os.path.dirname(path), f'.dispatch.parquet.{os.getpid()}.tmp')
+  pq.write_table(table, tmp_path, compression='zstd', row_group_size=ROW_GROUP_HOURS)
+  os.replace(tmp_path, path)
+
+
+def open_store(store=DISPATCH_STORE):
+  """Lazy pyarrow dataset of the store, nothing is read before a scan"""
+  import pyarrow.dataset as ds
+  return ds.dataset(store, format='parquet', partitioning='hive')
+
+
+def _get_filter(tags=None, scenarios=None, years=None, states=None, designs=None, hours=None):
+  import pyarrow.dataset as ds
+  expression = None
+  for column, values in zip(PARTITIONS, [tags, scenarios, years, states, designs]):
+    if values is not None:
+      condition = ds.field(column).isin(list(values))
+      expression = condition if expression is None else expression & condition
+  if hours is not None:
+    condition = (ds.field('hour') >= hours[0]) & (ds.field('hour') < hours[1])
+    expression = condition if expression is None else expression & condition
+  return expression
+
+
+def read_profiles(tags=None, scenarios=None, years=None, states=None, designs=None, hours=None, store=DISPATCH_STORE):
+  """Reads a selection of profiles in long format
+  Args:
+    tags, scenarios, years, states, designs (list): partitions to read, all by default
+    hours (tuple): (first hour, last hour excluded), all hours by default
+    store (str): path to the store
+  Returns:
+    profiles_df (DataFrame): columns hour, dispatch (MWe), tag, scenario, year, state and design
+  """
+  expression = _get_filter(tags, scenarios, years, states, designs, hours)
+  return open_store(store).to_table(filter=expression).to_pandas()
+
+
+def iter_profiles(tags=None, scenarios=None, years=None, states=None, designs=None, hours=None, store=DISPATCH_STORE):
+  """Iterates over the selected profiles, one profile in memory at a time
+  Yields:
+    partition (dict): tag, scenario, year, state and design of the profile
+    dispatch (ndarray): float32 hourly dispatch (MWe) of the selected hours
+  """
+  import pyarrow.dataset as ds
+  dataset = open_store(store)
+  partition_filter = _get_filter(tags, scenarios, years, states, designs)
+  hour_filter = _get_filter(hours=hours)
+  for fragment in dataset.get_fragments(filter=partition_filter):
+    table = fragment.to_table(filter=hour_filter, columns=['hour', 'dispatch (MWe)'])
+    yield ds.get_partition_keys(fragment.partition_expression), table.column('dispatch (MWe)').to_numpy()
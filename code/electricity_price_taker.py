@@ -2,8 +2,15 @@ from pyomo.environ import *
 import pandas as pd
 import numpy as np
 import os
+import time
+import hashlib
 import utils
+import cambium_prices
+import solver_config
+import representative_periods
+import dispatch_store
 from multiprocessing import Pool
+from itertools import product
 import matplotlib.pyplot as plt
 import seaborn as sns
 import argparse
@@ -13,14 +20,23 @@ ITC_ANR = utils.ITC_ANR
 
 cambium_scenario = 'MidCase'#'MidCaseTCExpire' # 'LowRECostTCExpire','MidCaseTCExpire', 'MidCase', 'LowRECost', 'HighRECost', 'HighNGPrice', 'LowNGPrice'
 
-electricity_prices_partial_path = './input_data/cambium_'+cambium_scenario.lower()+'_state_hourly_electricity_prices/Cambium22_'+cambium_scenario+'_hourly_'
+STATES = ['AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', \
+          'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR', 'PA', \
+          'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WY']
+ANR_TYPES = ['iPWR', 'HTGR', 'PBR-HTGR', 'iMSR', 'Micro']
+# Sweep over Cambium scenarios, years and ANR tags, results in a parquet dataset partitioned by scenario, year and tag
+SWEEP_SCENARIOS = ['HighRECost', 'LowRECostTCExpire', 'MidCaseTCExpire', 'MidCase', 'LowRECost', 'HighNGPrice', 'LowNGPrice']
+SWEEP_YEARS = [2024, 2030, 2040]
+SWEEP_TAGS = ['FOAK', 'NOAK']
+PRICE_TAKER_STORE = './results/price_taker'
 
 
-def get_electricity_prices(state, year):
+def get_electricity_prices(state, year, scenario=None):
   """Get the type and number of ANR for a site
   Args: 
     state (str): abbreviation of the state name
     year (int): Year
+    scenario (str): Cambium scenario, cambium_scenario by default
   Returns: 
     prices (DataFrame): with columns t, 0 to 8760, and price, electricity price in $/MWhe for year 
   """
@@ -28,22 +44,14 @@ def get_electricity_prices(state, year):
   if state =='OA': state = 'IA' # Iowa abbreviation fix
   if state =='HI': state = 'CA' # Hawai as California: high prices
 
-  elec_prices_path = electricity_prices_partial_path +state +'_'+str(year)+'.csv'
-  electricity_prices = pd.read_csv(elec_prices_path, skiprows=5)
-  electricity_prices = electricity_prices[['energy_cost_enduse']]
-  # Convert to USD2020
-  from utils import conversion_2021usd_to_2020usd
-  electricity_prices['energy_cost_enduse'] = electricity_prices['energy_cost_enduse']*conversion_2021usd_to_2020usd
-  # Index
-  electricity_prices.set_index([pd.Index([t for t in range(8760)])])
-  electricity_prices.reset_index(inplace=True)
-  electricity_prices.rename(columns={'index':'t', 'energy_cost_enduse':'price'}, inplace=True)
-  electricity_prices.set_index('t', inplace=True)
+  # Prices already in USD2020 in the memory-mapped cube, float64 for the model parameters
+  prices = cambium_prices.get_hourly_prices(scenario or cambium_scenario, year, state)
+  electricity_prices = pd.DataFrame({'price':prices.astype(np.float64)}, index=pd.RangeIndex(len(prices), name='t'))
 
   return electricity_prices
 
 
-def build_ED_electricity(state, ANRtype, ANR_data, year):
+def build_ED_electricity(state, ANRtype, ANR_data, year, scenario=None):
   """
   Performs economic dispatch of a type of ANR in a state given electricity prices
   Args: 
@@ -51,6 +59,7 @@ def build_ED_electricity(state, ANRtype, ANR_data, year):
     ANRtype (str): design of ANR
     ANR_data (DataFrame): ANR techno-economic parameter data
     year (int): Year for electricity prices
+    scenario (str): Cambium scenario, cambium_scenario by default
   Returns: 
 
   """
@@ -81,7 +90,7 @@ def build_ED_electricity(state, ANRtype, ANR_data, year):
   def pANRCRF(model):
     return model.pWACC / (1 - (1/(1+model.pWACC)**float(ANR_data.loc[ANRtype,'Life (y)'])))
 
-  electricity_prices = get_electricity_prices(state=state, year=year)
+  electricity_prices = get_electricity_prices(state=state, year=year, scenario=scenario)
   @model.Param(model.t)
   def pEPrice(model, t):
     return electricity_prices.loc[t,'price']
@@ -116,48 +125,648 @@ def build_ED_electricity(state, ANRtype, ANR_data, year):
   return model
 
 
-def solve_ED_electricity(state, ANRtype, ANR_data, year):
+def solve_ED_electricity(state, ANRtype, ANR_data, year, solver='highs'):
   print(f'Start price taker solve in state {state}, design {ANRtype}')
   model = build_ED_electricity(state, ANRtype, ANR_data, year)
 
-  solver = SolverFactory('glpk')
-  results = solver.solve(model, tee=False)
+  # LP: no time limit nor MIP settings
+  opt = solver_config.get_solver(solver, timelimit=None, mipgap=None, options={})
+  results = opt.solve(model, tee=False)
   if results.solver.termination_condition == TerminationCondition.optimal: 
     model.solutions.load_from(results)
   else:
     exit('Not solvable')
   
+  # Dispatch and prices pulled out once, metrics computed with NumPy
+  dispatch = np.array([value(model.vG[t]) for t in model.t])
+  prices = np.array([value(model.pEPrice[t]) for t in model.t])
+  metrics = _design_metrics(prices, dispatch, get_dispatch_params(ANRtype, ANR_data))
   results_dic = {}
-  results_dic['Annual Net Revenues ($/year/MWe)'] = value(model.NetRevenues/model.pANRCap)
+  results_dic['Annual Net Revenues ($/year/MWe)'] = float(metrics['Annual Net Revenues ($/year/MWe)'])
   results_dic['ANR type'] = ANRtype
   results_dic['state'] = state
   results_dic['year'] = year
-  def compute_elec_sales(model):
-    return sum(model.vG[t]*model.pEPrice[t] for t in model.t)/(1e6*model.pANRCap)
-  results_dic['Electricity sales (M$/year/MWe)'] = value(compute_elec_sales(model))
-
-  def compute_avg_elec_price(model):
-    return sum(model.pEPrice[t] for t in model.t)/8760
-  results_dic['Avg price ($/MWhe)'] = value(compute_avg_elec_price(model))
-
-  def compute_be_capex(model):
-    return (sum((model.pEPrice[t]-model.pANRVOM)*model.vG[t] for t in model.t) -\
-            model.pANRFOM*model.pANRCap )/(model.pANRCap*model.pANRCRF*(1-model.pITC_ANR))
-  results_dic['BE CAPEX ($/MWe)'] = value(compute_be_capex(model))
-
-  def compute_capacity_factor(model):
-    return sum(model.vG[t] for t in model.t)/(model.pANRCap*8760)
-  results_dic['Capacity factor'] = value(compute_capacity_factor(model))
-
-  def compute_lcoe(model):
-    """Computes the breakeven price of electricity assuming a 95% capacity factor"""
-    return ((model.pANRCAPEX*model.pANRCRF*(1-model.pITC_ANR) + model.pANRFOM)*model.pANRCap \
-            + model.pANRVOM*model.pANRCap*0.95*8760)/(sum(model.vG[t] for t in model.t))
-  
-  results_dic['LCOE ($/MWhe)'] = value(compute_lcoe(model))
-    
+  results_dic.update({key:float(values) for key, values in metrics.items()})
+
+  return results_dic
+
+
+def build_ED_electricity_periods(state, ANRtype, ANR_data, periods):
+  """
+  Economic dispatch of build_ED_electricity on representative periods of the prices (representative_periods)
+  Each hour of a representative is weighted by the number of hours it represents. Ramp constraints apply within the
+  representatives and between the last and first hours of the representatives of consecutive periods of the year.
+  The initial output is not fixed to the MSL.
+  Args: 
+    state (str): abbreviation for state name
+    ANRtype (str): design of ANR
+    ANR_data (DataFrame): ANR techno-economic parameter data
+    periods (dict): representative periods of the prices, see representative_periods.cluster_periods
+  Returns: 
+    model (ConcreteModel): reduced dispatch model
+  """
+  params = get_dispatch_params(ANRtype, ANR_data)
+  model = ConcreteModel(state)
+
+  ### Sets ###
+  model.c = Set(initialize = range(len(periods['medoids'])), doc='Representative periods')
+  model.h = Set(initialize = range(periods['period_hours']), doc='Hours of a period')
+  model.links = Set(dimen=2, initialize = representative_periods.get_transitions(periods), doc='Consecutive representatives')
+
+  ### Variables ###
+  model.vG = Var(model.c, model.h, within=NonNegativeReals)
+
+  ### Parameters ###
+  model.pANRCap = Param(initialize = params['cap'], doc='Total capacity deployed (MWe)')
+  model.pANRMSL = Param(initialize = params['msl'])
+  model.pANRVOM = Param(initialize = params['vom'])
+  model.pANRRamp = Param(initialize = params['ramp']*params['cap'], doc='Ramp limit (MWe/hr)')
+  crf = WACC / (1 - (1/(1+WACC)**params['life']))
+  model.pAnnualCosts = Param(initialize = (params['capex']*crf*(1-ITC_ANR)+params['fom'])*params['cap'])
+  model.pEPrice = Param(model.c, model.h, initialize = lambda model, c, h: periods['values'][c, h])
+  model.pWeight = Param(model.c, model.h, initialize = lambda model, c, h: periods['weights'][c, h])
+
+  ### Objective ###
+  def annualized_revenues(model):
+    return -model.pAnnualCosts + sum(model.pWeight[c, h]*(model.pEPrice[c, h]-model.pANRVOM)*model.vG[c, h] \
+                                     for c in model.c for h in model.h)
+  model.NetRevenues = Objective(expr = annualized_revenues, sense= maximize)
+
+  ### Constraints ###
+  model.max_capacity = Constraint(model.c, model.h, rule=lambda model, c, h: model.vG[c, h] <= model.pANRCap)
+  model.msl = Constraint(model.c, model.h, rule=lambda model, c, h: model.vG[c, h] >= model.pANRMSL)
+
+  def ramp_within(model, c, h):
+    if h == 0:
+      return Constraint.Skip
+    return (-model.pANRRamp, model.vG[c, h]-model.vG[c, h-1], model.pANRRamp)
+  model.ramp_within = Constraint(model.c, model.h, rule=ramp_within, doc='Ramp limits within a representative period')
+
+  last = periods['period_hours']-1
+  def ramp_link(model, c, next_c):
+    return (-model.pANRRamp, model.vG[next_c, 0]-model.vG[c, last], model.pANRRamp)
+  model.ramp_link = Constraint(model.links, rule=ramp_link, doc='Ramp limits between consecutive periods')
+
+  return model
+
+
+def solve_ED_electricity_periods(state, ANRtype, ANR_data, year, periods, period_hours=representative_periods.HOURS_PER_DAY,
+                                 solver='highs', scenario=None):
+  """Price taker results of solve_ED_electricity on representative periods of the prices
+  Args:
+    periods (int): number of representative periods
+    period_hours (int): hours per period, 24 for days, 168 for weeks
+  Returns:
+    results_dic (dict): results of solve_ED_electricity estimated on the representative periods, with the number of
+      periods and the solve time
+  """
+  start = time.time()
+  prices = get_electricity_prices(state=state, year=year, scenario=scenario)['price'].to_numpy()
+  rep_periods = representative_periods.cluster_periods(prices, periods, period_hours=period_hours)
+  model = build_ED_electricity_periods(state, ANRtype, ANR_data, rep_periods)
+  opt = solver_config.get_solver(solver, timelimit=None, mipgap=None, options={})
+  results = opt.solve(model, tee=False)
+  if results.solver.termination_condition == TerminationCondition.optimal: 
+    model.solutions.load_from(results)
+  else:
+    exit('Not solvable')
+
+  # Representative dispatch and prices expanded over the year
+  rep_dispatch = np.array([[value(model.vG[c, h]) for h in model.h] for c in model.c])
+  dispatch = representative_periods.expand_periods(rep_dispatch, rep_periods)[None, :]
+  rep_prices = representative_periods.expand_periods(rep_periods['values'], rep_periods)[None, :]
+  metrics = _design_metrics(rep_prices, dispatch, get_dispatch_params(ANRtype, ANR_data))
+  results_dic = {'Annual Net Revenues ($/year/MWe)':metrics['Annual Net Revenues ($/year/MWe)'][0], 'ANR type':ANRtype,
+                 'state':state, 'year':year}
+  results_dic.update({key:values[0] for key, values in metrics.items()})
+  results_dic['Periods'] = len(rep_periods['medoids'])
+  results_dic['Period hours'] = period_hours
+  results_dic['Solve time (s)'] = time.time()-start
   return results_dic
 
+
+def get_dispatch_levels(cap, msl, ramp):
+  """Output levels of the optimal dispatch of the price taker LP
+  A vertex of the LP is defined by chains of active ramp constraints starting at the MSL (also the initial output) or at
+  the capacity, so that an optimal dispatch only takes the values msl+k*ramp*cap and cap-k*ramp*cap within [msl, cap].
+  Args:
+    cap (float): capacity (MWe)
+    msl (float): minimum stable load (MWe)
+    ramp (float): ramp rate (fraction of capacity/hr)
+  Returns:
+    levels (ndarray): sorted output levels (MWe), the first one is the MSL
+  """
+  ramp_mw = ramp*cap
+  tol = 1e-9*max(cap, 1)
+  if ramp_mw <= tol:
+    return np.array([msl])
+  steps = np.arange(int(np.floor((cap-msl)/ramp_mw+1e-9))+1)
+  levels = np.sort(np.concatenate([msl+steps*ramp_mw, cap-steps*ramp_mw, [cap]]))
+  levels = levels[(levels >= msl-tol) & (levels <= cap+tol)]
+  return levels[np.concatenate([[True], np.diff(levels) > tol])]
+
+
+def dispatch_fast(prices, cap, msl, ramp, vom):
+  """Exact ramp-constrained dispatch of the price taker LP (build_ED_electricity) without solver
+  Dynamic programming over the output levels of the optimal vertices (get_dispatch_levels), linear in the number of hours
+  and vectorized over price series. The output starts at the MSL as in the LP.
+  Args:
+    prices (ndarray): electricity prices ($/MWhe), shape (T,) or (S, T) for S price series
+    cap, msl, ramp, vom (float or ndarray): capacity (MWe), MSL (MWe), ramp rate (fraction of capacity/hr) and VOM
+      ($/MWhe), scalars or arrays of shape (S,)
+  Returns:
+    dispatch (ndarray): hourly output (MWe), same shape as prices
+  """
+  prices = np.asarray(prices, dtype=np.float64)
+  single = prices.ndim == 1
+  prices = np.atleast_2d(prices)
+  S, T = prices.shape
+  cap, msl, ramp, vom = [np.broadcast_to(np.asarray(x, dtype=np.float64), (S,)) for x in (cap, msl, ramp, vom)]
+
+  # Levels padded with the last level of each series, duplicated levels do not change the optimum
+  series_levels = [get_dispatch_levels(cap[s], msl[s], ramp[s]) for s in range(S)]
+  m = max(len(lev) for lev in series_levels)
+  levels = np.array([np.pad(lev, (0, m-len(lev)), mode='edge') for lev in series_levels])
+  tol = 1e-9*np.maximum(cap, 1)
+  allowed = np.abs(levels[:, :, None]-levels[:, None, :]) <= (ramp*cap+tol)[:, None, None]
+  penalty = np.where(allowed, 0., -np.inf)
+
+  margins = prices-vom[:, None]
+  values = np.where(np.arange(m) == 0, margins[:, :1]*levels, -np.inf)
+  previous = np.empty((T, S, m), dtype=np.int16)
+  for t in range(1, T):
+    candidates = values[:, None, :]+penalty
+    previous[t] = candidates.argmax(axis=2)
+    values = np.take_along_axis(candidates, previous[t][:, :, None], axis=2)[:, :, 0]+margins[:, t:t+1]*levels
+
+  # Backtracking
+  index = np.empty((S, T), dtype=np.int64)
+  index[:, -1] = values.argmax(axis=1)
+  rows = np.arange(S)
+  for t in range(T-1, 0, -1):
+    index[:, t-1] = previous[t][rows, index[:, t]]
+  dispatch = np.take_along_axis(levels, index, axis=1)
+  return dispatch[0] if single else dispatch
+
+
+# Instances stacked in one LP by solve_dispatch_batch, about 9k variables each
+BATCH_INSTANCES = 48
+
+
+def build_dispatch_batch(prices, cap, msl, ramp, vom):
+  """Price taker LPs of S instances (build_ED_electricity) stacked in one block-diagonal sparse LP
+  Variables are the hourly outputs of each instance in order, the output of the first hour is fixed at the MSL.
+  Args:
+    prices (ndarray): electricity prices ($/MWhe), shape (S, T)
+    cap, msl, ramp, vom (ndarray): capacity (MWe), MSL (MWe), ramp rate (fraction of capacity/hr) and VOM ($/MWhe),
+      shape (S,)
+  Returns:
+    matrix (dict): c, A, b_l, b_u, lb, ub of the LP (minimization)
+  """
+  import scipy.sparse as sp
+  S, T = prices.shape
+  cap, msl, ramp, vom = [np.broadcast_to(np.asarray(x, dtype=np.float64), (S,)) for x in (cap, msl, ramp, vom)]
+  # Ramp rows g[s,t]-g[s,t-1] for t >= 1 of each instance
+  n_rows = S*(T-1)
+  rows = np.arange(n_rows)
+  current = (np.arange(S)[:, None]*T+np.arange(1, T)).ravel()
+  A = sp.csr_array((np.concatenate([np.ones(n_rows), -np.ones(n_rows)]),
+                    (np.concatenate([rows, rows]), np.concatenate([current, current-1]))), shape=(n_rows, S*T))
+  ramp_mw = np.repeat(ramp*cap, T-1)
+  lb = np.repeat(msl, T).reshape(S, T)
+  ub = np.repeat(cap, T).reshape(S, T)
+  ub[:, 0] = msl
+  return {'c':-(prices-vom[:, None]).ravel(), 'A':A, 'b_l':-ramp_mw, 'b_u':ramp_mw, 'lb':lb.ravel(), 'ub':ub.ravel()}
+
+
+def solve_dispatch_batch(prices, cap, msl, ramp, vom, batch_instances=BATCH_INSTANCES):
+  """Dispatch of many price taker instances with one HiGHS call per batch of instances, through scipy
+  The model, LP file and solver process overheads of the Pyomo solves are paid once per batch.
+  Args:
+    prices (ndarray): electricity prices ($/MWhe), shape (S, T)
+    cap, msl, ramp, vom (ndarray): operational parameters of the instances, shape (S,)
+    batch_instances (int): number of instances per LP
+  Returns:
+    dispatch (ndarray): hourly output (MWe), shape (S, T)
+  """
+  from scipy.optimize import milp, LinearConstraint, Bounds
+  prices = np.atleast_2d(np.asarray(prices, dtype=np.float64))
+  S, T = prices.shape
+  cap, msl, ramp, vom = [np.broadcast_to(np.asarray(x, dtype=np.float64), (S,)) for x in (cap, msl, ramp, vom)]
+  dispatch = np.empty((S, T))
+  for start in range(0, S, batch_instances):
+    batch = slice(start, start+batch_instances)
+    matrix = build_dispatch_batch(prices[batch], cap[batch], msl[batch], ramp[batch], vom[batch])
+    res = milp(matrix['c'], constraints=LinearConstraint(matrix['A'], matrix['b_l'], matrix['b_u']),
+               bounds=Bounds(matrix['lb'], matrix['ub']))
+    if res.status != 0:
+      exit('Not solvable')
+    dispatch[batch] = res.x.reshape(-1, T)
+  return dispatch
+
+
+# Rolling horizon: windows of committed hours solved with a lookahead, the monolithic LP is only solved for the gap
+# report up to MONOLITHIC_MAX_HOURS
+ROLLING_WINDOW_HOURS = 730
+ROLLING_LOOKAHEAD_HOURS = 168
+MONOLITHIC_MAX_HOURS = 3*8760
+
+
+def get_horizon_prices(state, years, start, stop, scenario=None):
+  """Hours [start, stop) of the prices of back-to-back years, only the years overlapping the hours are read"""
+  segments = []
+  for i, year in enumerate(years):
+    first, last = max(start, 8760*i), min(stop, 8760*(i+1))
+    if first < last:
+      segments.append(get_electricity_prices(state=state, year=year, scenario=scenario)['price'].to_numpy()[first-8760*i:last-8760*i])
+  return np.concatenate(segments)
+
+
+def build_dispatch_window(cap, msl, ramp, hours):
+  """Price taker LP of a window (build_ED_electricity) with mutable margins and bounds on the first hour, so that the
+  same model is re-solved for every window of a rolling horizon
+  Args:
+    cap, msl (float): capacity and MSL (MWe)
+    ramp (float): ramp rate (fraction of capacity/hr)
+    hours (int): hours of the window, lookahead included
+  Returns:
+    model (ConcreteModel): window model, set pMargin, pStartLow and pStartUp before each solve
+  """
+  model = ConcreteModel()
+  model.t = Set(initialize=np.arange(hours))
+  model.vG = Var(model.t, bounds=(msl, cap))
+  model.pMargin = Param(model.t, initialize=0, mutable=True, doc='Price minus VOM ($/MWhe)')
+  model.pStartLow = Param(initialize=msl, mutable=True)
+  model.pStartUp = Param(initialize=msl, mutable=True)
+  model.NetRevenues = Objective(expr=sum(model.pMargin[t]*model.vG[t] for t in model.t), sense=maximize)
+
+  def RRamprateUp(model, t):
+    if t == model.t.at(1):
+      return Constraint.Skip
+    return model.vG[model.t.prev(t)]-model.vG[t] >= -ramp*cap
+  model.RRamprateUp = Constraint(model.t, rule=RRamprateUp)
+
+  def RRamprateDn(model, t):
+    if t == model.t.at(1):
+      return Constraint.Skip
+    return model.vG[model.t.prev(t)]-model.vG[t] <= ramp*cap
+  model.RRamprateDn = Constraint(model.t, rule=RRamprateDn)
+  # Ramp state carried from the last committed hour of the previous window
+  model.start = Constraint(expr=inequality(model.pStartLow, model.vG[model.t.at(1)], model.pStartUp))
+  return model
+
+
+def solve_dispatch_rolling(state, ANRtype, ANR_data, years, scenario=None, window_hours=ROLLING_WINDOW_HOURS,
+                           lookahead_hours=ROLLING_LOOKAHEAD_HOURS, solver='highs', report=True):
+  """Dispatch of the price taker over back-to-back years with a rolling horizon
+  Each window commits window_hours and looks lookahead_hours further, the ramp state is carried across the windows
+  (and years, the output starts at the MSL only at the start of the horizon). The window model is built once and kept
+  in a persistent solver: only the margins and first-hour bounds change, each solve starts from the previous basis.
+  The model size, and memory, do not depend on the horizon length.
+  Args:
+    state (str): abbreviation of the state name
+    ANRtype (str): design of ANR
+    ANR_data (DataFrame): ANR techno-economic parameter data
+    years (list[int]): years of the horizon, in order
+    scenario (str): Cambium scenario, cambium_scenario by default
+    window_hours, lookahead_hours (int): committed and lookahead hours of each window
+    solver (str): persistent solver preset
+    report (bool): if True compare with the monolithic LP when the horizon has at most MONOLITHIC_MAX_HOURS
+  Returns:
+    dispatch (ndarray): hourly output (MWe) over the horizon
+    gap_report (dict): windows, solve times, operating margins ($) of the rolling and monolithic dispatch and gap (%)
+  """
+  from pyomo.contrib.appsi.base import TerminationCondition as AppsiTerminationCondition
+  params = get_dispatch_params(ANRtype, ANR_data)
+  cap, msl, ramp_mw = params['cap'], params['msl'], params['ramp']*params['cap']
+  T = 8760*len(years)
+  hours = window_hours+lookahead_hours
+  model = build_dispatch_window(cap, msl, params['ramp'], hours)
+  opt = solver_config.get_persistent_solver(solver, timelimit=None, mipgap=None)
+  dispatch = np.empty(T)
+  margin = 0
+  start_time = time.time()
+  for start in range(0, T, window_hours):
+    margins = get_horizon_prices(state, years, start, min(start+hours, T), scenario)-params['vom']
+    # Hours past the horizon have no margin, they do not change the optimum
+    margins = np.pad(margins, (0, hours-len(margins)))
+    for t in model.t:
+      model.pMargin[t] = margins[t]
+    if start == 0:
+      model.pStartLow, model.pStartUp = msl, msl
+    else:
+      model.pStartLow, model.pStartUp = max(msl, dispatch[start-1]-ramp_mw), min(cap, dispatch[start-1]+ramp_mw)
+    results = opt.solve(model)
+    if results.termination_condition != AppsiTerminationCondition.optimal:
+      exit('Not solvable')
+    results.solution_loader.load_vars()
+    committed = min(window_hours, T-start)
+    dispatch[start:start+committed] = [value(model.vG[t]) for t in range(committed)]
+    margin += np.dot(margins[:committed], dispatch[start:start+committed])
+  gap_report = {'Windows':int(np.ceil(T/window_hours)), 'Window hours':window_hours, 'Lookahead hours':lookahead_hours,
+                'Rolling solve time (s)':time.time()-start_time, 'Rolling margin ($)':float(margin)}
+  if report and T <= MONOLITHIC_MAX_HOURS:
+    start_time = time.time()
+    prices = get_horizon_prices(state, years, 0, T, scenario)
+    monolithic = solve_dispatch_batch(prices[None, :], cap, msl, params['ramp'], params['vom'])[0]
+    gap_report['Monolithic solve time (s)'] = time.time()-start_time
+    gap_report['Monolithic margin ($)'] = float(np.dot(prices-params['vom'], monolithic))
+    gap_report['Gap (%)'] = 100*(gap_report['Monolithic margin ($)']-margin)/abs(gap_report['Monolithic margin ($)'])
+  return dispatch, gap_report
+
+
+def solve_ED_electricity_rolling(state, ANRtype, ANR_data, years, scenario=None, window_hours=ROLLING_WINDOW_HOURS,
+                                 lookahead_hours=ROLLING_LOOKAHEAD_HOURS, solver='highs'):
+  """Price taker results of each year of a back-to-back multi-year horizon solved with solve_dispatch_rolling
+  Returns:
+    results (list[dict]): results_dic of solve_ED_electricity for each year, with the gap report of the horizon
+  """
+  dispatch, gap_report = solve_dispatch_rolling(state, ANRtype, ANR_data, years, scenario, window_hours, lookahead_hours,
+                                                solver)
+  params = get_dispatch_params(ANRtype, ANR_data)
+  prices = get_horizon_prices(state, years, 0, 8760*len(years), scenario).reshape(len(years), 8760)
+  metrics = _design_metrics(prices, dispatch.reshape(len(years), 8760), params)
+  results = []
+  for i, year in enumerate(years):
+    results_dic = {'Annual Net Revenues ($/year/MWe)':metrics['Annual Net Revenues ($/year/MWe)'][i], 'ANR type':ANRtype,
+                   'state':state, 'year':year}
+    results_dic.update({key:values[i] for key, values in metrics.items()})
+    results_dic.update(gap_report)
+    results.append(results_dic)
+  return results
+
+
+def get_dispatch_params(ANRtype, ANR_data):
+  """Parameters of the price taker model of a design, as in build_ED_electricity"""
+  row = ANR_data.loc[ANRtype]
+  nb_mod = int(row['Max Modules'])
+  return {'cap':nb_mod*float(row['Power in MWe']), 'msl':nb_mod*float(row['MSL in MWe']),
+          'ramp':float(row['Ramp Rate (fraction of capacity/hr)']), 'vom':float(row['VOM in $/MWh-e']),
+          'capex':float(row['CAPEX $/MWe']), 'fom':float(row['FOPEX $/MWe-y']), 'life':float(row['Life (y)'])}
+
+
+def compute_dispatch_metrics(prices, dispatch, cap, vom, capex, fom, life, wacc=WACC, itc=ITC_ANR):
+  """Price taker metrics of solve_ED_electricity from hourly prices and dispatch, vectorized
+  Can be used on stored dispatch profiles (get_dispatches) to evaluate other cost assumptions without solving again,
+  the dispatch is then kept as is, it is only optimal for the VOM it was solved with.
+  Args:
+    prices (ndarray): hourly electricity prices ($/MWhe), shape (..., T)
+    dispatch (ndarray): hourly output (MWe), shape (..., T)
+    cap (float or ndarray): capacity (MWe)
+    vom (float or ndarray): VOM ($/MWhe)
+    capex (float or ndarray): CAPEX ($/MWe)
+    fom (float or ndarray): FOM ($/MWe-y)
+    life (float or ndarray): lifetime (years)
+    wacc (float or ndarray): WACC
+    itc (float or ndarray): ITC on the ANR CAPEX
+  Returns:
+    metrics (dict): 'Annual Net Revenues ($/year/MWe)', 'Electricity sales (M$/year/MWe)', 'Avg price ($/MWhe)',
+      'BE CAPEX ($/MWe)', 'Capacity factor', 'LCOE ($/MWhe)' broadcast over the leading dimensions
+  """
+  prices, dispatch = np.asarray(prices, dtype=np.float64), np.asarray(dispatch, dtype=np.float64)
+  cap, vom, capex, fom, life, wacc, itc = [np.asarray(x, dtype=np.float64) for x in (cap, vom, capex, fom, life, wacc, itc)]
+  crf = wacc / (1 - (1/(1+wacc)**life))
+  annual_capex = capex*crf*(1-itc)
+  generation = dispatch.sum(axis=-1)
+  sales = (dispatch*prices).sum(axis=-1)
+  margin = sales-vom*generation
+  return {'Annual Net Revenues ($/year/MWe)':(-(annual_capex+fom)*cap+margin)/cap,
+          'Electricity sales (M$/year/MWe)':sales/(1e6*cap),
+          'Avg price ($/MWhe)':prices.sum(axis=-1)/8760,
+          'BE CAPEX ($/MWe)':(margin-fom*cap)/(cap*crf*(1-itc)),
+          'Capacity factor':generation/(cap*8760),
+          'LCOE ($/MWhe)':((annual_capex+fom)*cap+vom*cap*0.95*8760)/generation}
+
+
+def _design_metrics(prices, dispatch, params):
+  return compute_dispatch_metrics(prices, dispatch, params['cap'], params['vom'], params['capex'], params['fom'], params['life'])
+
+
+# Hourly dispatch (MWe) by operational parameters, shared by the cost scenarios (e.g. FOAK and NOAK)
+_dispatch_cache = {}
+# LP dispatch profiles stored as they are solved, named after the hash of the prices and operational parameters
+DISPATCH_CACHE_DIR = './cache/dispatch'
+# Dispatch method of each backend: the 'lp' and 'batch' backends solve the same LP and share their profiles, which are
+# stored in DISPATCH_CACHE_DIR. dispatch_fast is cheaper than reading a profile, its profiles are only kept in memory.
+DISPATCH_METHODS = {'lp':'lp', 'batch':'lp', 'fast':'fast'}
+# Read-only data of the pool workers, set by init_dispatch_worker
+_worker_ANR_data = {}
+
+
+def get_dispatch_key(scenario, state, year, params, backend='lp'):
+  """The dispatch only depends on the dispatch method, prices, capacity, MSL, ramp rate and VOM, not on CAPEX and FOM"""
+  return (DISPATCH_METHODS[backend], scenario or cambium_scenario, state, year, params['cap'], params['msl'], params['ramp'],
+          params['vom'])
+
+
+def _dispatch_path(key):
+  prices = get_electricity_prices(state=key[2], year=key[3], scenario=key[1])['price'].to_numpy()
+  digest = hashlib.sha256(prices.tobytes()+repr(key[:1]+key[4:]).encode()).hexdigest()
+  return os.path.join(DISPATCH_CACHE_DIR, digest[:32]+'.npy')
+
+
+def solve_ED_dispatch(state, ANRtype, ANR_data, year, solver='highs', scenario=None):
+  """Hourly dispatch (MWe) of the price taker LP"""
+  print(f'Start price taker solve in state {state}, design {ANRtype}')
+  model = build_ED_electricity(state, ANRtype, ANR_data, year, scenario=scenario)
+  opt = solver_config.get_solver(solver, timelimit=None, mipgap=None, options={})
+  results = opt.solve(model, tee=False)
+  if results.solver.termination_condition == TerminationCondition.optimal: 
+    model.solutions.load_from(results)
+  else:
+    exit('Not solvable')
+  return np.array([value(model.vG[t]) for t in model.t])
+
+
+def init_dispatch_worker(ANR_data_by_tag):
+  """Pool initializer: ANR data of each tag and memory-mapped price cube, shared by all the tasks of the worker"""
+  _worker_ANR_data.update(ANR_data_by_tag)
+  cambium_prices.open_price_cube()
+
+
+def _solve_dispatch_task(task):
+  key, (anr_tag, year, scenario, state, ANRtype), solver = task
+  return key, solve_ED_dispatch(state, ANRtype, _worker_ANR_data[anr_tag], year, solver=solver, scenario=scenario)
+
+
+def _write_profiles(key_cases, store):
+  """Writes the dispatch of the cases with an ANR tag in the dispatch profile store"""
+  for key, (anr_tag, year, scenario, state, ANRtype) in key_cases:
+    if anr_tag is not None:
+      dispatch_store.write_profile(_dispatch_cache[key], anr_tag, scenario or cambium_scenario, year, state, ANRtype, store)
+
+
+def get_dispatches(cases, ANR_data_by_tag, solver='highs', backend='lp', workers=None, profile_store=None):
+  """Dispatch of the cases, solved once for each distinct set of operational parameters and cached in memory
+  LP solves run in a single pool over the flattened cases. LP and batch profiles are stored in DISPATCH_CACHE_DIR as soon
+  as they are solved and shared by the two backends, fast profiles are not stored (see DISPATCH_METHODS).
+  Args:
+    cases (list[tuple]): (anr_tag, year, scenario, state, ANRtype), scenario None for cambium_scenario
+    ANR_data_by_tag (dict): ANR techno-economic parameter data of each anr_tag
+    solver (str): solver preset of the LP
+    backend (str): 'lp', 'batch' (stacked LPs, solve_dispatch_batch) or 'fast' (dispatch_fast)
+    workers (int): number of pool workers, number of cores by default
+    profile_store (str): if given, the hourly profiles of the cases are also written in this dispatch_store
+  Returns:
+    dispatch (ndarray): hourly dispatch (MWe) of each case, shape (len(cases), 8760)
+  """
+  keys = [get_dispatch_key(scenario, state, year, get_dispatch_params(ANRtype, ANR_data_by_tag[anr_tag]), backend) \
+          for anr_tag, year, scenario, state, ANRtype in cases]
+  key_cases = {}
+  if profile_store:
+    for key, (anr_tag, year, scenario, state, ANRtype) in zip(keys, cases):
+      if anr_tag is not None and not dispatch_store.has_profile(anr_tag, scenario or cambium_scenario, year, state, ANRtype, profile_store):
+        key_cases.setdefault(key, []).append((anr_tag, year, scenario, state, ANRtype))
+  missing = {}
+  for key, case in zip(keys, cases):
+    if key in _dispatch_cache or key in missing:
+      continue
+    path = _dispatch_path(key) if DISPATCH_METHODS[backend] == 'lp' else None
+    if path is not None and os.path.isfile(path):
+      _dispatch_cache[key] = np.load(path)
+    else:
+      missing[key] = case
+  if missing and backend in ('fast', 'batch'):
+    prices = np.array([get_electricity_prices(state=key[2], year=key[3], scenario=key[1])['price'].to_numpy() for key in missing])
+    cap, msl, ramp, vom = np.array([key[4:] for key in missing]).T
+    dispatch_function = dispatch_fast if backend == 'fast' else solve_dispatch_batch
+    _dispatch_cache.update(zip(missing.keys(), dispatch_function(prices, cap, msl, ramp, vom)))
+    for key in missing:
+      if backend == 'batch':
+        os.makedirs(DISPATCH_CACHE_DIR, exist_ok=True)
+        np.save(_dispatch_path(key), _dispatch_cache[key])
+      _write_profiles([(key, case) for case in key_cases.pop(key, [])], profile_store)
+  elif missing:
+    workers = min(workers or os.cpu_count(), len(missing))
+    chunksize = max(1, len(missing)//(4*workers))
+    os.makedirs(DISPATCH_CACHE_DIR, exist_ok=True)
+    with Pool(workers, initializer=init_dispatch_worker, initargs=(ANR_data_by_tag,)) as pool:
+      tasks = [(key, case, solver) for key, case in missing.items()]
+      for key, dispatch in pool.imap_unordered(_solve_dispatch_task, tasks, chunksize=chunksize):
+        _dispatch_cache[key] = dispatch
+        np.save(_dispatch_path(key), dispatch)
+        _write_profiles([(key, case) for case in key_cases.pop(key, [])], profile_store)
+  # Profiles of the cases that were already solved
+  for key, cases_of_key in key_cases.items():
+    _write_profiles([(key, case) for case in cases_of_key], profile_store)
+  if missing:
+    print(f'Dispatch: {len(missing)} solves for {len(cases)} cases')
+  return np.array([_dispatch_cache[key] for key in keys])
+
+
+def compute_ED_results(states, ANRtype, ANR_data, year, dispatch, scenario=None):
+  """Price taker results of a design in several states from the dispatch
+  Args:
+    states (list[str]): abbreviations of the state names
+    ANRtype (str): design of ANR
+    ANR_data (DataFrame): ANR techno-economic parameter data
+    year (int): Year for electricity prices
+    dispatch (ndarray): hourly dispatch (MWe) in each state, shape (len(states), 8760)
+    scenario (str): Cambium scenario, cambium_scenario by default
+  Returns:
+    results (list[dict]): results_dic of solve_ED_electricity for each state
+  """
+  params = get_dispatch_params(ANRtype, ANR_data)
+  prices = np.array([get_electricity_prices(state=state, year=year, scenario=scenario)['price'].to_numpy() for state in states])
+  metrics = _design_metrics(prices, dispatch, params)
+  results = []
+  for s, state in enumerate(states):
+    results_dic = {'Annual Net Revenues ($/year/MWe)':metrics['Annual Net Revenues ($/year/MWe)'][s], 'ANR type':ANRtype,
+                   'state':state, 'year':year}
+    results_dic.update({key:values[s] for key, values in metrics.items()})
+    results.append(results_dic)
+  return results
+
+
+def solve_ED_electricity_fast(states, ANRtype, ANR_data, year):
+  """Price taker results of a design in several states with dispatch_fast
+  Returns:
+    results (list[dict]): results_dic of solve_ED_electricity for each state
+  """
+  dispatch = get_dispatches([(None, year, None, state, ANRtype) for state in states], {None:ANR_data}, backend='fast')
+  return compute_ED_results(states, ANRtype, ANR_data, year, dispatch)
+
+
+def compute_ED_cost_scenarios(state, ANRtype, ANR_data, year, capex, fom, wacc=WACC, itc=ITC_ANR, vom=None, solver='highs',
+                              backend='lp'):
+  """Price taker results of a design for several cost scenarios, from a single dispatch solve
+  Args:
+    state (str): abbreviation of the state name
+    ANRtype (str): design of ANR, operational parameters from ANR_data
+    ANR_data (DataFrame): ANR techno-economic parameter data
+    year (int): Year for electricity prices
+    capex, fom, wacc, itc (float or ndarray): CAPEX ($/MWe), FOM ($/MWe-y), WACC and ITC of the cost scenarios
+    vom (float or ndarray): VOM ($/MWhe) of the cost scenarios, the dispatch is solved with the VOM of ANR_data
+    solver (str): solver preset of the LP
+    backend (str): 'lp', 'batch' or 'fast'
+  Returns:
+    results_df (DataFrame): one row per cost scenario with the cost parameters and results of solve_ED_electricity
+  """
+  params = get_dispatch_params(ANRtype, ANR_data)
+  vom = params['vom'] if vom is None else vom
+  capex, fom, wacc, itc, vom = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (capex, fom, wacc, itc, vom)])
+  dispatch = get_dispatches([(None, year, None, state, ANRtype)], {None:ANR_data}, solver=solver, backend=backend)
+  prices = get_electricity_prices(state=state, year=year)['price'].to_numpy()[None, :]
+  metrics = compute_dispatch_metrics(prices, dispatch, params['cap'], vom, capex, fom, params['life'], wacc=wacc, itc=itc)
+  results_df = pd.DataFrame({'CAPEX $/MWe':capex, 'FOPEX $/MWe-y':fom, 'WACC':wacc, 'ITC ANR':itc, 'VOM in $/MWh-e':vom})
+  results_df['ANR type'] = ANRtype
+  results_df['state'] = state
+  results_df['year'] = year
+  for key, values in metrics.items():
+    results_df[key] = np.broadcast_to(values, capex.shape)
+  return results_df
+
+
+def validate_dispatch_fast(states, ANRtype, ANR_data, year, solver='highs', rel_tol=1e-6):
+  """Compares the results of dispatch_fast with the LP, prints the differences
+  The capacity factor, sales and LCOE can differ with equal revenues when the price equals the VOM (degenerate LP).
+  Returns:
+    differences (DataFrame): state, field, LP and fast values of the differing results
+  """
+  fast_results = solve_ED_electricity_fast(states, ANRtype, ANR_data, year)
+  differences = []
+  for state, fast_dic in zip(states, fast_results):
+    lp_dic = solve_ED_electricity(state, ANRtype, ANR_data, year, solver=solver)
+    for key, lp_value in lp_dic.items():
+      if isinstance(lp_value, str) or key == 'year':
+        continue
+      if abs(fast_dic[key]-lp_value) > rel_tol*max(1, abs(lp_value)):
+        differences.append({'state':state, 'ANR type':ANRtype, 'field':key, 'LP':lp_value, 'fast':fast_dic[key]})
+  differences = pd.DataFrame(differences, columns=['state', 'ANR type', 'field', 'LP', 'fast'])
+  print(f'{ANRtype}: {len(differences)} differences between LP and fast dispatch in {len(states)} states')
+  if len(differences) > 0:
+    print(differences)
+  return differences
+
+def compare_periods(periods_df, ANR_data, solver='highs', backend='fast', scenario=None):
+  """Errors of the results on representative periods against the full-year dispatch
+  Args:
+    periods_df (DataFrame): results of solve_ED_electricity_periods
+    ANR_data (DataFrame): ANR techno-economic parameter data
+    solver (str): solver preset of the full-year LP
+    backend (str): 'lp', 'batch' or 'fast' for the full-year dispatch
+    scenario (str): Cambium scenario, cambium_scenario by default
+  Returns:
+    errors_df (DataFrame): full-year and reduced revenues and capacity factors with their errors
+  """
+  rows = []
+  for (ANRtype, year), group in periods_df.groupby(['ANR type', 'year'], sort=False):
+    states = list(group['state'])
+    dispatch = get_dispatches([(None, year, scenario, state, ANRtype) for state in states], {None:ANR_data}, solver=solver,
+                              backend=backend)
+    full_results = compute_ED_results(states, ANRtype, ANR_data, year, dispatch, scenario=scenario)
+    for full_dic, (_, reduced) in zip(full_results, group.iterrows()):
+      full_rev, reduced_rev = full_dic['Annual Net Revenues ($/year/MWe)'], reduced['Annual Net Revenues ($/year/MWe)']
+      rows.append({'state':full_dic['state'], 'ANR type':ANRtype, 'year':year, 'Periods':reduced['Periods'],
+                   'Full revenues ($/year/MWe)':full_rev, 'Reduced revenues ($/year/MWe)':reduced_rev,
+                   'Revenues error (%)':100*(reduced_rev-full_rev)/abs(full_rev),
+                   'Full capacity factor':full_dic['Capacity factor'], 'Reduced capacity factor':reduced['Capacity factor'],
+                   'Capacity factor error':reduced['Capacity factor']-full_dic['Capacity factor']})
+  errors_df = pd.DataFrame(rows)
+  print(errors_df[['Revenues error (%)', 'Capacity factor error']].abs().describe().loc[['mean', 'max']])
+  return errors_df
+
+
 def save_electricity_results(results_df, excel_file):
   """Save electricity results
   Args: 
@@ -221,30 +830,155 @@ def compute_cost_reduction():
     df['Cost red CAPEX BE'] = df.apply(lambda x: max(0,1-(x['BE CAPEX ($/MWe)']/x['CAPEX $/MWe'])), axis=1)
     df.to_excel(excel_file)
 
-def main():
-  states = ['AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', \
-            'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR', 'PA', \
-              'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WY']
-  ANRtype_list = ['iPWR', 'HTGR', 'PBR-HTGR', 'iMSR', 'Micro']
+def main(solver='highs', backend='lp'):
+  states = STATES
+  ANRtype_list = ANR_TYPES
   years = [2024]#, 2030, 2040]
+  anr_tags = ['FOAK', 'NOAK']
   all_states_results_list = []
-  for anr_tag in ['FOAK', 'NOAK']:
-    ANR_data = pd.read_excel('./ANRs.xlsx', sheet_name=anr_tag, index_col=0)
+  cambium_prices.ensure_price_cube([cambium_scenario])
+  tag_ANR_data = {anr_tag:utils.read_excel_cached('./ANRs.xlsx', sheet_name=anr_tag, index_col=0) for anr_tag in anr_tags}
+
+  # Dispatch solved once for each distinct set of operational parameters of FOAK and NOAK, costs do not change it
+  get_dispatches([(anr_tag, year, cambium_scenario, state, ANRtype) for anr_tag in anr_tags for year in years \
+                  for state in states for ANRtype in ANRtype_list], tag_ANR_data, solver=solver, backend=backend,
+                 profile_store=dispatch_store.DISPATCH_STORE)
+
+  for anr_tag in anr_tags:
+    ANR_data = tag_ANR_data[anr_tag]
     excel_file = f'./results/price_taker_{anr_tag}_{cambium_scenario}.xlsx'
     for year in years:
-      for state in states: 
-        
-        # Parallel solving
-        with Pool(5) as pool:
-          results = pool.starmap(solve_ED_electricity, [(state, ANRtype, ANR_data, year) for ANRtype in ANRtype_list])
-        pool.close()
-
-        state_elec_results_df = pd.DataFrame(results)
-        all_states_results_list.append(state_elec_results_df)
+      # Results of all states of a design at once from the cached dispatch, in the order of states then designs
+      design_results = {}
+      for ANRtype in ANRtype_list:
+        dispatch = get_dispatches([(anr_tag, year, cambium_scenario, state, ANRtype) for state in states], tag_ANR_data,
+                                  backend=backend)
+        design_results[ANRtype] = compute_ED_results(states, ANRtype, ANR_data, year, dispatch)
+      for s in range(len(states)):
+        all_states_results_list.append(pd.DataFrame([design_results[ANRtype][s] for ANRtype in ANRtype_list]))
     all_states_elec_results_df = pd.concat(all_states_results_list, ignore_index=True)
     save_electricity_results(all_states_elec_results_df, excel_file)
 
 
+def read_price_taker_results(scenarios=None, years=None, tags=None, states=None, store=PRICE_TAKER_STORE):
+  """Reads price taker results of the sweep store
+  Args:
+    scenarios, years, tags, states (list): filters, all by default
+    store (str): path to the parquet dataset partitioned by scenario, year and tag
+  Returns:
+    results_df (DataFrame): results_dic of solve_ED_electricity with the scenario, year and tag columns
+  """
+  import pyarrow.dataset as ds
+  if not os.path.isdir(store):
+    return pd.DataFrame(columns=['scenario', 'year', 'tag', 'state', 'ANR type'])
+  dataset = ds.dataset(store, format='parquet', partitioning='hive')
+  filters = []
+  for column, values in [('scenario', scenarios), ('year', years), ('tag', tags), ('state', states)]:
+    if values is not None:
+      filters.append(ds.field(column).isin(list(values)))
+  expression = None
+  for f in filters:
+    expression = f if expression is None else expression & f
+  return dataset.to_table(filter=expression).to_pandas()
+
+
+def _write_partition(df, scenario, year, tag, store):
+  """Writes the results of a scenario, year and tag, replacing the partition"""
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  folder = os.path.join(store, f'scenario={scenario}', f'year={year}', f'tag={tag}')
+  os.makedirs(folder, exist_ok=True)
+  table = pa.Table.from_pandas(df.drop(columns=['scenario', 'year', 'tag'], errors='ignore').reset_index(drop=True), preserve_index=False)
+  # Hidden name, pyarrow datasets skip the files starting with '_' or '.'
+  tmp_path = os.path.join(folder, f'.results.parquet.{os.getpid()}.tmp')
+  pq.write_table(table, tmp_path)
+  os.replace(tmp_path, os.path.join(folder, 'results.parquet'))
+
+
+def has_prices(scenario, year, state):
+  """True if the price cube has prices for the scenario, year and state"""
+  try:
+    prices = get_electricity_prices(state=state, year=year, scenario=scenario)['price'].to_numpy()
+  except KeyError:
+    return False
+  return not np.isnan(prices).any()
+
+
+def sweep(scenarios=SWEEP_SCENARIOS, years=SWEEP_YEARS, tags=SWEEP_TAGS, states=STATES, solver='highs', backend='lp',
+          store=PRICE_TAKER_STORE):
+  """Price taker results for all combinations of Cambium scenarios, years, ANR tags and states, in one run
+  Combinations already in the store are skipped, the dispatch of the others is solved in a single pool.
+  Args:
+    scenarios (list[str]): Cambium scenarios
+    years (list[int]): years
+    tags (list[str]): ANR tags, sheets of ANRs.xlsx
+    states (list[str]): abbreviations of the state names
+    solver (str): solver preset of the LP
+    backend (str): 'lp', 'batch' or 'fast'
+    store (str): path to the parquet dataset partitioned by scenario, year and tag
+  Returns:
+    results_df (DataFrame): results of all requested combinations
+  """
+  cambium_prices.ensure_price_cube(scenarios)
+  tag_ANR_data = {anr_tag:utils.read_excel_cached('./ANRs.xlsx', sheet_name=anr_tag, index_col=0) for anr_tag in tags}
+  existing = read_price_taker_results(scenarios, years, tags, states, store)
+  done = set(zip(existing['scenario'], existing['year'].astype(int), existing['tag'], existing['state']))
+
+  todo = {}
+  for scenario, year, state in product(scenarios, years, states):
+    todo_tags = [anr_tag for anr_tag in tags if (scenario, year, anr_tag, state) not in done]
+    if todo_tags and not has_prices(scenario, year, state):
+      print(f'No Cambium prices for {scenario}, {year}, {state}: skipped')
+      continue
+    for anr_tag in todo_tags:
+      todo.setdefault((scenario, year, anr_tag), []).append(state)
+  print(f'Price taker sweep: {sum(len(v) for v in todo.values())} (scenario, year, tag, state) to solve, {len(done)} in store')
+
+  get_dispatches([(anr_tag, year, scenario, state, ANRtype) for (scenario, year, anr_tag), todo_states in todo.items() \
+                  for state in todo_states for ANRtype in ANR_TYPES], tag_ANR_data, solver=solver, backend=backend,
+                 profile_store=dispatch_store.DISPATCH_STORE)
+  for (scenario, year, anr_tag), todo_states in todo.items():
+    results = []
+    for ANRtype in ANR_TYPES:
+      dispatch = get_dispatches([(anr_tag, year, scenario, state, ANRtype) for state in todo_states], tag_ANR_data,
+                                backend=backend)
+      results += compute_ED_results(todo_states, ANRtype, tag_ANR_data[anr_tag], year, dispatch, scenario=scenario)
+    partition_df = read_price_taker_results([scenario], [year], [anr_tag], store=store)
+    partition_df = pd.concat([partition_df.drop(columns=['scenario', 'year', 'tag']), pd.DataFrame(results).drop(columns=['year'])],
+                             ignore_index=True)
+    _write_partition(partition_df, scenario, year, anr_tag, store)
+  return read_price_taker_results(scenarios, years, tags, states, store)
+
+
+def main_periods(periods, period_hours=representative_periods.HOURS_PER_DAY, solver='highs'):
+  """Screening run of main on representative periods, with the error report against the full-year dispatch"""
+  years = [2024]
+  for anr_tag in ['FOAK', 'NOAK']:
+    ANR_data = utils.read_excel_cached('./ANRs.xlsx', sheet_name=anr_tag, index_col=0)
+    results = [solve_ED_electricity_periods(state, ANRtype, ANR_data, year, periods, period_hours=period_hours, solver=solver) \
+               for year in years for state in STATES for ANRtype in ANR_TYPES]
+    periods_df = pd.DataFrame(results)
+    print(f'{anr_tag}: {len(results)} solves on {periods} representative periods in {periods_df["Solve time (s)"].sum():.1f} s')
+    save_electricity_results(periods_df, f'./results/price_taker_{anr_tag}_{cambium_scenario}_periods_{periods}.xlsx')
+    errors_df = compare_periods(periods_df, ANR_data, solver=solver)
+    errors_df.to_excel(f'./results/price_taker_{anr_tag}_{cambium_scenario}_periods_{periods}_errors.xlsx')
+
+
+def main_rolling(years=SWEEP_YEARS, states=STATES, window_hours=ROLLING_WINDOW_HOURS, lookahead_hours=ROLLING_LOOKAHEAD_HOURS,
+                 solver='highs'):
+  """Price taker over back-to-back years with the rolling horizon, with the gap report against the monolithic LP"""
+  for anr_tag in ['FOAK', 'NOAK']:
+    ANR_data = utils.read_excel_cached('./ANRs.xlsx', sheet_name=anr_tag, index_col=0)
+    results = [results_dic for state in states for ANRtype in ANR_TYPES
+               for results_dic in solve_ED_electricity_rolling(state, ANRtype, ANR_data, years, window_hours=window_hours,
+                                                               lookahead_hours=lookahead_hours, solver=solver)]
+    rolling_df = pd.DataFrame(results)
+    if 'Gap (%)' in rolling_df:
+      print(f'{anr_tag}: rolling horizon gap max {rolling_df["Gap (%)"].max():.4f}%, mean {rolling_df["Gap (%)"].mean():.4f}%')
+    years_label = '_'.join(str(year) for year in years)
+    save_electricity_results(rolling_df, f'./results/price_taker_{anr_tag}_{cambium_scenario}_rolling_{years_label}.xlsx')
+
+
 def compare_deployment_stages():
   noak_results = f'./results/price_taker_NOAK_{cambium_scenario}.xlsx'
   foak_results = f'./results/price_taker_FOAK_{cambium_scenario}.xlsx'
@@ -324,17 +1058,7 @@ def add_vertical_line(ax, x, ymin, ymax, color):
 
 
 def compute_average_electricity_prices(cambium_scenario, year):
-  import glob
-  folder = f'./input_data/cambium_{cambium_scenario.lower()}_state_hourly_electricity_prices'
-  list_csv_files = glob.glob(folder+'/Cambium*.csv')
-  state_prices = pd.DataFrame(columns=['average price ($/MWhe)', 'state'])
-  state_prices.set_index('state', inplace=True)
-  for file in list_csv_files:
-    if str(year) in file:
-      state = file.split('_')[-2]
-      avg_price = pd.read_csv(file, skiprows=5)['energy_cost_enduse'].mean()
-      state_prices.loc[state, 'average price ($/MWhe)'] = avg_price
-  state_prices.to_excel(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx')
+  utils.compute_average_electricity_prices(cambium_scenario, year)
 
 def compute_with_average_elec_price(oak):
   year= 2024
@@ -364,8 +1088,30 @@ if __name__ == '__main__':
   parser.add_argument('-c', '--compare', required=False, help='Compare via a plot FOAK and NOAK results')
   parser.add_argument('-b', '--breakeven', required=False, help='Compute cost reduction needed for breakeven')
   parser.add_argument('-a', '--average', required=False, help='Compute revenues with average electricity price instead of price taker ')
+  parser.add_argument('-s', '--solver', required=False, default='highs', help='Solver preset: highs, cplex, cbc or glpk')
+  parser.add_argument('-f', '--fast', required=False, action='store_true', help='Dispatch with dispatch_fast instead of the LP')
+  parser.add_argument('--batch', required=False, action='store_true', help='Solve the LPs stacked in batches of instances')
+  parser.add_argument('--periods', required=False, type=int, help='Screening run on k representative periods of the prices')
+  parser.add_argument('--period-hours', required=False, type=int, default=24, help='Hours per representative period: 24 (days) or 168 (weeks)')
+  parser.add_argument('--sweep', required=False, action='store_true', help=f'Sweep scenarios, years, tags and states, results in {PRICE_TAKER_STORE}')
+  parser.add_argument('--scenarios', nargs='+', default=SWEEP_SCENARIOS, help='Cambium scenarios of the sweep')
+  parser.add_argument('--years', nargs='+', type=int, default=SWEEP_YEARS, help='Years of the sweep')
+  parser.add_argument('--tags', nargs='+', default=SWEEP_TAGS, help='ANR tags of the sweep')
+  parser.add_argument('--states', nargs='+', default=STATES, help='States of the sweep')
+  parser.add_argument('--rolling', required=False, action='store_true', help='Rolling horizon over the back-to-back years, with the gap report')
+  parser.add_argument('--window-hours', required=False, type=int, default=ROLLING_WINDOW_HOURS, help='Committed hours of each rolling window')
+  parser.add_argument('--lookahead-hours', required=False, type=int, default=ROLLING_LOOKAHEAD_HOURS, help='Lookahead hours of each rolling window')
   args = parser.parse_args()
-  if args.compare:
+  backend = 'fast' if args.fast else 'batch' if args.batch else 'lp'
+  if args.rolling:
+    main_rolling(years=args.years, states=args.states, window_hours=args.window_hours,
+                 lookahead_hours=args.lookahead_hours, solver=args.solver)
+  elif args.periods:
+    main_periods(args.periods, period_hours=args.period_hours, solver=args.solver)
+  elif args.sweep:
+    sweep(scenarios=args.scenarios, years=args.years, tags=args.tags, states=args.states, solver=args.solver,
+          backend=backend)
+  elif args.compare:
     compare_deployment_stages()
   elif args.plot:
     if args.plot == 'FOAK':
@@ -380,4 +1126,4 @@ if __name__ == '__main__':
   elif args.average:
     compute_with_average_elec_price(args.average)
   else:
-    main()
+    main(solver=args.solver, backend=backend)
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+import utils
+
+"""Batch project finance metrics of many sites at once: IRR, NPV, payback and LCOH from arrays of investments and
+yearly revenues, with the cash flow convention of utils.calculate_irr (initial investment, PTC for the first years,
+additional investments added to the cash flow of their year).
+The IRR is the root of the NPV polynomial in x = 1/(1+IRR) closest to IRR = 0, as numpy_financial.irr. Cash flows with
+at most one sign change have a single positive root, found for all sites together by Newton steps safeguarded by an
+exact bracket (bisection when a step leaves it). Other cash flows fall back to the polynomial roots site by site."""
+
+PTC_YEARS = 10
+IRR_TOL = 1e-13
+IRR_MAX_ITER = 200
+
+
+def build_cashflows(Co, Celec, Ch2, Cff, lifetime=20, ptc=True, ptc_years=PTC_YEARS, add_capex=None):
+  """Yearly cash flows of the sites, as in utils.calculate_irr
+  Args:
+    Co (float or ndarray): initial investment ($)
+    Celec (float or ndarray): yearly revenues from electricity sales ($/year)
+    Ch2 (float or ndarray): yearly H2 PTC revenues ($/year), only for the first ptc_years years
+    Cff (float or ndarray): yearly avoided fossil fuel costs ($/year)
+    lifetime (int or ndarray): lifetime (years)
+    ptc (bool): if False no PTC revenues
+    ptc_years (int or ndarray): years of PTC
+    add_capex (dict[int:float or ndarray]): amount added to the cash flow of a year, e.g. negative for a reinvestment
+  Returns:
+    cashflows (ndarray): cash flows of years 0 to the longest lifetime, zero after the lifetime of a site,
+      shape (S, max lifetime+1)
+  """
+  Co, Celec, Ch2, Cff, lifetime, ptc_years = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                                                  for x in (Co, Celec, Ch2, Cff, lifetime, ptc_years)])
+  years = np.arange(int(lifetime.max())+1)
+  active = (years >= 1) & (years <= lifetime[:, None])
+  yearly = (Celec+Cff)[:, None]+(Ch2[:, None]*(years <= ptc_years[:, None]) if ptc else 0)
+  cashflows = np.where(active, yearly, 0.)
+  cashflows[:, 0] = -Co
+  for year, add_investment in (add_capex or {}).items():
+    cashflows[:, year] += add_investment
+  return cashflows
+
+
+def compute_npv(cashflows, rate=utils.WACC):
+  """Net present value ($) of the cash flows of each site, rate as float or array of shape (S,)"""
+  cashflows = np.atleast_2d(cashflows)
+  discount = (1+np.asarray(rate, dtype=np.float64))[..., None]**-np.arange(cashflows.shape[1])
+  return (cashflows*discount).sum(axis=1)
+
+
+def _horner(cashflows, x):
+  """Polynomial sum_t cashflows[:, t]*x**t and its derivative for each site"""
+  f = np.zeros(len(x))
+  df = np.zeros(len(x))
+  for t in range(cashflows.shape[1]-1, -1, -1):
+    df = df*x+f
+    f = f*x+cashflows[:, t]
+  return f, df
+
+
+def _irr_roots(cashflows):
+  """IRR of one site from the polynomial roots, as numpy_financial.irr"""
+  res = np.roots(cashflows[::-1])
+  mask = (res.imag == 0) & (res.real > 0)
+  if not mask.any():
+    return np.nan
+  rate = 1/res[mask].real-1
+  return rate.item(np.argmin(np.abs(rate)))
+
+
+def compute_irr(cashflows, tol=IRR_TOL, max_iter=IRR_MAX_ITER):
+  """IRR of the cash flows of each site
+  Args:
+    cashflows (ndarray): yearly cash flows, shape (S, years)
+    tol (float): relative step or bracket width on x = 1/(1+IRR) at convergence
+    max_iter (int): maximum number of safeguarded Newton iterations
+  Returns:
+    irr (ndarray): IRR of each site, nan if there is no positive root (e.g. no sign change)
+  """
+  cashflows = np.atleast_2d(np.asarray(cashflows, dtype=np.float64))
+  S = len(cashflows)
+  signs = np.sign(cashflows)
+  # Sign changes between consecutive non-zero cash flows
+  last_sign = np.zeros(S)
+  changes = np.zeros(S, dtype=int)
+  for t in range(cashflows.shape[1]):
+    nonzero = signs[:, t] != 0
+    changes += nonzero & (last_sign != 0) & (signs[:, t] != last_sign)
+    last_sign = np.where(nonzero, signs[:, t], last_sign)
+  irr = np.full(S, np.nan)
+  single = (changes == 1) & (cashflows[:, 0] != 0)
+  for s in np.flatnonzero((changes > 1) | ((changes == 1) & (cashflows[:, 0] == 0))):
+    irr[s] = _irr_roots(cashflows[s])
+
+  flows = cashflows[single]
+  if len(flows) > 0:
+    # Bracket [lo, hi] of the positive root: f(0) = first cash flow, hi doubled until the sign changes
+    lo = np.zeros(len(flows))
+    sign_lo = np.sign(flows[:, 0])
+    hi = np.ones(len(flows))
+    outside = np.arange(len(flows))
+    for _ in range(200):
+      f_hi, _ = _horner(flows[outside], hi[outside])
+      outside = outside[np.sign(f_hi) == sign_lo[outside]]
+      if len(outside) == 0:
+        break
+      lo[outside] = hi[outside]
+      hi[outside] *= 2
+    # Newton from the end of the bracket where the sign is opposite to the first cash flow: the NPV polynomial of
+    # revenues after an investment is convex in x there, the steps decrease monotonically to the root
+    x = hi.copy()
+    # Sites still iterating
+    active = np.arange(len(flows))
+    for _ in range(max_iter):
+      f, df = _horner(flows[active], x[active])
+      same = np.sign(f) == sign_lo[active]
+      lo[active] = np.where(same, x[active], lo[active])
+      hi[active] = np.where(same, hi[active], x[active])
+      with np.errstate(divide='ignore', invalid='ignore'):
+        newton = x[active]-f/df
+      inside = (newton > lo[active]) & (newton < hi[active])
+      # Converged on the Newton step, at the roundoff level of the investment, or on the bracket width
+      converged = (np.abs(newton-x[active]) <= tol*x[active]) | (np.abs(f) <= tol*np.abs(flows[active, 0])) \
+                  | (hi[active]-lo[active] <= tol*hi[active])
+      x[active] = np.where(inside, newton, np.where(converged, x[active], (lo[active]+hi[active])/2))
+      active = active[~converged]
+      if len(active) == 0:
+        break
+    irr[single] = 1/x-1
+  return irr
+
+
+def compute_payback(cashflows, rate=None):
+  """Payback period (years) of each site: first time the cumulative cash flow is positive, linear within the year
+  Args:
+    cashflows (ndarray): yearly cash flows, shape (S, years)
+    rate (float or ndarray): if given, discounted payback period at this rate
+  Returns:
+    payback (ndarray): payback period (years), nan if never paid back
+  """
+  cashflows = np.atleast_2d(np.asarray(cashflows, dtype=np.float64))
+  if rate is not None:
+    cashflows = cashflows*(1+np.asarray(rate, dtype=np.float64))[..., None]**-np.arange(cashflows.shape[1])
+  cumulative = np.cumsum(cashflows, axis=1)
+  paid = cumulative >= 0
+  paid[:, 0] &= cashflows[:, 0] >= 0
+  year = paid.argmax(axis=1)
+  rows = np.arange(len(cashflows))
+  previous = cumulative[rows, np.maximum(year-1, 0)]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    fraction = np.where(year > 0, -previous/cashflows[rows, year], 0.)
+  return np.where(paid.any(axis=1), np.maximum(year-1, 0)+fraction, np.nan)
+
+
+def compute_lcoh(Co, annual_costs, h2_kg_per_year, lifetime=20, wacc=utils.WACC, annual_credits=0, add_capex=None):
+  """Levelized cost of hydrogen of each site: present value of the investments and costs net of the credits (e.g.
+  electricity sales) divided by the present value of the hydrogen production
+  Args:
+    Co (float or ndarray): initial investment ($)
+    annual_costs (float or ndarray): yearly O&M and fuel costs ($/year)
+    h2_kg_per_year (float or ndarray): yearly hydrogen production (kg/year)
+    lifetime (int or ndarray): lifetime (years)
+    wacc (float or ndarray): discount rate
+    annual_credits (float or ndarray): yearly revenues deducted from the costs ($/year)
+    add_capex (dict[int:float or ndarray]): additional investment of a year ($, positive)
+  Returns:
+    lcoh (ndarray): LCOH ($/kgH2)
+  """
+  Co, annual_costs, h2_kg_per_year, lifetime, wacc, annual_credits = np.broadcast_arrays(
+    *[np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (Co, annual_costs, h2_kg_per_year, lifetime, wacc, annual_credits)])
+  # Present value of 1 $/year over the lifetime
+  annuity = (1-(1+wacc)**-lifetime)/wacc
+  costs = Co+(annual_costs-annual_credits)*annuity
+  for year, add_investment in (add_capex or {}).items():
+    costs = costs+np.where(year <= lifetime, add_investment*(1+wacc)**-year, 0)
+  return costs/(h2_kg_per_year*annuity)
+
+
+def evaluate_projects(Co, Celec, Ch2, Cff, lifetime=20, ptc=True, ptc_years=PTC_YEARS, add_capex=None, wacc=utils.WACC,
+                      decimals=None):
+  """IRR, NPV and payback period of many sites with the cash flows of utils.calculate_irr
+  Args:
+    Co, Celec, Ch2, Cff, lifetime, ptc, ptc_years, add_capex: see build_cashflows
+    wacc (float or ndarray): discount rate of the NPV
+    decimals (int): if given the IRR is rounded, 2 as in utils.calculate_irr
+  Returns:
+    metrics (dict): 'IRR', 'NPV ($)', 'Payback (years)' arrays of shape (S,)
+  """
+  cashflows = build_cashflows(Co, Celec, Ch2, Cff, lifetime, ptc, ptc_years, add_capex)
+  irr = compute_irr(cashflows)
+  return {'IRR':irr if decimals is None else np.round(irr, decimals), 'NPV ($)':compute_npv(cashflows, wacc),
+          'Payback (years)':compute_payback(cashflows)}
+
+
+def add_irr_columns(df, investment_col, elec_col, ptc_col, ff_col, lifetime=20, decimals=2):
+  """Adds the 'IRR w PTC' and 'IRR wo PTC' columns of utils.calculate_irr to a results DataFrame in one batch
+  Args:
+    df (DataFrame): results with the investment and yearly revenues columns
+    investment_col, elec_col, ptc_col, ff_col (str): names of the Co, Celec, Ch2 and Cff columns
+  Returns:
+    df (DataFrame): df with the IRR columns
+  """
+  values = [pd.to_numeric(df[col]).to_numpy(dtype=np.float64) for col in (investment_col, elec_col, ptc_col, ff_col)]
+  df['IRR w PTC'] = evaluate_projects(*values, lifetime=lifetime, ptc=True, decimals=decimals)['IRR']
+  df['IRR wo PTC'] = evaluate_projects(*values, lifetime=lifetime, ptc=False, decimals=decimals)['IRR']
+  return df
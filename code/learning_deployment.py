@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+import os
+import time
+import argparse
+import utils
+import deployment_model
+import solver_config
+import cost_model
+import demand_registry
+
+"""Sequential deployment of ANR-H2 systems with learning on the ANR CAPEX, as in deployment_w_learning.ipynb: plants
+are deployed one at a time in order of increasing breakeven price, and after each plant the CAPEX of the chosen design
+is updated with the cumulative number of modules of that design, shared by all industries.
+The ANR CAPEX only changes the cost of the ANR modules, so the H2 side of the deployment problem of a plant is solved
+once: for each design, the Pareto front of (number of ANR modules, H2 costs) is computed with deployment_model.fast_solve.
+Each step then only rebuilds the module cost vector and takes the cheapest point of the fronts, which is the exact
+optimal deployment at the current CAPEX. The 'milp' backend instead keeps one persistent sweep model per plant, reused
+across trajectories, and only re-solves a plant when the CAPEX vector changed since its last solve."""
+
+INDUSTRIES = ['steel', 'refining', 'ammonia'] # order of deployment_w_learning.ipynb, process heat is not modeled here
+LEARNING_RATE_ANR_CAPEX = 0.07
+# One workbook per learning rate with a sheet per industry, raw_results_with_learning.xlsx is filled by the notebook
+LEARNING_RESULTS = './results/learning_deployment_lr_{learning_rate}.xlsx'
+
+
+def get_module_cost(params, anr_capex):
+  """Annualized cost of an ANR module of each design ($/year) with the given CAPEX ($/MWe)"""
+  return params['module_cost']+params['anr_cap']*(anr_capex-params['anr_capex'])*(1-utils.ITC_ANR)*params['anr_crf']
+
+
+def compute_pareto_fronts(params, h2_dem_kg_per_day, elec_dem_MWe, max_modules):
+  """Pareto fronts of the number of ANR modules and the H2 costs of each design at a plant, independent of the ANR
+  costs: the optimal deployment of a design is on its front for any ANR module cost
+  Returns:
+    fronts (list[list[tuple]]): for each design, (# ANR modules, annualized H2 costs ($/year), H2 modules) with the
+      number of modules decreasing and the H2 costs increasing, empty if infeasible
+  """
+  fronts = []
+  for g in range(len(params['G'])):
+    # Free modules of design g only: fast_solve returns the cheapest H2 deployment with the fewest modules
+    design_params = dict(params, G=params['G'][g:g+1], anr_cap=params['anr_cap'][g:g+1], module_cost=np.zeros(1),
+                         h2_cap_elec=params['h2_cap_elec'][:,g:g+1], h2_unit_cost=params['h2_unit_cost'][:,g:g+1])
+    front, n_max = [], max_modules
+    while n_max >= 1:
+      deployment = deployment_model.fast_solve(design_params, h2_dem_kg_per_day, elec_dem_MWe, n_max)
+      if deployment is None:
+        break
+      q = np.array([deployment['H2 modules'][h] for h in params['H']])
+      h2_costs = float(np.nansum(q*params['h2_unit_cost'][:,g]))
+      front.append((deployment['# ANR modules'], h2_costs, deployment['H2 modules']))
+      n_max = deployment['# ANR modules']-1
+    fronts.append(front)
+  return fronts
+
+
+def select_deployment(params, fronts, module_cost, eps=1e-9):
+  """Cheapest deployment on the Pareto fronts of a plant for the given ANR module costs, None if infeasible"""
+  best = None
+  for g, front in enumerate(fronts):
+    for N, h2_costs, h2_modules in front:
+      cost = module_cost[g]*N+h2_costs
+      if best is None or cost < best[0]*(1-eps):
+        best = (cost, {'ANR type':params['G'][g], '# ANR modules':N, 'H2 modules':dict(h2_modules)})
+  return None if best is None else best[1]
+
+
+def get_plants(industries=INDUSTRIES, plants=None):
+  """Plants of each industry with their demand and results function, see demand_registry.get_site
+  Returns:
+    sites (list[tuple]): (industry, plant id, site dict)
+  """
+  sites = []
+  for industry in industries:
+    ids = plants[industry] if plants is not None and industry in plants else demand_registry.get_plant_ids(industry)
+    sites += [(industry, plant, demand_registry.get_site(industry, plant)) for plant in ids]
+  return sites
+
+
+def order_plants(sites, ANR_data, H2_data, fronts, wacc=utils.WACC, interleave=False):
+  """Orders the plants by increasing breakeven price of their FOAK deployment, industry by industry as in
+  deployment_w_learning.ipynb, or all industries together if interleave
+  Returns:
+    sites (list[tuple]): ordered sites, infeasible plants removed
+  """
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  breakeven = []
+  for (industry, plant, site), plant_fronts in zip(sites, fronts):
+    deployment = select_deployment(params, plant_fronts, params['module_cost'])
+    if deployment is None:
+      print(f'{industry} {plant}: no feasible deployment, not deployed')
+      continue
+    results_ref = site['compile results'](plant, ANR_data, H2_data, deployment, wacc=wacc)
+    breakeven.append((industry, plant, site, plant_fronts, results_ref['Breakeven price ($/MMBtu)']))
+  rank = {industry:i for i, industry in enumerate(dict.fromkeys(s[0] for s in sites))}
+  key = (lambda x:x[4]) if interleave else (lambda x:(rank[x[0]], x[4]))
+  return [x[:4] for x in sorted(breakeven, key=key)]
+
+
+def run_learning_trajectory(ordered_sites, ANR_data, H2_data, learning_rate_anr_capex=LEARNING_RATE_ANR_CAPEX,
+                            wacc=utils.WACC, initial_units=None, backend='fast', models=None, solver='highs'):
+  """Deploys the plants in order, updating the ANR CAPEX of the chosen design with the cumulative number of modules
+  Args:
+    ordered_sites (list[tuple]): (industry, plant id, site dict, Pareto fronts) from order_plants
+    ANR_data (DataFrame): FOAK ANR parameters
+    H2_data (DataFrame): H2 technologies parameters
+    learning_rate_anr_capex (float): learning rate of the ANR CAPEX
+    wacc (float): weighted average cost of capital
+    initial_units (dict): modules of each design deployed before the first plant, 0 by default
+    backend (str): 'fast' (Pareto fronts) or 'milp' (persistent sweep model per plant)
+    models (dict): for the 'milp' backend, persistent models per plant kept across trajectories
+    solver (str): persistent solver preset of the 'milp' backend
+  Returns:
+    results (DataFrame): results of the deployed plants in order, with 'Industry', 'Learning rate',
+      'Cumulative # ANR modules' and 'Cumulative # ANR modules of type'
+    units (dict): cumulative number of modules of each design
+  """
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  foak_capex = params['anr_capex']
+  units = np.array([(initial_units or {}).get(g, 0) for g in params['G']], dtype=float)
+  current_ANR_data = ANR_data.copy()
+  current_ANR_data['CAPEX $/MWe'] = current_ANR_data['CAPEX $/MWe'].astype(float)
+  models = {} if models is None else models
+  results, total = [], 0
+  start = time.time()
+  for industry, plant, site, fronts in ordered_sites:
+    anr_capex = np.where(units > 0, cost_model.learned_capex(foak_capex, learning_rate_anr_capex, np.maximum(units, 1)),
+                         foak_capex)
+    if backend == 'milp':
+      deployment = solve_plant_milp(models, (industry, plant), site, anr_capex, current_ANR_data, H2_data, wacc, solver,
+                                    industry != 'refining')
+    else:
+      deployment = select_deployment(params, fronts, get_module_cost(params, anr_capex))
+    if deployment is None:
+      print(f'{industry} {plant}: no feasible deployment, not deployed')
+      continue
+    current_ANR_data['CAPEX $/MWe'] = anr_capex
+    results_ref = site['compile results'](plant, current_ANR_data, H2_data, deployment, wacc=wacc)
+    g = params['G'].index(deployment['ANR type'])
+    units[g] += deployment['# ANR modules']
+    total += deployment['# ANR modules']
+    results_ref['Industry'] = industry
+    results_ref['Learning rate'] = learning_rate_anr_capex
+    results_ref['Cumulative # ANR modules'] = total
+    results_ref['Cumulative # ANR modules of type'] = units[g]
+    results.append(results_ref)
+  print(f'Learning rate {learning_rate_anr_capex}: {len(results)} plants deployed in {time.time()-start:.2f} s')
+  return pd.DataFrame(results), dict(zip(params['G'], units))
+
+
+def solve_plant_milp(models, key, site, anr_capex, ANR_data, H2_data, wacc, solver, plant_balance):
+  """Solves a plant with its persistent sweep model and solver at the given ANR CAPEX, the model, solver and last
+  solution are kept in models under key and the solve is skipped if the CAPEX vector did not change"""
+  if key in models and np.array_equal(models[key]['ANR CAPEX'], anr_capex):
+    return models[key]['deployment']
+  step_ANR_data = ANR_data.copy()
+  step_ANR_data['CAPEX $/MWe'] = anr_capex
+  step_params = deployment_model.get_deployment_params(step_ANR_data, H2_data, wacc=wacc)
+  if key not in models:
+    model = deployment_model.build_sweep_model(step_params, site['H2 demand (kg/day)'], site['Electricity demand (MWe)'],
+                                               site['max modules'], plant_balance)
+    models[key] = {'model':model, 'solver':solver_config.get_persistent_solver(solver)}
+  else:
+    deployment_model.set_sweep_params(models[key]['model'], step_params)
+  deployment = deployment_model.solve_sweep_model(models[key]['model'], models[key]['solver'])
+  models[key].update({'ANR CAPEX':anr_capex.copy(), 'deployment':deployment})
+  return deployment
+
+
+def add_avoided_emissions(results):
+  """Adds the 'Ann. avoided CO2 emissions (MMT-CO2/year)' of each plant compared to its fossil pathway, as in
+  deployment_w_learning.ipynb"""
+  if len(results) == 0:
+    return results
+  baseline = pd.Series(np.nan, index=results.index) # tCO2/year
+  industry = results['Industry']
+  # Only the ammonia results have the ammonia capacity column
+  if (industry == 'ammonia').any():
+    baseline[industry == 'ammonia'] = results['Ammonia capacity (tNH3/year)']*utils.nh3_carbon_intensity
+  baseline[industry == 'refining'] = results['H2 Dem. (kg/day)']*365*utils.smr_carbon_intensity/1e3
+  steel = industry == 'steel'
+  baseline[steel] = [demand_registry.get_plant('steel', plant)['GHG QUANTITY (METRIC TONS CO2e)']
+                     for plant in results.loc[steel, 'id']]
+  results['Ann. avoided CO2 emissions (MMT-CO2/year)'] = (baseline-results['Ann. CO2 emissions (kgCO2eq/year)']/1e3)/1e6
+  return results
+
+
+def main(learning_rates=(LEARNING_RATE_ANR_CAPEX,), industries=INDUSTRIES, anr_tag='FOAK', wacc=utils.WACC,
+         interleave=False, backend='fast', plants=None, save=True):
+  """Learning trajectories of all industries for each learning rate, the plants are ordered once with FOAK costs and
+  their Pareto fronts (or persistent models) are shared by all trajectories
+  Returns:
+    results (DataFrame): results of all trajectories
+  """
+  abspath = os.path.abspath(__file__)
+  dname = os.path.dirname(abspath)
+  os.chdir(dname)
+  ANR_data, H2_data = utils.load_data(anr_tag=anr_tag)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  start = time.time()
+  sites = get_plants(industries, plants)
+  fronts = [compute_pareto_fronts(params, site['H2 demand (kg/day)'], site['Electricity demand (MWe)'], site['max modules'])
+            for _, _, site in sites]
+  ordered_sites = order_plants(sites, ANR_data, H2_data, fronts, wacc=wacc, interleave=interleave)
+  print(f'Pareto fronts and order of {len(sites)} plants in {time.time()-start:.2f} s')
+  models = {}
+  trajectories = [run_learning_trajectory(ordered_sites, ANR_data, H2_data, lr, wacc=wacc, backend=backend,
+                                          models=models)[0] for lr in learning_rates]
+  trajectories = [add_avoided_emissions(trajectory) for trajectory in trajectories]
+  results = pd.concat(trajectories, ignore_index=True)
+  if save:
+    for lr, trajectory in zip(learning_rates, trajectories):
+      with pd.ExcelWriter(LEARNING_RESULTS.format(learning_rate=lr)) as writer:
+        for industry in industries:
+          trajectory[trajectory['Industry'] == industry].to_excel(writer, sheet_name=industry, index=False)
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-l', '--learning-rates', type=float, nargs='+', default=[LEARNING_RATE_ANR_CAPEX],
+                      help='Learning rates of the ANR CAPEX')
+  parser.add_argument('-i', '--industries', nargs='+', default=INDUSTRIES, help='Industries in order of deployment')
+  parser.add_argument('--interleave', action='store_true', help='Order the plants of all industries together')
+  parser.add_argument('--milp', action='store_true', help='Solve each plant with its persistent MILP instead of the Pareto fronts')
+  args = parser.parse_args()
+  main(learning_rates=args.learning_rates, industries=args.industries, interleave=args.interleave,
+       backend='milp' if args.milp else 'fast')
@@ -0,0 +1,356 @@
+import numpy as np
+import pandas as pd
+import os
+import time
+import argparse
+from multiprocessing import Pool
+import utils
+import deployment_model
+import sensitivity
+import demand_registry
+
+"""Monte Carlo propagation of the uncertainty on the ANR and H2 techno-economic parameters (ANRs.xlsx, h2_tech.xlsx)
+and on utils constants to the deployment, breakeven prices and net revenues of all plants.
+Samples are multipliers of the nominal values with triangular marginals, drawn by Latin hypercube or Sobol sequence and
+correlated through a Gaussian copula.
+For each plant and sample, the cheapest of the deployments already found at the plant is compared with a lower bound on
+the costs of all deployments (ANR modules of integer H2 module packings and integer H2 modules of each design): if it is
+within GAP_TOL of the bound it is kept without solving, its cost then being at most GAP_TOL above the optimum,
+otherwise the sample is solved exactly with deployment_model.fast_solve (or the MILP) and the new deployment is added to
+the candidates. The screened fraction and the largest cost gap of the screened samples are reported for each plant. Economics of all samples are then evaluated analytically.
+Plants are evaluated in parallel and only percentile bands and industry totals per sample are kept."""
+
+# Multipliers of the nominal values: (low, mode, high) of triangular distributions
+UNCERTAINTIES = {'ANR CAPEX':(0.7, 1., 1.5),
+                 'ANR FOM':(0.8, 1., 1.2),
+                 'ANR VOM':(0.8, 1., 1.2),
+                 'ANR life':(0.75, 1., 1.),
+                 'H2 CAPEX':(0.7, 1., 1.3),
+                 'H2 FOM':(0.8, 1., 1.2),
+                 'H2 VOM':(0.8, 1., 1.2),
+                 'H2 efficiency':(0.95, 1., 1.05),
+                 'H2 life':(0.75, 1., 1.25),
+                 'WACC':(0.8, 1., 1.3),
+                 'NG price':(0.7, 1., 1.5)}
+# Rank correlations between uncertainties, the others are independent
+CORRELATION = {('ANR CAPEX', 'ANR FOM'):0.5, ('H2 CAPEX', 'H2 FOM'):0.5, ('ANR CAPEX', 'H2 CAPEX'):0.3}
+PERCENTILES = (5, 50, 95)
+# Relative cost gap to the lower bound below which a candidate deployment is kept without solving: costs and breakeven
+# prices of the screened samples are within GAP_TOL of the optimum, net revenues (differences of costs) can differ more
+GAP_TOL = 1e-3
+CHUNK_SIZE = 256
+METRICS = ['Breakeven price ($/MMBtu)', 'BE wo PTC ($/MMBtu)', 'Net Revenues ($/year)', 'Net Revenues with H2 PTC ($/year)',
+           'Depl. ANR Cap. (MWe)']
+MC_RESULTS = './results/monte_carlo_anr_{anr_tag}.xlsx'
+
+
+def draw_samples(n_samples, uncertainties=UNCERTAINTIES, correlation=CORRELATION, method='lhs', seed=0):
+  """Correlated samples of the multipliers
+  Args:
+    n_samples (int): number of samples, a power of 2 for 'sobol'
+    uncertainties (dict): name to (low, mode, high) multipliers
+    correlation (dict): (name, name) to correlation of the underlying normal variables
+    method (str): 'lhs' or 'sobol'
+    seed (int): seed of the sampler
+  Returns:
+    samples (DataFrame): one row per sample, one column per uncertainty
+  """
+  from scipy.stats import qmc, norm, triang
+  names = list(uncertainties)
+  if method == 'sobol':
+    sampler = qmc.Sobol(d=len(names), scramble=True, seed=seed)
+  else:
+    sampler = qmc.LatinHypercube(d=len(names), seed=seed)
+  u = np.clip(sampler.random(n_samples), 1e-12, 1-1e-12)
+  if correlation:
+    corr = np.eye(len(names))
+    for (a, b), rho in correlation.items():
+      corr[names.index(a), names.index(b)] = corr[names.index(b), names.index(a)] = rho
+    u = norm.cdf(norm.ppf(u)@np.linalg.cholesky(corr).T)
+  samples = {}
+  for j, name in enumerate(names):
+    low, mode, high = uncertainties[name]
+    samples[name] = triang.ppf(u[:,j], c=(mode-low)/(high-low), loc=low, scale=high-low) if high > low else np.full(n_samples, mode)
+  return pd.DataFrame(samples)
+
+
+def get_sample_params(params, samples, wacc=utils.WACC):
+  """Deployment parameters of each sample as arrays with a leading sample axis, as deployment_model.get_deployment_params
+  Returns:
+    stacked (dict): sampled arrays of the params keys, and 'wacc' and 'NG price' of each sample
+  """
+  def multiplier(name):
+    return samples[name].to_numpy(dtype=np.float64)[:,None] if name in samples else np.ones((len(samples), 1))
+  stacked = {'wacc':wacc*multiplier('WACC')[:,0], 'NG price':multiplier('NG price')[:,0]}
+  anr_life = np.log(1/(1-wacc/params['anr_crf']))/np.log(1+wacc)
+  h2_life = np.log(1/(1-wacc/params['h2_crf']))/np.log(1+wacc)
+  stacked['anr_capex'] = params['anr_capex']*multiplier('ANR CAPEX')
+  stacked['anr_fom'] = params['anr_fom']*multiplier('ANR FOM')
+  stacked['anr_vom'] = params['anr_vom']*multiplier('ANR VOM')
+  stacked['anr_crf'] = deployment_model.compute_crf(stacked['wacc'][:,None], anr_life*multiplier('ANR life'))
+  stacked['h2_capex'] = params['h2_capex']*multiplier('H2 CAPEX')
+  stacked['h2_fom'] = params['h2_fom']*multiplier('H2 FOM')
+  stacked['h2_vom'] = params['h2_vom']*multiplier('H2 VOM')
+  stacked['h2_crf'] = deployment_model.compute_crf(stacked['wacc'][:,None], h2_life*multiplier('H2 life'))
+  stacked['h2_cap_h2'] = params['h2_cap_h2']*multiplier('H2 efficiency')
+  stacked['module_cost'] = params['anr_cap']*((stacked['anr_capex']*(1-utils.ITC_ANR)*stacked['anr_crf']+stacked['anr_fom'])\
+                                              +stacked['anr_vom']*deployment_model.HOURS_PER_YEAR)
+  stacked['h2_unit_cost'] = params['h2_cap_elec'][None]*(stacked['h2_capex']*(1-utils.ITC_H2)*stacked['h2_crf']\
+                            +stacked['h2_fom']+stacked['h2_vom']*deployment_model.HOURS_PER_YEAR)[:,:,None]
+  return stacked
+
+
+def select_params(params, stacked, i):
+  """Deployment parameters of sample i, usable by fast_solve and the MILP"""
+  return dict(params, wacc=stacked['wacc'][i], **{key:stacked[key][i] for key in stacked if key not in ('wacc', 'NG price')})
+
+
+def get_packing_patterns(C, s, eps=1e-9):
+  """Numbers of H2 modules of each technology fitting in an ANR module of capacity C (MWe), the technology with the
+  lowest electric capacity filling the remaining capacity
+  Returns:
+    patterns (ndarray): shape (patterns, H), 0 for the technologies not available with the design
+  """
+  valid = np.flatnonzero(~np.isnan(s))
+  f = valid[np.argmin(s[valid])]
+  m = [h for h in valid if h != f]
+  grid = np.indices(tuple(int(np.floor(C/s[h]+eps))+1 for h in m)).reshape(len(m), -1).T
+  loads = grid@s[m]
+  fits = loads <= C+eps
+  patterns = np.zeros((int(fits.sum()), len(s)))
+  patterns[:,m] = grid[fits]
+  patterns[:,f] = np.floor((C-loads[fits])/s[f]+eps)
+  return patterns
+
+
+def get_lower_bounds(params, stacked, h2_dem_kg_per_day, elec_dem_MWe, max_modules, eps=1e-9):
+  """Lower bound on the costs ($/year) of any deployment at a plant for each sample, the sum for each design of:
+  - the ANR modules: at least the H2 demand over the largest H2 production of the integer H2 modules fitting in a
+    module, and the electricity demand at the lowest electricity per kg,
+  - the H2 modules: the cheapest technology per kg alone with an integer number of modules, or any mix, which costs at
+    least the continuous cost of the cheapest technology plus the smallest extra cost of one module of another one
+  """
+  D, E = h2_dem_kg_per_day, elec_dem_MWe
+  r = stacked['h2_cap_h2']*24
+  rows = np.arange(len(r))
+  bounds = np.full(len(r), np.inf)
+  for g in range(len(params['G'])):
+    s = params['h2_cap_elec'][:,g]
+    valid = np.flatnonzero(~np.isnan(s))
+    if len(valid) == 0:
+      continue
+    module_h2 = np.max(r@get_packing_patterns(params['anr_cap'][g], s, eps).T, axis=1)
+    N_min = np.maximum.reduce([np.ones(len(r)), np.ceil(D/module_h2-eps),
+                               np.ceil((E+D*np.min(s[valid]/r[:,valid], axis=1))/params['anr_cap'][g]-eps)])
+    k, r_g = stacked['h2_unit_cost'][:,valid,g], r[:,valid]
+    a = np.argmin(k/r_g, axis=1)
+    k_a, r_a = k[rows,a], r_g[rows,a]
+    h2_bound = k_a*np.maximum(0, np.ceil(D/r_a-eps))
+    if len(valid) > 1:
+      extra = k-k_a[:,None]*r_g/r_a[:,None]
+      extra[rows,a] = np.inf
+      h2_bound = np.minimum(h2_bound, k_a*D/r_a+np.maximum(0, extra.min(axis=1)))
+    bound = stacked['module_cost'][:,g]*N_min+h2_bound
+    bounds = np.minimum(bounds, np.where(N_min <= max_modules, bound, np.inf))
+  return bounds
+
+
+def get_candidate_costs(params, stacked, candidates, h2_dem_kg_per_day, eps=1e-9):
+  """Costs ($/year) of the candidate deployments for each sample, inf where the H2 demand is not met
+  Returns:
+    costs (ndarray): shape (samples, candidates)
+  """
+  r = stacked['h2_cap_h2']*24
+  costs = np.full((len(r), len(candidates)), np.inf)
+  for k, deployment in enumerate(candidates):
+    g = params['G'].index(deployment['ANR type'])
+    q = np.array([deployment['H2 modules'][h] for h in params['H']], dtype=float)
+    used = q > 0
+    cost = stacked['module_cost'][:,g]*deployment['# ANR modules']+stacked['h2_unit_cost'][:,used,g]@q[used]
+    costs[:,k] = np.where(r[:,used]@q[used] >= h2_dem_kg_per_day*(1-eps), cost, np.inf)
+  return costs
+
+
+def solve_sample(params, site, backend='fast', plant_balance=True):
+  """Exact deployment of a plant for one sample, with fast_solve or the MILP"""
+  D, E, max_modules = site['H2 demand (kg/day)'], site['Electricity demand (MWe)'], site['max modules']
+  if backend == 'milp':
+    matrix = deployment_model.build_deployment_matrix(params, D, E, max_modules, plant_balance)
+    return deployment_model.solve_deployment_matrix(params, matrix)
+  return deployment_model.fast_solve(params, D, E, max_modules)
+
+
+def compute_economics(industry, results_ref, params, stacked, candidates, choice, base_wacc=utils.WACC):
+  """Costs, net revenues and breakeven prices of the chosen deployment of each sample, as compile_*_results
+  Args:
+    industry (str): industry of the plant
+    results_ref (dict): results of the plant at nominal values
+    params (dict): nominal deployment parameters
+    stacked (dict): from get_sample_params
+    candidates (list[dict]): deployments of the plant
+    choice (ndarray): index of the deployment of each sample in candidates
+  Returns:
+    economics (dict): arrays of the METRICS over the samples
+  """
+  g = np.array([params['G'].index(d['ANR type']) for d in candidates])[choice]
+  N = np.array([d['# ANR modules'] for d in candidates], dtype=float)[choice]
+  q = np.array([[d['H2 modules'][h] for h in params['H']] for d in candidates], dtype=float)[choice]
+  rows = np.arange(len(choice))
+  h2_cap_elec = np.nan_to_num(params['h2_cap_elec'][:,g].T)*q
+  capacity = N*params['anr_cap'][g]
+  costs = capacity*(stacked['anr_capex'][rows,g]*(1-utils.ITC_ANR)*stacked['anr_crf'][rows,g]+stacked['anr_fom'][rows,g]
+                    +stacked['anr_vom'][rows,g]*deployment_model.HOURS_PER_YEAR)
+  costs += np.sum(h2_cap_elec*(stacked['h2_capex']*(1-utils.ITC_H2)*stacked['h2_crf']+stacked['h2_fom']
+                               +stacked['h2_vom']*deployment_model.HOURS_PER_YEAR), axis=1)
+  results_df = pd.DataFrame([results_ref])
+  conv_capital = sensitivity.get_conversion_capital(industry, results_df, base_wacc)[0]
+  conversion = results_ref['Conversion costs ($/year)']-conv_capital\
+               +conv_capital*deployment_model.compute_crf(stacked['wacc'], sensitivity.CONVERSION_LIFE)\
+               /deployment_model.compute_crf(base_wacc, sensitivity.CONVERSION_LIFE)
+  be_inputs = {name:results_ref[name] for name in ['H2 Dem. (kg/day)', 'Ammonia capacity (tNH3/year)', 'Steel prod. (ton/year)']
+               if name in results_ref}
+  be_inputs['Net Revenues ($/year)'] = -costs-conversion
+  be_inputs['Net Revenues with H2 PTC ($/year)'] = be_inputs['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
+  be_function, be_wo_ptc_function = sensitivity.get_breakeven_functions(industry)
+  avoided = results_ref['Avoided NG costs ($/year)']*stacked['NG price']
+  return {'Breakeven price ($/MMBtu)':be_function(be_inputs), 'BE wo PTC ($/MMBtu)':be_wo_ptc_function(be_inputs),
+          'Net Revenues ($/year)':be_inputs['Net Revenues ($/year)']+avoided,
+          'Net Revenues with H2 PTC ($/year)':be_inputs['Net Revenues with H2 PTC ($/year)']+avoided,
+          'Depl. ANR Cap. (MWe)':capacity}
+
+
+def evaluate_plant(industry, plant, ANR_data, H2_data, samples, wacc=utils.WACC, backend='fast', gap_tol=GAP_TOL,
+                   percentiles=PERCENTILES, chunk_size=CHUNK_SIZE):
+  """Deployment and economics of a plant for all samples
+  Returns:
+    bands (dict): percentiles of the METRICS at the plant and solve statistics, None if infeasible at nominal values
+    totals (dict): arrays over the samples of the plant contributions to the industry totals
+  """
+  start = time.time()
+  site = demand_registry.get_site(industry, plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  nominal = deployment_model.fast_solve(params, site['H2 demand (kg/day)'], site['Electricity demand (MWe)'], site['max modules'])
+  if nominal is None:
+    return None, None
+  results_ref = site['compile results'](plant, ANR_data, H2_data, nominal, wacc=wacc)
+  candidates, choice, solved = [nominal], np.full(len(samples), -1), 0
+  gaps = np.zeros(len(samples))
+  for chunk_start in range(0, len(samples), chunk_size):
+    chunk = np.arange(chunk_start, min(chunk_start+chunk_size, len(samples)))
+    stacked = get_sample_params(params, samples.iloc[chunk], wacc)
+    costs = get_candidate_costs(params, stacked, candidates, site['H2 demand (kg/day)'])
+    bounds = get_lower_bounds(params, stacked, site['H2 demand (kg/day)'], site['Electricity demand (MWe)'], site['max modules'])
+    best = np.argmin(costs, axis=1)
+    kept = costs[np.arange(len(chunk)), best] <= bounds*(1+gap_tol)
+    choice[chunk[kept]] = best[kept]
+    # Upper bound on the relative cost error of the screened samples, 0 for the solved ones
+    gaps[chunk[kept]] = costs[np.arange(len(chunk)), best][kept]/bounds[kept]-1
+    for i in np.flatnonzero(~kept):
+      deployment = solve_sample(select_params(params, stacked, i), site, backend, industry != 'refining')
+      solved += 1
+      if deployment is None:
+        continue
+      deployment = {key:deployment[key] for key in ['ANR type', '# ANR modules', 'H2 modules']}
+      if deployment not in candidates:
+        candidates.append(deployment)
+      choice[chunk[i]] = candidates.index(deployment)
+  feasible = choice >= 0
+  stacked = get_sample_params(params, samples[feasible], wacc)
+  economics = compute_economics(industry, results_ref, params, stacked, candidates, choice[feasible], wacc)
+  bands = {'Industry':industry, 'id':plant, 'state':results_ref['state'], 'Nominal ANR type':nominal['ANR type'],
+           'Nominal # ANR modules':nominal['# ANR modules'], 'Feasible samples':int(feasible.sum()),
+           'Same deployment (%)':100*np.mean(choice[feasible] == 0),
+           'Same ANR type (%)':100*np.mean([candidates[k]['ANR type'] == nominal['ANR type'] for k in choice[feasible]]),
+           'Solved samples':solved, 'Screened samples (%)':100*(1-solved/len(samples)),
+           'Max cost gap (%)':100*gaps.max(initial=0), 'Cost gap tolerance (%)':100*gap_tol,
+           '# deployments':len(candidates)}
+  for metric in METRICS:
+    bands[f'Nominal {metric}'] = results_ref[metric]
+    for p, value in zip(percentiles, np.percentile(economics[metric], percentiles)):
+      bands[f'{metric} P{p}'] = value
+  totals = {name:np.zeros(len(samples)) for name in ['Depl. ANR Cap. (MWe)', 'Net Revenues with H2 PTC ($/year)',
+                                                     'Viable ANR Cap. (MWe)', 'Viable ANR Cap. w PTC (MWe)']}
+  totals['Depl. ANR Cap. (MWe)'][feasible] = economics['Depl. ANR Cap. (MWe)']
+  totals['Net Revenues with H2 PTC ($/year)'][feasible] = economics['Net Revenues with H2 PTC ($/year)']
+  totals['Viable ANR Cap. (MWe)'][feasible] = economics['Depl. ANR Cap. (MWe)']*(economics['Net Revenues ($/year)'] > 0)
+  totals['Viable ANR Cap. w PTC (MWe)'][feasible] = economics['Depl. ANR Cap. (MWe)']\
+                                                    *(economics['Net Revenues with H2 PTC ($/year)'] > 0)
+  bands['Time (s)'] = time.time()-start
+  return bands, totals
+
+
+def _evaluate_plant_task(args):
+  return args[0], evaluate_plant(*args)
+
+
+def run_monte_carlo(samples, industries=demand_registry.INDUSTRIES, anr_tag='FOAK', wacc=utils.WACC, backend='fast',
+                    gap_tol=GAP_TOL, percentiles=PERCENTILES, workers=10, plants=None):
+  """Percentile bands of all plants and industries over the samples, plants evaluated in parallel
+  Args:
+    samples (DataFrame): from draw_samples
+    industries (list[str]): industries to evaluate
+    anr_tag (str): ANR cost sheet
+    wacc (float): nominal WACC
+    backend (str): 'fast' or 'milp', exact solver of the samples not covered by the candidates
+    gap_tol (float): relative gap below which a candidate deployment is kept without solving, 0 solves all samples
+    percentiles (tuple): percentiles of the bands
+    workers (int): number of processes
+    plants (dict): industry to list of plant ids, all plants by default
+  Returns:
+    sites_df (DataFrame): bands of each plant
+    industries_df (DataFrame): bands of the industry totals (deployed and viable capacities, net revenues)
+  """
+  ANR_data, H2_data = utils.load_data(anr_tag=anr_tag)
+  registry = demand_registry.get_registry(industries)
+  tasks = [(industry, plant, ANR_data, H2_data, samples, wacc, backend, gap_tol, percentiles)
+           for industry in industries
+           for plant in (plants[industry] if plants is not None and industry in plants else demand_registry.get_plant_ids(industry))]
+  sites, totals = [], {}
+  with Pool(workers, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+    # Only the bands and the running industry totals are kept in memory
+    for industry, (bands, plant_totals) in pool.imap_unordered(_evaluate_plant_task, tasks):
+      if bands is None:
+        continue
+      sites.append(bands)
+      for name, values in plant_totals.items():
+        totals.setdefault(industry, {}).setdefault(name, np.zeros(len(samples)))
+        totals[industry][name] += values
+  industries_bands = []
+  for industry, industry_totals in totals.items():
+    for name, values in industry_totals.items():
+      row = {'Industry':industry, 'Metric':name}
+      row.update({f'P{p}':value for p, value in zip(percentiles, np.percentile(values, percentiles))})
+      row['Mean'] = values.mean()
+      industries_bands.append(row)
+  return pd.DataFrame(sites), pd.DataFrame(industries_bands)
+
+
+def main(n_samples=1024, method='lhs', seed=0, anr_tag='FOAK', backend='fast', workers=10):
+  abspath = os.path.abspath(__file__)
+  dname = os.path.dirname(abspath)
+  os.chdir(dname)
+  start = time.time()
+  samples = draw_samples(n_samples, method=method, seed=seed)
+  sites_df, industries_df = run_monte_carlo(samples, anr_tag=anr_tag, backend=backend, workers=workers)
+  print(f'{n_samples} samples of {len(sites_df)} plants in {time.time()-start:.1f} s, '
+        f'{sites_df["Solved samples"].sum()} samples solved, {sites_df["Screened samples (%)"].mean():.1f}% screened '
+        f'with a cost gap to the lower bound of at most {sites_df["Max cost gap (%)"].max():.3f}% '
+        f'(tolerance {100*GAP_TOL:.1f}%)')
+  print(industries_df)
+  with pd.ExcelWriter(MC_RESULTS.format(anr_tag=anr_tag)) as writer:
+    samples.to_excel(writer, sheet_name='samples', index=False)
+    sites_df.to_excel(writer, sheet_name='sites', index=False)
+    industries_df.to_excel(writer, sheet_name='industries', index=False)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n', '--samples', type=int, default=1024, help='Number of samples')
+  parser.add_argument('-m', '--method', choices=['lhs', 'sobol'], default='lhs', help='Sampling method')
+  parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the sampler')
+  parser.add_argument('-a', '--anr-tag', default='FOAK', help='ANR cost sheet')
+  parser.add_argument('--milp', action='store_true', help='Solve the samples not covered by the candidates with the MILP')
+  parser.add_argument('-w', '--workers', type=int, default=10, help='Number of processes')
+  args = parser.parse_args()
+  main(n_samples=args.samples, method=args.method, seed=args.seed, anr_tag=args.anr_tag,
+       backend='milp' if args.milp else 'fast', workers=args.workers)
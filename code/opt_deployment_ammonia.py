@@ -2,8 +2,14 @@ from pyomo.environ import *
 import pandas as pd
 import numpy as np
 import os
+import time
 from utils import load_data
 import utils
+import demand_registry
+import deployment_model
+import solver_config
+import results_cache
+import sys
 from multiprocessing import Pool
 
 WACC = utils.WACC
@@ -21,17 +27,16 @@ ngNH3ConsRate = 30.82# MMBtu/tNH3
 ngNH3ElecCons = 0.061 # MWh/tNH3
 
 def get_ammonia_plant_demand(plant):
-  ammonia_df = pd.read_excel('./h2_demand_ammonia_us_2022.xlsx', sheet_name='processed')
-  plant_df = ammonia_df[ammonia_df['id'] == plant]
-  h2_demand_kg_per_day = float(plant_df['H2 Dem. (kg/year)'].iloc[0])/365
-  elec_demand_MWe = float(plant_df['Electricity demand (MWe)'].iloc[0])
-  ammonia_capacity = float(plant_df['Capacity (tNH3/year)'].iloc[0])
-  state = plant_df['State'].iloc[0].strip()
-  lat = plant_df['latitude'].iloc[0]
-  lon = plant_df['longitude'].iloc[0]
+  plant_row = demand_registry.get_plant('ammonia', plant)
+  h2_demand_kg_per_day = float(plant_row['H2 Dem. (kg/year)'])/365
+  elec_demand_MWe = float(plant_row['Electricity demand (MWe)'])
+  ammonia_capacity = float(plant_row['Capacity (tNH3/year)'])
+  state = plant_row['State'].strip()
+  lat = plant_row['latitude']
+  lon = plant_row['longitude']
   return ammonia_capacity, h2_demand_kg_per_day, elec_demand_MWe, state, lat, lon
 
-def build_ammonia_plant_deployment(plant, ANR_data, H2_data): 
+def build_ammonia_plant_deployment(plant, ANR_data, H2_data, formulation='slots'): 
   print(f'Ammonia plant {plant} : start solving')
   model = ConcreteModel(plant)
 
@@ -176,121 +181,124 @@ def build_ammonia_plant_deployment(plant, ANR_data, H2_data):
             <= sum(model.pANRCap[g]*model.vM[n,g] for n in model.N)
   model.energy_balance_plant = Constraint(model.G, rule = energy_balance_plant)
 
+  if formulation == 'ordered':
+    deployment_model.add_symmetry_breaking(model)
+
   
   return model
 
 
-def solve_ammonia_plant_deployment(ANR_data, H2_data, plant, print_results):
-  model = build_ammonia_plant_deployment(plant, ANR_data, H2_data)
-  ammonia_capacity, h2_dem_kg_per_day, elec_dem_MWh_per_day, state, lat, lon = get_ammonia_plant_demand(plant)
-  # for carbon accounting
-  def compute_annual_carbon_emissions(model):
-    return sum(sum(sum(model.pH2CarbonInt[h,g]*model.vQ[n,h,g]*model.pH2CapH2[h]*24*365 for g in model.G) for h in model.H) for n in model.N)
-  
-  def compute_anr_capex(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR)*model.pANRCRF[g]for g in model.G) for n in model.N) 
-  
-  def compute_anr_om(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*(model.pANRFC[g]+model.pANRVOM[g]*365*24) for g in model.G) for n in model.N) 
-  
-  def compute_h2_capex(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*model.pH2CAPEX[h]*(1-model.pITC_H2)*model.pH2CRF[h] for h in model.H) for g in model.G) for n in model.N) 
-  
-  def compute_h2_om(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2FC[h]+model.pH2VOM[h]*365*24) for h in model.H) for g in model.G) for n in model.N) 
-
-  def get_crf(model):
-    return sum(model.vS[g]*model.pANRCRF[g] for g in model.G)
-  
-  def get_anr_capex(model):
-    return sum(model.pANRCAPEX[g]*model.vS[g] for g in model.G)
-  
-  def compute_conv_costs(model):
-    crf = model.pWACC / (1 - (1/(1+model.pWACC)**auxNucNH3LT) ) 
-    costs =auxNucNH3CAPEX*crf*(1-model.pITC_H2)
-    return costs
-  
-  def get_deployed_cap(model):
-    return sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-  
-  def annualized_avoided_ng_costs(model):
-    ng_price = utils.get_ng_price_aeo(model.pState)
-    avoided_costs = utils.nh3_nrj_intensity*model.pNH3Cap*ng_price 
-    return avoided_costs
-  
-  def get_eq_elec_dem_h2(model): return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) for g in model.G) for n in model.N) 
-  def compute_surplus_capacity(model):
-    deployed_capacity = sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-    aux_elec_demand = elec_dem_MWh_per_day/24
-    h2_elec_demand  = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) for g in model.G) for n in model.N) 
-    return deployed_capacity - aux_elec_demand - h2_elec_demand
-
-  def compute_initial_investment(model):
-    anr_capex = sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR) for g in model.G) for n in model.N)
-    h2_capex = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2CAPEX[h]*(1-model.pITC_H2)) for h in model.H) for g in model.G) for n in model.N)
-    conversion_costs = auxNucNH3CAPEX*(1-model.pITC_H2)
-    Co = anr_capex + h2_capex +conversion_costs 
-    return Co
-
-  ############## SOLVE ###################
-  solver = SolverFactory('cplex')
-  solver.options['timelimit'] = 240
-  solver.options['mip pool relgap'] = 0.02
-  solver.options['mip tolerances absmipgap'] = 1e-4
-  solver.options['mip tolerances mipgap'] = 5e-3
-  results = solver.solve(model, tee = print_results)
+def compile_ammonia_results(plant, ANR_data, H2_data, deployment, wacc=WACC, other_revenues=0):
+  """Computes the results of an ANR-H2 deployment at an ammonia plant, shared by all solution methods
+  Args:
+    plant (str): id of the ammonia plant
+    ANR_data (DataFrame): ANR parameters
+    H2_data (DataFrame): H2 technologies parameters
+    deployment (dict): 'ANR type', '# ANR modules' and 'H2 modules' (technology to number of modules)
+    wacc (float): weighted average cost of capital
+  Returns:
+    results_ref (dict): results of the deployment
+  """
+  ammonia_capacity, h2_dem_kg_per_day, elec_dem_MWe, state, lat, lon = get_ammonia_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  costs = deployment_model.compute_deployment_costs(params, deployment)
+  conv_costs = auxNucNH3CAPEX*deployment_model.compute_crf(wacc, auxNucNH3LT)*(1-ITC_H2)
 
   results_ref = {}
   results_ref['id'] = plant
-  results_ref['state'] = value(model.pState)
+  results_ref['state'] = state
   results_ref['State price ($/MMBtu)'] = utils.get_ng_price_aeo(results_ref['state'])
   results_ref['latitude'] = lat
   results_ref['longitude'] = lon
   results_ref['Ammonia capacity (tNH3/year)'] = ammonia_capacity
   results_ref['H2 Dem. (kg/day)'] = h2_dem_kg_per_day
-  results_ref['ANR CAPEX ($/MWe)'] = value(get_anr_capex(model))
-  results_ref['Aux Elec Dem. (MWe)'] = elec_dem_MWh_per_day/24
-  results_ref['Net Revenues ($/year)'] = value(model.NetRevenues)
+  results_ref['ANR CAPEX ($/MWe)'] = costs['ANR CAPEX ($/MWe)']
+  results_ref['Aux Elec Dem. (MWe)'] = elec_dem_MWe/24
+  results_ref['Net Revenues ($/year)'] = -conv_costs-costs['Total costs ($/year)']+other_revenues
   results_ref['H2 PTC Revenues ($/year)'] = h2_dem_kg_per_day*365*utils.h2_ptc
   results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
-  for h in model.H:
+  for h in params['H']:
     results_ref[h] = 0
+  results_ref['Ann. CO2 emissions (kgCO2eq/year)'] = costs['H2 CO2 emissions (kgCO2eq/year)']
+  results_ref['Initial investment ($)'] = costs['ANR investment ($)']+costs['H2 investment ($)']+auxNucNH3CAPEX*(1-ITC_H2)
+  results_ref['ANR CAPEX ($/year)'] = costs['ANR CAPEX ($/year)']
+  results_ref['ANR CRF'] = costs['ANR CRF']
+  results_ref['Depl. ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)']
+  results_ref['Depl H2 Cap. (MWe)'] = costs['Depl H2 Cap. (MWe)']
+  results_ref['H2 CAPEX ($/year)'] = costs['H2 CAPEX ($/year)']
+  results_ref['ANR O&M ($/year)'] = costs['ANR O&M ($/year)']
+  results_ref['H2 O&M ($/year)'] = costs['H2 O&M ($/year)']
+  results_ref['Conversion costs ($/year)'] = conv_costs
+  results_ref['Avoided NG costs ($/year)'] = utils.nh3_nrj_intensity*ammonia_capacity*utils.get_ng_price_aeo(state)
+  results_ref['Breakeven price ($/MMBtu)'] = compute_ng_breakeven_price(results_ref) # Compute BE price before adding avoided ng costs!
+  results_ref['BE wo PTC ($/MMBtu)'] = compute_ng_be_without_ptc(results_ref)
+  results_ref['Net Revenues ($/year)'] +=results_ref['Avoided NG costs ($/year)']
+  # Recalculate revenues with H2 PTC: add revenues from avoided NG costs
+  results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
+  results_ref['Surplus ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)'] - elec_dem_MWe/24 - costs['Depl H2 Cap. (MWe)']
+  results_ref['Net Annual Revenues ($/MWe/y)'] = (results_ref['Net Revenues ($/year)'])/results_ref['Depl. ANR Cap. (MWe)']
+  results_ref['Net Annual Revenues with H2 PTC ($/MWe/y)'] = results_ref['Net Revenues with H2 PTC ($/year)']/results_ref['Depl. ANR Cap. (MWe)']
+  results_ref['ANR type'] = deployment['ANR type']
+  results_ref['# ANR modules'] = deployment['# ANR modules']
+  for h in params['H']:
+    results_ref[h] += deployment['H2 modules'][h]
+  return results_ref
+
+
+def solve_ammonia_plant_deployment(ANR_data, H2_data, plant, print_results, formulation='slots', solver='cplex'):
+  start = time.time()
+  model = build_ammonia_plant_deployment(plant, ANR_data, H2_data, formulation=formulation)
+  build_time = time.time()-start
+
+  ############## SOLVE ###################
+  opt = solver_config.get_solver(solver)
+  start = time.time()
+  results = opt.solve(model, tee = print_results)
+  solve_time = time.time()-start
+
   if results.solver.termination_condition == TerminationCondition.optimal: 
     model.solutions.load_from(results)
-    results_ref['Ann. CO2 emissions (kgCO2eq/year)'] = value(compute_annual_carbon_emissions(model))
-    results_ref['Initial investment ($)'] = value(compute_initial_investment(model))
-    results_ref['ANR CAPEX ($/year)'] = value(compute_anr_capex(model))
-    results_ref['ANR CRF'] = value(get_crf(model))
-    results_ref['Depl. ANR Cap. (MWe)'] = value(get_deployed_cap(model))
-    results_ref['Depl H2 Cap. (MWe)'] = value(get_eq_elec_dem_h2(model))
-    results_ref['H2 CAPEX ($/year)'] = value(compute_h2_capex(model))
-    results_ref['ANR O&M ($/year)'] = value(compute_anr_om(model))
-    results_ref['H2 O&M ($/year)'] = value(compute_h2_om(model))
-    results_ref['Conversion costs ($/year)'] = value(compute_conv_costs(model))
-    results_ref['Avoided NG costs ($/year)'] = value(annualized_avoided_ng_costs(model))
-    results_ref['Breakeven price ($/MMBtu)'] = compute_ng_breakeven_price(results_ref) # Compute BE price before adding avoided ng costs!
-    results_ref['BE wo PTC ($/MMBtu)'] = compute_ng_be_without_ptc(results_ref)
-    results_ref['Net Revenues ($/year)'] +=results_ref['Avoided NG costs ($/year)']
-    # Recalculate revenues with H2 PTC: add revenues from avoided NG costs
-    results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
-    results_ref['Surplus ANR Cap. (MWe)'] = value(compute_surplus_capacity(model))
-    results_ref['Net Annual Revenues ($/MWe/y)'] = (results_ref['Net Revenues ($/year)'])/results_ref['Depl. ANR Cap. (MWe)']
-    results_ref['Net Annual Revenues with H2 PTC ($/MWe/y)'] = results_ref['Net Revenues with H2 PTC ($/year)']/results_ref['Depl. ANR Cap. (MWe)']
-    for g in model.G: 
-      if value(model.vS[g]) >=1: 
-        results_ref['ANR type'] = g
-        total_nb_modules = int(np.sum([value(model.vM[n,g]) for n in model.N]))
-        results_ref['# ANR modules'] = total_nb_modules
-        for n in model.N:
-          if value(model.vM[n,g]) >=1:
-            for h in model.H:
-              if value(model.vQ[n,h,g]) > 0:
-                results_ref[h] += value(model.vQ[n,h,g])
-    print(f'Ammonia plant {plant} solved')
+    results_ref = compile_ammonia_results(plant, ANR_data, H2_data, deployment_model.extract_deployment(model))
+    print(f'Ammonia plant {plant} solved (build {build_time:.3f} s, solve {solve_time:.3f} s)')
     return results_ref
   else:
     print('Not feasible.')
     return None
+
+
+def solve_ammonia_plant_deployment_matrix(ANR_data, H2_data, plant, print_results, formulation='slots', solver='highs'):
+  """Solves the deployment at an ammonia plant with the MILP built directly as sparse matrices (no Pyomo model)"""
+  print(f'Ammonia plant {plant} : start solving')
+  ammonia_capacity, h2_dem_kg_per_day, elec_dem_MWe, state, lat, lon = get_ammonia_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  matrix = deployment_model.build_deployment_matrix(params, h2_dem_kg_per_day, elec_dem_MWe, MaxANRMod,
+                                                   formulation=formulation)
+  deployment = deployment_model.solve_deployment_matrix(params, matrix, options=solver_config.get_scipy_options(solver, disp=print_results))
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  results_ref = compile_ammonia_results(plant, ANR_data, H2_data, deployment)
+  print(f'Ammonia plant {plant} solved (build {matrix["build_time"]:.3f} s, solve {deployment["Solve time (s)"]:.3f} s)')
+  return results_ref
+
+
+def solve_ammonia_plant_deployment_fast(ANR_data, H2_data, plant, print_results=False, formulation='slots', solver=None):
+  """Solves the deployment at an ammonia plant exactly by enumeration, without MILP solver"""
+  ammonia_capacity, h2_dem_kg_per_day, elec_dem_MWe, state, lat, lon = get_ammonia_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  deployment = deployment_model.fast_solve(params, h2_dem_kg_per_day, elec_dem_MWe, MaxANRMod)
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  return compile_ammonia_results(plant, ANR_data, H2_data, deployment)
+
+
+def solve_ammonia_plant_deployment_check(ANR_data, H2_data, plant, print_results=False, formulation='slots', solver='cplex'):
+  """Solves the deployment at an ammonia plant with the MILP and by enumeration and reports the differences"""
+  results_ref = solve_ammonia_plant_deployment(ANR_data, H2_data, plant, print_results, formulation=formulation, solver=solver)
+  results_fast = solve_ammonia_plant_deployment_fast(ANR_data, H2_data, plant)
+  deployment_model.report_differences(plant, results_ref, results_fast)
+  return results_ref
   
 
 def compute_ng_breakeven_price(results_ref):
@@ -309,24 +317,66 @@ def compute_ng_be_without_ptc(results_ref):
 
 
 
-def main(anr_tag='FOAK', wacc=WACC, print_main_results=True, print_results=False): 
+def sweep_ammonia_plants(scenarios, solver='highs', formulation='ordered', warmstart=True):
+  """Solves the deployment at all ammonia plants for each scenario of a sweep, each plant model is built once and re-solved
+  with a persistent solver (see deployment_model.sweep_plant)
+  Args:
+    scenarios (list[dict]): scenarios, see deployment_model.load_sweep_scenarios
+    solver (str): persistent solver preset
+    formulation (str): 'slots' or 'ordered'
+    warmstart (bool): start each solve from the solution of the previous scenario
+  Returns:
+    df (DataFrame): results of all plants and scenarios
+  """
+  abspath = os.path.abspath(__file__)
+  dname = os.path.dirname(abspath)
+  os.chdir(dname)
+  plant_ids = demand_registry.get_plant_ids('ammonia')
+  registry = demand_registry.get_registry(['ammonia'])
+  h2_dem = {plant:get_ammonia_plant_demand(plant)[1] for plant in plant_ids}
+  elec_dem = {plant:get_ammonia_plant_demand(plant)[2] for plant in plant_ids}
+  scenario_data = deployment_model.load_sweep_scenarios(scenarios)
+  with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+    results = pool.starmap(deployment_model.sweep_plant, [(plant, scenario_data, h2_dem[plant], elec_dem[plant], MaxANRMod, True, compile_ammonia_results,
+                                                           solver, formulation, warmstart) for plant in plant_ids])
+  df = pd.DataFrame([results_ref for plant_results in results for results_ref in plant_results if results_ref is not None])
+  return df
+
+
+SOLVE_FUNCTIONS = {'pyomo':solve_ammonia_plant_deployment, 'matrix':solve_ammonia_plant_deployment_matrix,
+                   'fast':solve_ammonia_plant_deployment_fast, 'check':solve_ammonia_plant_deployment_check}
+
+def get_cache_components(plant, ANR_data, H2_data, backend, formulation, solver):
+  state = demand_registry.get_plant('ammonia', plant)['State'].strip()
+  return results_cache.get_plant_components('ammonia', plant, ANR_data, H2_data, sys.modules[__name__],
+                                           {'NG price ($/MMBtu)':utils.get_ng_price_aeo(state)}, backend, formulation, solver)
+
+
+def main(anr_tag='FOAK', wacc=WACC, print_main_results=True, print_results=False, backend='pyomo', formulation='slots', solver='cplex', use_cache=True): 
   # Go the present directory
   abspath = os.path.abspath(__file__)
   dname = os.path.dirname(abspath)
   os.chdir(dname)
 
-  # Load steel data
-  ammonia_df = pd.read_excel('h2_demand_ammonia_us_2022.xlsx', sheet_name='processed')
-  plant_ids = list(ammonia_df['id'])
+  # Load ammonia data once, shared with the workers through the pool initializer
+  plant_ids = demand_registry.get_plant_ids('ammonia')
+  registry = demand_registry.get_registry(['ammonia'])
 
   # Load ANR and H2 parameters
   ANR_data, H2_data = load_data(anr_tag=anr_tag)
 
   # Build results dataset one by one
   
-  with Pool(10) as pool:
-    results = pool.starmap(solve_ammonia_plant_deployment, [(ANR_data, H2_data, plant, print_results) for plant in plant_ids])
-  pool.close()
+  def solve_plants(plants):
+    with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+      return pool.starmap(SOLVE_FUNCTIONS[backend], [(ANR_data, H2_data, plant, print_results, formulation, solver) for plant in plants])
+
+  if use_cache:
+    # Plants whose inputs did not change are read from the results cache without building a model
+    plant_components = {plant:get_cache_components(plant, ANR_data, H2_data, backend, formulation, solver) for plant in plant_ids}
+    results = results_cache.solve_with_cache('ammonia', plant_ids, plant_components, solve_plants)
+  else:
+    results = solve_plants(plant_ids)
 
   df = pd.DataFrame(results)
 
@@ -2,7 +2,13 @@ from pyomo.environ import *
 import pandas as pd
 import numpy as np
 import csv, os
+import time
 import utils
+import demand_registry
+import deployment_model
+import solver_config
+import results_cache
+import sys
 from multiprocessing import Pool
 
 """version 0.2 Relaxed the heat balance constraint to be <= instead of ==, now the problem is feasible
@@ -22,26 +28,21 @@ WACC = utils.WACC
 
 
 def get_refinery_demand(ref_id):
-  ref_df = pd.read_excel('h2_demand_refineries.xlsx', sheet_name='processed')
-  select_df = ref_df[ref_df['refinery_id']==ref_id]
-  demand_kg_day = select_df['Corrected 2022 demand (kg/day)'].iloc[0]
+  demand_kg_day = float(demand_registry.get_plant('refining', ref_id)['Corrected 2022 demand (kg/day)'])
   return demand_kg_day
 
 def get_state(ref_id):
-  ref_df = pd.read_excel('h2_demand_refineries.xlsx', sheet_name='processed')
-  select_df = ref_df[ref_df['refinery_id']==ref_id]
-  state= select_df['state'].iloc[0]
+  state = demand_registry.get_plant('refining', ref_id)['state']
   return state
 
 def get_lat_lon(ref_id):
-  ref_df = pd.read_excel('h2_demand_refineries.xlsx', sheet_name='processed')
-  select_df = ref_df[ref_df['refinery_id']==ref_id]
-  lat = select_df['latitude'].iloc[0]
-  lon = select_df['longitude'].iloc[0]
+  ref_row = demand_registry.get_plant('refining', ref_id)
+  lat = ref_row['latitude']
+  lon = ref_row['longitude']
   return lat, lon
 
 
-def solve_refinery_deployment(ref_id, ANR_data, H2_data):
+def build_refinery_deployment(ref_id, ANR_data, H2_data, formulation='slots'):
   print(f'Start solve for {ref_id}')
   model = ConcreteModel(ref_id)
 
@@ -170,107 +171,124 @@ def solve_refinery_deployment(ref_id, ANR_data, H2_data):
     return sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]/model.pANRThEff[g] for h in model.H) <= (model.pANRCap[g]/model.pANRThEff[g])*model.vM[n,g]
   model.heat_elec_balance = Constraint(model.N, model.G, rule=heat_elec_balance)
 
+  if formulation == 'ordered':
+    deployment_model.add_symmetry_breaking(model)
 
-  #### DATA ####
-  def compute_annual_carbon_emissions(model):
-    return sum(sum(sum(model.pH2CarbonInt[h,g]*model.vQ[n,h,g]*model.pH2CapH2[h]*24*365 for g in model.G) for h in model.H) for n in model.N)
+  return model
 
-  def compute_anr_capex(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR)*model.pANRCRF[g]for g in model.G) for n in model.N) 
-  
-  def compute_anr_om(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*(model.pANRFC[g]+model.pANRVOM[g]*365*24) for g in model.G) for n in model.N) 
-  
-  def compute_h2_capex(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*model.pH2CAPEX[h]*(1-model.pITC_H2)*model.pH2CRF[h] for h in model.H) for g in model.G) for n in model.N) 
-  
-  def compute_h2_om(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2FC[h]+model.pH2VOM[h]*365*24) for h in model.H) for g in model.G) for n in model.N) 
-
-  def get_crf(model):
-    return sum(model.vS[g]*model.pANRCRF[g] for g in model.G)
-  
-  def get_anr_capex(model):
-    return sum(model.pANRCAPEX[g]*model.vS[g] for g in model.G)
-  
-  def get_deployed_cap(model):
-    return sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-  
-  def annualized_avoided_ng_costs(model):
-    ng_price = utils.get_ng_price_aeo(model.pState)
-    avoided_costs = ng_price*utils.smr_nrj_intensity*model.pRefDem*365
-    return avoided_costs
-
-  def get_eq_elec_dem_h2(model): return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) for g in model.G) for n in model.N) 
-  def compute_surplus_capacity(model):
-    deployed_capacity = sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-    aux_elec_demand = 0/24
-    h2_elec_demand  = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for g in model.G) for h in model.H) for n in model.N)
-    return deployed_capacity - aux_elec_demand - h2_elec_demand
-  
-  def compute_initial_investment(model):
-    anr_capex = sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR) for g in model.G) for n in model.N)
-    h2_capex = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2CAPEX[h]*(1-model.pITC_H2)) for h in model.H) for g in model.G) for n in model.N)
-    conversion_costs = 0
-    Co = anr_capex + h2_capex +conversion_costs 
-    return Co
 
+def compile_refinery_results(ref_id, ANR_data, H2_data, deployment, wacc=WACC, other_revenues=0):
+  """Computes the results of an ANR-H2 deployment at a refinery, shared by all solution methods
+  Args:
+    ref_id (str): id of the refinery
+    ANR_data (DataFrame): ANR parameters
+    H2_data (DataFrame): H2 technologies parameters
+    deployment (dict): 'ANR type', '# ANR modules' and 'H2 modules' (technology to number of modules)
+    wacc (float): weighted average cost of capital
+  Returns:
+    results_ref (dict): results of the deployment
+  """
+  demand_daily = get_refinery_demand(ref_id)
+  state = get_state(ref_id)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  costs = deployment_model.compute_deployment_costs(params, deployment)
 
-  #### SOLVE with CPLEX ####
-  opt = SolverFactory('cplex')
-
-  results = opt.solve(model, tee = False)
   results_ref = {}
   results_ref['id'] = ref_id
   lat, lon = get_lat_lon(ref_id)
   results_ref['latitude'] = lat 
   results_ref['longitude'] = lon
-  results_ref['state'] = value(model.pState)
+  results_ref['state'] = state
   results_ref['State price ($/MMBtu)'] = utils.get_ng_price_aeo(results_ref['state'])
-  results_ref['ANR CAPEX ($/MWe)'] = value(get_anr_capex(model))
-  results_ref['H2 Dem. (kg/day)'] = value(model.pRefDem)
-  results_ref['Net Revenues ($/year)'] = value(model.NetRevenues)
+  results_ref['ANR CAPEX ($/MWe)'] = costs['ANR CAPEX ($/MWe)']
+  results_ref['H2 Dem. (kg/day)'] = demand_daily
+  results_ref['Net Revenues ($/year)'] = -costs['Total costs ($/year)']+other_revenues
   results_ref['H2 PTC Revenues ($/year)'] = demand_daily*365*utils.h2_ptc
   results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
-  for h in model.H:
+  for h in params['H']:
     results_ref[h] = 0
+  results_ref['Ann. CO2 emissions (kgCO2eq/year)'] = costs['H2 CO2 emissions (kgCO2eq/year)']
+  results_ref['Initial investment ($)'] = costs['ANR investment ($)']+costs['H2 investment ($)'] # no conversion costs
+  results_ref['ANR CAPEX ($/year)'] = costs['ANR CAPEX ($/year)']
+  results_ref['H2 CAPEX ($/year)'] = costs['H2 CAPEX ($/year)']
+  results_ref['ANR O&M ($/year)'] = costs['ANR O&M ($/year)']
+  results_ref['H2 O&M ($/year)'] = costs['H2 O&M ($/year)']
+  results_ref['ANR CRF'] = costs['ANR CRF']
+  results_ref['Depl. ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)']
+  results_ref['Depl. H2 Cap. (MWe)'] = costs['Depl H2 Cap. (MWe)']
+  results_ref['Conversion costs ($/year)'] = 0 # no conversion costs
+  results_ref['Avoided NG costs ($/year)'] = utils.get_ng_price_aeo(state)*utils.smr_nrj_intensity*demand_daily*365
+  results_ref['Breakeven price ($/MMBtu)'] = compute_breakeven_price(results_ref) # Compute BE prices before adding avoided NG costs!
+  results_ref['BE wo PTC ($/MMBtu)'] = compute_ng_be_wo_PTC(results_ref)
+  results_ref['Net Revenues ($/year)'] +=results_ref['Avoided NG costs ($/year)']
+  results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
+  results_ref['Surplus ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)'] - costs['Depl H2 Cap. (MWe)']
+  results_ref['Net Annual Revenues ($/MWe/y)'] = (results_ref['Net Revenues ($/year)'])/results_ref['Depl. ANR Cap. (MWe)']
+  results_ref['Net Annual Revenues with H2 PTC ($/MWe/y)'] = results_ref['Net Revenues with H2 PTC ($/year)']/results_ref['Depl. ANR Cap. (MWe)']
+  results_ref['ANR type'] = deployment['ANR type']
+  results_ref['# ANR modules'] = deployment['# ANR modules']
+  for h in params['H']:
+    results_ref[h] += deployment['H2 modules'][h]
+  return results_ref
+
+
+def solve_refinery_deployment(ref_id, ANR_data, H2_data, formulation='slots', solver='cplex'):
+  start = time.time()
+  model = build_refinery_deployment(ref_id, ANR_data, H2_data, formulation=formulation)
+  build_time = time.time()-start
+
+  #### SOLVE ####
+  # No time limit and CPLEX default relative gap
+  opt = solver_config.get_solver(solver, timelimit=None, mipgap=1e-4, options={})
+
+  start = time.time()
+  results = opt.solve(model, tee = False)
+  solve_time = time.time()-start
   if results.solver.termination_condition == TerminationCondition.optimal: 
     model.solutions.load_from(results)
-    results_ref['Ann. CO2 emissions (kgCO2eq/year)'] = value(compute_annual_carbon_emissions(model))
-    results_ref['Initial investment ($)'] = value(compute_initial_investment(model))
-    results_ref['ANR CAPEX ($/year)'] = value(compute_anr_capex(model))
-    results_ref['H2 CAPEX ($/year)'] = value(compute_h2_capex(model))
-    results_ref['ANR O&M ($/year)'] = value(compute_anr_om(model))
-    results_ref['H2 O&M ($/year)'] = value(compute_h2_om(model))
-    results_ref['ANR CRF'] = value(get_crf(model))
-    results_ref['Depl. ANR Cap. (MWe)'] = value(get_deployed_cap(model))
-    results_ref['Depl. H2 Cap. (MWe)'] = value(get_eq_elec_dem_h2(model))
-    results_ref['Conversion costs ($/year)'] = 0 # no conversion costs
-    results_ref['Avoided NG costs ($/year)'] = value(annualized_avoided_ng_costs(model))
-    results_ref['Breakeven price ($/MMBtu)'] = compute_breakeven_price(results_ref) # Compute BE prices before adding avoided NG costs!
-    results_ref['BE wo PTC ($/MMBtu)'] = compute_ng_be_wo_PTC(results_ref)
-    results_ref['Net Revenues ($/year)'] +=results_ref['Avoided NG costs ($/year)']
-    results_ref['Net Revenues with H2 PTC ($/year)'] = results_ref['Net Revenues ($/year)']+results_ref['H2 PTC Revenues ($/year)']
-    results_ref['Surplus ANR Cap. (MWe)'] = value(compute_surplus_capacity(model))
-    results_ref['Net Annual Revenues ($/MWe/y)'] = (results_ref['Net Revenues ($/year)'])/results_ref['Depl. ANR Cap. (MWe)']
-    results_ref['Net Annual Revenues with H2 PTC ($/MWe/y)'] = results_ref['Net Revenues with H2 PTC ($/year)']/results_ref['Depl. ANR Cap. (MWe)']
-    
-    for g in model.G: 
-      if value(model.vS[g]) >=1: 
-        results_ref['ANR type'] = g
-        total_nb_modules = int(np.sum([value(model.vM[n,g]) for n in model.N]))
-        results_ref['# ANR modules'] = total_nb_modules
-        for n in model.N:
-          if value(model.vM[n,g]) >=1:
-            for h in model.H:
-              results_ref[h] += value(model.vQ[n,h,g])
-    print(f'Refining plant {ref_id} solved')
+    results_ref = compile_refinery_results(ref_id, ANR_data, H2_data, deployment_model.extract_deployment(model))
+    print(f'Refining plant {ref_id} solved (build {build_time:.3f} s, solve {solve_time:.3f} s)')
     return results_ref
   else:
     print('Not feasible.')
     return None
 
 
+def solve_refinery_deployment_matrix(ref_id, ANR_data, H2_data, formulation='slots', solver='highs'):
+  """Solves the deployment at a refinery with the MILP built directly as sparse matrices (no Pyomo model)"""
+  print(f'Start solve for {ref_id}')
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  # No auxiliary electricity demand: only the module level heat and electricity balance
+  matrix = deployment_model.build_deployment_matrix(params, get_refinery_demand(ref_id), 0, MaxANRMod, plant_balance=False,
+                                                   formulation=formulation)
+  deployment = deployment_model.solve_deployment_matrix(params, matrix,
+                                                       options=solver_config.get_scipy_options(solver, timelimit=None, mipgap=1e-4))
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  results_ref = compile_refinery_results(ref_id, ANR_data, H2_data, deployment)
+  print(f'Refining plant {ref_id} solved (build {matrix["build_time"]:.3f} s, solve {deployment["Solve time (s)"]:.3f} s)')
+  return results_ref
+
+
+def solve_refinery_deployment_fast(ref_id, ANR_data, H2_data, formulation='slots', solver=None):
+  """Solves the deployment at a refinery exactly by enumeration, without MILP solver"""
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  deployment = deployment_model.fast_solve(params, get_refinery_demand(ref_id), 0, MaxANRMod)
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  return compile_refinery_results(ref_id, ANR_data, H2_data, deployment)
+
+
+def solve_refinery_deployment_check(ref_id, ANR_data, H2_data, formulation='slots', solver='cplex'):
+  """Solves the deployment at a refinery with the MILP and by enumeration and reports the differences"""
+  results_ref = solve_refinery_deployment(ref_id, ANR_data, H2_data, formulation=formulation, solver=solver)
+  results_fast = solve_refinery_deployment_fast(ref_id, ANR_data, H2_data)
+  deployment_model.report_differences(ref_id, results_ref, results_fast)
+  return results_ref
+
+
 def compute_breakeven_price(results_ref):
   revenues = results_ref['Net Revenues with H2 PTC ($/year)']
   breakeven_price = -revenues/(EFF_H2_SMR * CONV_MJ_TO_MMBTU * results_ref['H2 Dem. (kg/day)']*365)
@@ -283,18 +301,61 @@ def compute_ng_be_wo_PTC(results_ref):
   return breakeven_price
 
 
-def main(anr_tag='FOAK', wacc=WACC, print_main_results=True):
+def sweep_refineries(scenarios, solver='highs', formulation='ordered', warmstart=True):
+  """Solves the deployment at all refineries for each scenario of a sweep, each plant model is built once and re-solved
+  with a persistent solver (see deployment_model.sweep_plant)
+  Args:
+    scenarios (list[dict]): scenarios, see deployment_model.load_sweep_scenarios
+    solver (str): persistent solver preset
+    formulation (str): 'slots' or 'ordered'
+    warmstart (bool): start each solve from the solution of the previous scenario
+  Returns:
+    df (DataFrame): results of all plants and scenarios
+  """
   abspath = os.path.abspath(__file__)
   dname = os.path.dirname(abspath)
   os.chdir(dname)
-  ref_df = pd.read_excel('h2_demand_refineries.xlsx', sheet_name='processed')
-  ref_ids = list(ref_df['refinery_id'])
+  ref_ids = demand_registry.get_plant_ids('refining')
+  registry = demand_registry.get_registry(['refining'])
+  # No auxiliary electricity demand: only the module level heat and electricity balance
+  h2_dem = {ref_id:get_refinery_demand(ref_id) for ref_id in ref_ids}
+  elec_dem = {ref_id:0 for ref_id in ref_ids}
+  scenario_data = deployment_model.load_sweep_scenarios(scenarios)
+  with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+    results = pool.starmap(deployment_model.sweep_plant, [(plant, scenario_data, h2_dem[plant], elec_dem[plant], MaxANRMod, False, compile_refinery_results,
+                                                           solver, formulation, warmstart) for plant in ref_ids])
+  df = pd.DataFrame([results_ref for plant_results in results for results_ref in plant_results if results_ref is not None])
+  return df
+
+
+SOLVE_FUNCTIONS = {'pyomo':solve_refinery_deployment, 'matrix':solve_refinery_deployment_matrix,
+                   'fast':solve_refinery_deployment_fast, 'check':solve_refinery_deployment_check}
+
+def get_cache_components(ref_id, ANR_data, H2_data, backend, formulation, solver):
+  state = demand_registry.get_plant('refining', ref_id)['state']
+  return results_cache.get_plant_components('refining', ref_id, ANR_data, H2_data, sys.modules[__name__],
+                                           {'NG price ($/MMBtu)':utils.get_ng_price_aeo(state)}, backend, formulation, solver)
+
+def main(anr_tag='FOAK', wacc=WACC, print_main_results=True, backend='pyomo', formulation='slots', solver='cplex', use_cache=True):
+  abspath = os.path.abspath(__file__)
+  dname = os.path.dirname(abspath)
+  os.chdir(dname)
+  # Load refining data once, shared with the workers through the pool initializer
+  ref_ids = demand_registry.get_plant_ids('refining')
+  registry = demand_registry.get_registry(['refining'])
 
   ANR_data, H2_data = utils.load_data(anr_tag=anr_tag)
 
-  with Pool(10) as pool: 
-    results = pool.starmap(solve_refinery_deployment, [(ref_id, ANR_data, H2_data) for ref_id in ref_ids])
-  pool.close()
+  def solve_plants(plants):
+    with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+      return pool.starmap(SOLVE_FUNCTIONS[backend], [(ref_id, ANR_data, H2_data, formulation, solver) for ref_id in plants])
+
+  if use_cache:
+    # Plants whose inputs did not change are read from the results cache without building a model
+    plant_components = {ref_id:get_cache_components(ref_id, ANR_data, H2_data, backend, formulation, solver) for ref_id in ref_ids}
+    results = results_cache.solve_with_cache('refining', ref_ids, plant_components, solve_plants)
+  else:
+    results = solve_plants(ref_ids)
 
   df = pd.DataFrame(results)
   excel_file = f'./results/raw_results_anr_{anr_tag}_h2_wacc_{str(wacc)}.xlsx'
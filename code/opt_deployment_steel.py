@@ -2,7 +2,13 @@ from pyomo.environ import *
 import pandas as pd
 import numpy as np
 import os
+import time
 import utils
+import demand_registry
+import deployment_model
+import solver_config
+import results_cache
+import sys
 from multiprocessing import Pool
 
 """ Version 0"""
@@ -18,28 +24,24 @@ WACC = utils.WACC
 
 
 def get_steel_plant_demand(plant):
-  steel_df = pd.read_excel('./h2_demand_bfbof_steel_us_2022.xlsx', sheet_name='processed')
-  plant_df = steel_df[steel_df['Plant'] == plant]
-  h2_demand_kg_per_day = float(plant_df['Hydrogen demand (kg/day)'].iloc[0])
-  elec_demand_MWe = float(plant_df['Electricity demand (MWe)'].iloc[0])
-  steel_cap_ton_per_annum = float(plant_df['Steel production capacity (ttpa)'].iloc[0]*1000)
+  plant_row = demand_registry.get_plant('steel', plant)
+  h2_demand_kg_per_day = float(plant_row['Hydrogen demand (kg/day)'])
+  elec_demand_MWe = float(plant_row['Electricity demand (MWe)'])
+  steel_cap_ton_per_annum = float(plant_row['Steel production capacity (ttpa)']*1000)
   return steel_cap_ton_per_annum, h2_demand_kg_per_day, elec_demand_MWe
 
 
 def get_state(plant):
-  steel_df = pd.read_excel('./h2_demand_bfbof_steel_us_2022.xlsx', sheet_name='processed')
-  plant_df = steel_df[steel_df['Plant'] == plant]
-  state = plant_df['STATE'].iloc[0]
+  state = demand_registry.get_plant('steel', plant)['STATE']
   return state
 
 def get_lat_lon(plant):
-  steel_df = pd.read_excel('./h2_demand_bfbof_steel_us_2022.xlsx', sheet_name='processed')
-  plant_df = steel_df[steel_df['Plant'] == plant]
-  lat = plant_df['latitude'].iloc[0]
-  lon = plant_df['longitude'].iloc[0]
+  plant_row = demand_registry.get_plant('steel', plant)
+  lat = plant_row['latitude']
+  lon = plant_row['longitude']
   return lat, lon
 
-def build_steel_plant_deployment(plant, ANR_data, H2_data): 
+def build_steel_plant_deployment(plant, ANR_data, H2_data, formulation='slots'): 
   print(f'Start {plant}')
   model = ConcreteModel(plant)
 
@@ -194,123 +196,133 @@ def build_steel_plant_deployment(plant, ANR_data, H2_data):
             <= sum(model.pANRCap[g]*model.vM[n,g] for n in model.N)
   model.energy_balance_plant = Constraint(model.G, rule = energy_balance_plant)
 
+  if formulation == 'ordered':
+    deployment_model.add_symmetry_breaking(model)
+
   
   return model
 
 
-def solve_steel_plant_deployment(plant, ANR_data, H2_data):
-  steel_cap_ton_per_annum, h2_dem_kg_per_day, elec_dem_MWh_per_day = get_steel_plant_demand(plant)
-
-  model = build_steel_plant_deployment(plant, ANR_data, H2_data)
-  # for carbon accounting
-  def compute_annual_carbon_emissions(model):
-    return sum(sum(sum(model.pH2CarbonInt[h,g]*model.vQ[n,h,g]*model.pH2CapH2[h]*24*365 for g in model.G) for h in model.H) for n in model.N)+\
-          model.pDRICO2Intensity*steel_cap_ton_per_annum
-  
-  def compute_anr_capex(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR)*model.pANRCRF[g]for g in model.G) for n in model.N) 
-  
-  def compute_anr_om(model):
-    return sum(sum(model.pANRCap[g]*model.vM[n,g]*(model.pANRFC[g]+model.pANRVOM[g]*365*24) for g in model.G) for n in model.N) 
-  
-  def compute_h2_capex(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*model.pH2CAPEX[h]*(1-model.pITC_H2)*model.pH2CRF[h] for h in model.H) for g in model.G) for n in model.N) 
-  
-  def compute_h2_om(model):
-    return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2FC[h]+model.pH2VOM[h]*365*24) for h in model.H) for g in model.G) for n in model.N) 
-
-  def get_crf(model):
-    return sum(model.vS[g]*model.pANRCRF[g] for g in model.G)
-  
-  def get_anr_capex(model):
-    return sum(model.pANRCAPEX[g]*model.vS[g] for g in model.G)
-  
-  def compute_conv_costs(model):
-    crf = model.pWACC / (1 - (1/(1+model.pWACC)**20) )# assumes 20 years lifetime for shaft and eaf
-    costs = steel_cap_ton_per_annum*(model.pEAFCAPEX*(1-model.pITC_H2)*crf + model.pShaftFCAPEX*(1-model.pITC_H2)*crf/model.pRatioSteelDRI + model.pEAFOM +\
-            model.pIronOre*model.pRatioIronOreDRI/model.pRatioSteelDRI)
-    return costs
-  def get_deployed_cap(model):
-    return sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-  
-  def annualized_avoided_ng_costs():
-    coal_price = utils.get_met_coal_eia_aeo_price()
-    avoided_costs = coal_price*steel_cap_ton_per_annum*utils.coal_to_steel_ratio_bau*utils.coal_heat_content
-    return avoided_costs
-
-  def compute_surplus_capacity(model):
-    deployed_capacity = sum(sum (model.vM[n,g]*model.pANRCap[g] for g in model.G) for n in model.N)
-    aux_elec_demand = elec_dem_MWh_per_day/24
-    h2_elec_demand  = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) for g in model.G) for n in model.N) 
-    return deployed_capacity - aux_elec_demand - h2_elec_demand
-
-  def get_eq_elec_dem_h2(model): return sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g] for h in model.H) for g in model.G) for n in model.N) 
-
-  def compute_initial_investment(model):
-    anr_capex = sum(sum(model.pANRCap[g]*model.vM[n,g]*model.pANRCAPEX[g]*(1-model.pITC_ANR) for g in model.G) for n in model.N)
-    h2_capex = sum(sum(sum(model.pH2CapElec[h,g]*model.vQ[n,h,g]*(model.pH2CAPEX[h]*(1-model.pITC_H2)) for h in model.H) for g in model.G) for n in model.N)
-    conversion_costs = steel_cap_ton_per_annum*(model.pEAFCAPEX*(1-model.pITC_H2) + model.pShaftFCAPEX*(1-model.pITC_H2)/model.pRatioSteelDRI )
-    Co = anr_capex + h2_capex +conversion_costs 
-    return Co
-
-  ############## SOLVE ###################
-  solver = SolverFactory('cplex')
-  solver.options['timelimit'] = 240
-  solver.options['mip pool relgap'] = 0.02
-  solver.options['mip tolerances absmipgap'] = 1e-4
-  solver.options['mip tolerances mipgap'] = 5e-3
-  results = solver.solve(model, tee = False)
+def compute_conversion_costs(steel_cap_ton_per_annum, wacc=WACC):
+  """Annualized costs of the shaft furnace and EAF conversion and of the iron ore ($/year)"""
+  crf = deployment_model.compute_crf(wacc, 20) # assumes 20 years lifetime for shaft and eaf
+  costs = steel_cap_ton_per_annum*(utils.eaf_CAPEX*(1-utils.ITC_H2)*crf + utils.shaft_CAPEX*(1-utils.ITC_H2)*crf/utils.steel_to_dri_ratio + utils.eaf_OM +\
+          iron_ore_cost*utils.ratio_ironore_DRI/utils.steel_to_dri_ratio)
+  return costs
+
+
+def compile_steel_results(plant, ANR_data, H2_data, deployment, wacc=WACC, other_revenues=0):
+  """Computes the results of an ANR-H2 deployment at a steel plant, shared by all solution methods
+  Args:
+    plant (str): id of the steel plant
+    ANR_data (DataFrame): ANR parameters
+    H2_data (DataFrame): H2 technologies parameters
+    deployment (dict): 'ANR type', '# ANR modules' and 'H2 modules' (technology to number of modules)
+    wacc (float): weighted average cost of capital
+  Returns:
+    results_dic (dict): results of the deployment
+  """
+  steel_cap_ton_per_annum, h2_dem_kg_per_day, elec_dem_MWe = get_steel_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=wacc)
+  costs = deployment_model.compute_deployment_costs(params, deployment)
+  conv_costs = compute_conversion_costs(steel_cap_ton_per_annum, wacc=wacc)
 
   results_dic = {}
   results_dic['id'] = plant
-  results_dic['state'] = value(model.pState)
+  results_dic['state'] = get_state(plant)
   results_dic['State price ($/MMBtu)'] = utils.get_met_coal_eia_aeo_price()
   lat, lon = get_lat_lon(plant)
   results_dic['latitude'], results_dic['longitude'] = lat, lon
   results_dic['Steel prod. (ton/year)'] = steel_cap_ton_per_annum
-  results_dic['H2 Dem. (kg/day)'] = value(model.pH2Dem)
-  results_dic['ANR CAPEX ($/MWe)'] = value(get_anr_capex(model))
-  results_dic['Aux Elec Dem. (MWe)'] = value(model.pElecDem)
-  results_dic['Net Revenues ($/year)'] = value(model.NetRevenues)
-  results_dic['H2 PTC Revenues ($/year)'] = value(model.pH2Dem)*365*utils.h2_ptc
+  results_dic['H2 Dem. (kg/day)'] = h2_dem_kg_per_day
+  results_dic['ANR CAPEX ($/MWe)'] = costs['ANR CAPEX ($/MWe)']
+  results_dic['Aux Elec Dem. (MWe)'] = elec_dem_MWe
+  results_dic['Net Revenues ($/year)'] = -costs['Total costs ($/year)']-conv_costs+other_revenues
+  results_dic['H2 PTC Revenues ($/year)'] = h2_dem_kg_per_day*365*utils.h2_ptc
   results_dic['Net Revenues with H2 PTC ($/year)'] = results_dic['Net Revenues ($/year)']+results_dic['H2 PTC Revenues ($/year)']
-  for h in model.H:
+  for h in params['H']:
     results_dic[h] = 0
+  results_dic['Ann. CO2 emissions (kgCO2eq/year)'] = costs['H2 CO2 emissions (kgCO2eq/year)']+utils.dri_co2_intensity*steel_cap_ton_per_annum
+  results_dic['Initial investment ($)'] = costs['ANR investment ($)']+costs['H2 investment ($)']\
+    +steel_cap_ton_per_annum*(utils.eaf_CAPEX*(1-utils.ITC_H2) + utils.shaft_CAPEX*(1-utils.ITC_H2)/utils.steel_to_dri_ratio)
+  results_dic['ANR CAPEX ($/year)'] = costs['ANR CAPEX ($/year)']
+  results_dic['H2 CAPEX ($/year)'] = costs['H2 CAPEX ($/year)']
+  results_dic['ANR O&M ($/year)'] = costs['ANR O&M ($/year)']
+  results_dic['H2 O&M ($/year)'] = costs['H2 O&M ($/year)']
+  results_dic['ANR CRF'] = costs['ANR CRF']
+  results_dic['Depl. ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)']
+  results_dic['Depl H2 Cap. (MWe)'] = costs['Depl H2 Cap. (MWe)']
+  results_dic['Conversion costs ($/year)'] = conv_costs
+  results_dic['Avoided NG costs ($/year)'] = utils.get_met_coal_eia_aeo_price()*steel_cap_ton_per_annum*utils.coal_to_steel_ratio_bau*utils.coal_heat_content
+  results_dic['Breakeven price ($/MMBtu)'] = compute_breakeven_price(results_dic) # Compute BE price before adding avoided ng costs!
+  results_dic['BE wo PTC ($/MMBtu)'] = compute_be_wo_PTC(results_dic)
+  results_dic['Net Revenues ($/year)'] += results_dic['Avoided NG costs ($/year)']
+  results_dic['Net Revenues with H2 PTC ($/year)'] = results_dic['Net Revenues ($/year)']+results_dic['H2 PTC Revenues ($/year)']
+  results_dic['Surplus ANR Cap. (MWe)'] = costs['Depl. ANR Cap. (MWe)'] - elec_dem_MWe/24 - costs['Depl H2 Cap. (MWe)']
+  results_dic['Net Annual Revenues ($/MWe/y)'] = (results_dic['Net Revenues ($/year)']+results_dic['Avoided NG costs ($/year)'])/results_dic['Depl. ANR Cap. (MWe)']
+  results_dic['Net Annual Revenues with H2 PTC ($/MWe/y)'] = (results_dic['Net Revenues with H2 PTC ($/year)']+results_dic['Avoided NG costs ($/year)'])/results_dic['Depl. ANR Cap. (MWe)']
+  results_dic['ANR type'] = deployment['ANR type']
+  results_dic['# ANR modules'] = deployment['# ANR modules']
+  for h in params['H']:
+    results_dic[h] += deployment['H2 modules'][h]
+  return results_dic
+
+
+def solve_steel_plant_deployment(plant, ANR_data, H2_data, formulation='slots', solver='cplex'):
+  start = time.time()
+  model = build_steel_plant_deployment(plant, ANR_data, H2_data, formulation=formulation)
+  build_time = time.time()-start
+
+  ############## SOLVE ###################
+  opt = solver_config.get_solver(solver)
+  start = time.time()
+  results = opt.solve(model, tee = False)
+  solve_time = time.time()-start
+
   if results.solver.termination_condition == TerminationCondition.optimal: 
     model.solutions.load_from(results)
-    results_dic['Ann. CO2 emissions (kgCO2eq/year)'] = value(compute_annual_carbon_emissions(model))
-    results_dic['Initial investment ($)'] = value(compute_initial_investment(model))
-    results_dic['ANR CAPEX ($/year)'] = value(compute_anr_capex(model))
-    results_dic['H2 CAPEX ($/year)'] = value(compute_h2_capex(model))
-    results_dic['ANR O&M ($/year)'] = value(compute_anr_om(model))
-    results_dic['H2 O&M ($/year)'] = value(compute_h2_om(model))
-    results_dic['ANR CRF'] = value(get_crf(model))
-    results_dic['Depl. ANR Cap. (MWe)'] = value(get_deployed_cap(model))
-    results_dic['Depl H2 Cap. (MWe)'] = value(get_eq_elec_dem_h2(model))
-    results_dic['Conversion costs ($/year)'] = value(compute_conv_costs(model))
-    results_dic['Avoided NG costs ($/year)'] = value(annualized_avoided_ng_costs())
-    results_dic['Breakeven price ($/MMBtu)'] = compute_breakeven_price(results_dic) # Compute BE price before adding avoided ng costs!
-    results_dic['BE wo PTC ($/MMBtu)'] = compute_be_wo_PTC(results_dic)
-    results_dic['Net Revenues ($/year)'] += results_dic['Avoided NG costs ($/year)']
-    results_dic['Net Revenues with H2 PTC ($/year)'] = results_dic['Net Revenues ($/year)']+results_dic['H2 PTC Revenues ($/year)']
-    results_dic['Surplus ANR Cap. (MWe)'] = value(compute_surplus_capacity(model))
-    results_dic['Net Annual Revenues ($/MWe/y)'] = (results_dic['Net Revenues ($/year)']+results_dic['Avoided NG costs ($/year)'])/results_dic['Depl. ANR Cap. (MWe)']
-    results_dic['Net Annual Revenues with H2 PTC ($/MWe/y)'] = (results_dic['Net Revenues with H2 PTC ($/year)']+results_dic['Avoided NG costs ($/year)'])/results_dic['Depl. ANR Cap. (MWe)']
-    for g in model.G: 
-      if value(model.vS[g]) >=1: 
-        results_dic['ANR type'] = g
-        total_nb_modules = int(np.sum([value(model.vM[n,g]) for n in model.N]))
-        results_dic['# ANR modules'] = total_nb_modules
-        for n in model.N:
-          if value(model.vM[n,g]) >=1:
-            for h in model.H:
-              results_dic[h] += value(model.vQ[n,h,g])
-    print(f'Solved {plant}')
+    results_dic = compile_steel_results(plant, ANR_data, H2_data, deployment_model.extract_deployment(model))
+    print(f'Solved {plant} (build {build_time:.3f} s, solve {solve_time:.3f} s)')
     return results_dic
   else:
     print('Not feasible.')
     return None
 
+
+def solve_steel_plant_deployment_matrix(plant, ANR_data, H2_data, formulation='slots', solver='highs'):
+  """Solves the deployment at a steel plant with the MILP built directly as sparse matrices (no Pyomo model)"""
+  print(f'Start {plant}')
+  steel_cap_ton_per_annum, h2_dem_kg_per_day, elec_dem_MWe = get_steel_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  matrix = deployment_model.build_deployment_matrix(params, h2_dem_kg_per_day, elec_dem_MWe, MaxANRMod,
+                                                   formulation=formulation)
+  deployment = deployment_model.solve_deployment_matrix(params, matrix, options=solver_config.get_scipy_options(solver))
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  results_dic = compile_steel_results(plant, ANR_data, H2_data, deployment)
+  print(f'Solved {plant} (build {matrix["build_time"]:.3f} s, solve {deployment["Solve time (s)"]:.3f} s)')
+  return results_dic
+
+
+def solve_steel_plant_deployment_fast(plant, ANR_data, H2_data, formulation='slots', solver=None):
+  """Solves the deployment at a steel plant exactly by enumeration, without MILP solver"""
+  steel_cap_ton_per_annum, h2_dem_kg_per_day, elec_dem_MWe = get_steel_plant_demand(plant)
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=WACC)
+  deployment = deployment_model.fast_solve(params, h2_dem_kg_per_day, elec_dem_MWe, MaxANRMod)
+  if deployment is None:
+    print('Not feasible.')
+    return None
+  return compile_steel_results(plant, ANR_data, H2_data, deployment)
+
+
+def solve_steel_plant_deployment_check(plant, ANR_data, H2_data, formulation='slots', solver='cplex'):
+  """Solves the deployment at a steel plant with the MILP and by enumeration and reports the differences"""
+  results_dic = solve_steel_plant_deployment(plant, ANR_data, H2_data, formulation=formulation, solver=solver)
+  results_fast = solve_steel_plant_deployment_fast(plant, ANR_data, H2_data)
+  deployment_model.report_differences(plant, results_dic, results_fast)
+  return results_dic
+
 def compute_breakeven_price(results_ref):
   costs = -results_ref['Net Revenues with H2 PTC ($/year)'] # NEt revenues Negative by convention
   plant_cap = results_ref['Steel prod. (ton/year)']
@@ -328,24 +340,64 @@ def compute_be_wo_PTC(results_ref):
   breakeven_price = breakeven_price_per_ton/utils.coal_heat_content
   return breakeven_price
 
-def main(anr_tag='FOAK', wacc=WACC, print_main_results=True, print_results=False): 
+def sweep_steel_plants(scenarios, solver='highs', formulation='ordered', warmstart=True):
+  """Solves the deployment at all steel plants for each scenario of a sweep, each plant model is built once and re-solved
+  with a persistent solver (see deployment_model.sweep_plant)
+  Args:
+    scenarios (list[dict]): scenarios, see deployment_model.load_sweep_scenarios
+    solver (str): persistent solver preset
+    formulation (str): 'slots' or 'ordered'
+    warmstart (bool): start each solve from the solution of the previous scenario
+  Returns:
+    df (DataFrame): results of all plants and scenarios
+  """
+  abspath = os.path.abspath(__file__)
+  dname = os.path.dirname(abspath)
+  os.chdir(dname)
+  steel_ids = demand_registry.get_plant_ids('steel')
+  registry = demand_registry.get_registry(['steel'])
+  h2_dem = {plant:get_steel_plant_demand(plant)[1] for plant in steel_ids}
+  elec_dem = {plant:get_steel_plant_demand(plant)[2] for plant in steel_ids}
+  scenario_data = deployment_model.load_sweep_scenarios(scenarios)
+  with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+    results = pool.starmap(deployment_model.sweep_plant, [(plant, scenario_data, h2_dem[plant], elec_dem[plant], MaxANRMod, True, compile_steel_results,
+                                                           solver, formulation, warmstart) for plant in steel_ids])
+  df = pd.DataFrame([results_ref for plant_results in results for results_ref in plant_results if results_ref is not None])
+  return df
+
+
+SOLVE_FUNCTIONS = {'pyomo':solve_steel_plant_deployment, 'matrix':solve_steel_plant_deployment_matrix,
+                   'fast':solve_steel_plant_deployment_fast, 'check':solve_steel_plant_deployment_check}
+
+def get_cache_components(plant, ANR_data, H2_data, backend, formulation, solver):
+  return results_cache.get_plant_components('steel', plant, ANR_data, H2_data, sys.modules[__name__],
+                                           {'Coal price ($/MMBtu)':utils.get_met_coal_eia_aeo_price()}, backend, formulation, solver)
+
+def main(anr_tag='FOAK', wacc=WACC, print_main_results=True, print_results=False, backend='pyomo', formulation='slots', solver='cplex', use_cache=True): 
   # Go the present directory
   abspath = os.path.abspath(__file__)
   dname = os.path.dirname(abspath)
   os.chdir(dname)
 
-  # Load steel data
-  steel_df = pd.read_excel('h2_demand_bfbof_steel_us_2022.xlsx', sheet_name='processed')
-  steel_ids = list(steel_df['Plant'])
+  # Load steel data once, shared with the workers through the pool initializer
+  steel_ids = demand_registry.get_plant_ids('steel')
+  registry = demand_registry.get_registry(['steel'])
 
   # Load ANR and H2 parameters
   ANR_data, H2_data = utils.load_data(anr_tag=anr_tag)
 
   # Build results dataset one by one
 
-  with Pool(10) as pool:
-    results = pool.starmap(solve_steel_plant_deployment, [(plant, ANR_data, H2_data) for plant in steel_ids])
-  pool.close()
+  def solve_plants(plants):
+    with Pool(10, initializer=demand_registry.init_registry, initargs=(registry,)) as pool:
+      return pool.starmap(SOLVE_FUNCTIONS[backend], [(plant, ANR_data, H2_data, formulation, solver) for plant in plants])
+
+  if use_cache:
+    # Plants whose inputs did not change are read from the results cache without building a model
+    plant_components = {plant:get_cache_components(plant, ANR_data, H2_data, backend, formulation, solver) for plant in steel_ids}
+    results = results_cache.solve_with_cache('steel', steel_ids, plant_components, solve_plants)
+  else:
+    results = solve_plants(steel_ids)
 
   df = pd.DataFrame(results)
 
@@ -1,7 +1,7 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from utils import cashflows_color_map, palette, letter_annotation
+from utils import cashflows_color_map, palette, letter_annotation, read_excel_cached
 import seaborn as sns
 
 cogen_tag = False
@@ -17,7 +17,7 @@ anr_design_palette = {'HTGR':'blue',
 def load_data(OAK):
   list_df = []
   for ind, ind_label in industries.items():
-    df = pd.read_excel(f'./results/clean_results_anr_{OAK}_h2_wacc_0.077.xlsx', sheet_name=ind)
+    df = read_excel_cached(f'./results/clean_results_anr_{OAK}_h2_wacc_0.077.xlsx', sheet_name=ind)
     df['Industry'] = ind_label
     list_df.append(df)
   total_df = pd.concat(list_df, ignore_index=True)
@@ -25,7 +25,7 @@ def load_data(OAK):
 
 
 def compute_normalized_net_revenues(df, OAK):
-  anr_data = pd.read_excel('./ANRs.xlsx', sheet_name=OAK)
+  anr_data = read_excel_cached('./ANRs.xlsx', sheet_name=OAK)
   anr_data = anr_data[['Reactor', 'Thermal Efficiency']]
   df = df.merge(anr_data, left_on='ANR type', right_on='Reactor')
   df['Net Annual Revenues (M$/MWe/y)'] = df['Net Annual Revenues ($/MWe/y)']/1e6
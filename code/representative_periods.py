@@ -0,0 +1,108 @@
+import numpy as np
+
+"""Representative periods of hourly time series for screening runs of the hourly models.
+The periods (days or weeks) of a year are clustered with k-medoids on their hourly profiles, each period of the year is
+represented by its medoid. The sequence of representatives is kept (chronology) so that the models can link
+consecutive periods, e.g. ramp constraints between the last hour of a period and the first hour of the next one."""
+
+HOURS_PER_DAY = 24
+HOURS_PER_WEEK = 168
+
+
+def _kmedoids_init(distances, k, rng):
+  """k-medoids++ initialization: medoids drawn with probability proportional to the squared distance"""
+  n = len(distances)
+  medoids = [int(rng.integers(n))]
+  for _ in range(1, k):
+    d2 = distances[:, medoids].min(axis=1)**2
+    if d2.sum() == 0:
+      medoids.append(int(np.setdiff1d(np.arange(n), medoids)[0]))
+    else:
+      medoids.append(int(rng.choice(n, p=d2/d2.sum())))
+  return np.array(medoids)
+
+
+def kmedoids(profiles, k, seed=0, max_iter=100):
+  """k-medoids (alternating assignment and medoid update) with euclidean distance
+  Args:
+    profiles (ndarray): profiles to cluster, shape (n, P)
+    k (int): number of clusters
+    seed (int): seed of the initialization
+    max_iter (int): maximum number of iterations
+  Returns:
+    medoids (ndarray): indices of the medoid profiles, shape (k,)
+    assignment (ndarray): cluster of each profile, shape (n,)
+  """
+  n = len(profiles)
+  k = min(k, n)
+  sq = (profiles**2).sum(axis=1)
+  distances = np.sqrt(np.maximum(sq[:, None]+sq[None, :]-2*profiles@profiles.T, 0))
+  medoids = _kmedoids_init(distances, k, np.random.default_rng(seed))
+  for _ in range(max_iter):
+    assignment = distances[:, medoids].argmin(axis=1)
+    new_medoids = medoids.copy()
+    for c in range(k):
+      members = np.flatnonzero(assignment == c)
+      if len(members) > 0:
+        new_medoids[c] = members[distances[np.ix_(members, members)].sum(axis=1).argmin()]
+    if np.array_equal(new_medoids, medoids):
+      break
+    medoids = new_medoids
+  return medoids, distances[:, medoids].argmin(axis=1)
+
+
+def cluster_periods(series, k, period_hours=HOURS_PER_DAY, seed=0):
+  """Representative periods of an hourly time series
+  The full periods are clustered with k-medoids, a last incomplete period (e.g. the last 24 hours of the year with weeks)
+  is assigned to the closest medoid on its hours.
+  Args:
+    series (ndarray): hourly values, shape (T,)
+    k (int): number of representative periods
+    period_hours (int): hours per period, 24 for days, 168 for weeks
+    seed (int): seed of the k-medoids initialization
+  Returns:
+    periods (dict):
+      'medoids' (ndarray): index of the period of each representative, shape (k,)
+      'values' (ndarray): hourly values of the representatives, shape (k, period_hours)
+      'assignment' (ndarray): representative of each period of the series in chronological order
+      'weights' (ndarray): number of hours of the series represented by each hour of the representatives, shape (k, period_hours)
+      'period_hours' (int), 'hours' (int): hours per period and length of the series
+  """
+  series = np.asarray(series, dtype=np.float64)
+  T = len(series)
+  n_full = T//period_hours
+  profiles = series[:n_full*period_hours].reshape(n_full, period_hours)
+  medoids, assignment = kmedoids(profiles, k, seed=seed)
+  values = profiles[medoids]
+  weights = np.zeros(values.shape)
+  np.add.at(weights, assignment, 1)
+  tail = T-n_full*period_hours
+  if tail > 0:
+    tail_cluster = np.linalg.norm(values[:, :tail]-series[-tail:], axis=1).argmin()
+    assignment = np.append(assignment, tail_cluster)
+    weights[tail_cluster, :tail] += 1
+  return {'medoids':medoids, 'values':values, 'assignment':assignment, 'weights':weights, 'period_hours':period_hours,
+          'hours':T}
+
+
+def get_transitions(periods):
+  """Distinct pairs of representatives of consecutive periods, used to link the last hour of a representative to the
+  first hour of the next one
+  Returns:
+    transitions (list[tuple]): (representative, next representative)
+  """
+  assignment = periods['assignment']
+  return sorted(set(zip(assignment[:-1].tolist(), assignment[1:].tolist())))
+
+
+def expand_periods(values, periods):
+  """Hourly series of the year from values on the representative periods
+  Args:
+    values (ndarray): values on the representatives, shape (k, period_hours) or (S, k, period_hours)
+    periods (dict): output of cluster_periods
+  Returns:
+    series (ndarray): hourly series, shape (T,) or (S, T)
+  """
+  values = np.asarray(values)
+  expanded = values[..., periods['assignment'], :]
+  return expanded.reshape(values.shape[:-2]+(-1,))[..., :periods['hours']]
@@ -0,0 +1,181 @@
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+"""Content-addressed on-disk cache of the per-plant results of the opt_deployment_* scripts.
+The key of a plant is the hash of its input components: demand row, ANR and H2 data, constants of utils and of the
+industry script, prices used in the results, and model version, source code, backend, formulation and solver settings.
+Each component is hashed separately so that the invalidation report can tell which components changed for a miss."""
+
+RESULTS_CACHE_DIR = './cache/results'
+# Functions of utils used in the results of the opt_deployment_* scripts, their constants are in 'utils constants'
+UTILS_RESULTS_FUNCTIONS = ['get_ng_price_aeo', '_ng_price_map', 'load_ng_prices', 'get_met_coal_eia_aeo_price']
+# Backends never served from the cache: 'check' cross-checks the other backends
+UNCACHED_BACKENDS = ['check']
+
+
+def _hash_bytes(data):
+  return hashlib.sha256(data).hexdigest()
+
+
+def hash_component(value):
+  """Hash of a key component: DataFrame, Series or json-serializable value (dict, list, number, str)"""
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+    data = pd.util.hash_pandas_object(value, index=True).values.tobytes()
+    return _hash_bytes(data+json.dumps(columns, default=str).encode())
+  return _hash_bytes(json.dumps(value, sort_keys=True, default=str).encode())
+
+
+def get_constants(module):
+  """Numerical module-level constants of a module (e.g. WACC, ITC and PTC values of utils)"""
+  return {name:value for name, value in vars(module).items()
+          if not name.startswith('_') and isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def get_source_hashes(modules, functions=()):
+  """Hash of the source file of each module and of the source of each function, so that code changes of the models
+  and results invalidate the cache"""
+  import inspect
+  from utils import file_hash
+  hashes = {module.__name__:file_hash(module.__file__) for module in modules}
+  hashes.update({f'{function.__module__}.{function.__name__}':_hash_bytes(inspect.getsource(function).encode())
+                 for function in functions})
+  return hashes
+
+
+def get_cache_key(components):
+  """Key of a plant from its input components
+  Args:
+    components (dict): component name to value
+  Returns:
+    key (str): hash of all components
+    component_hashes (dict): hash of each component
+  """
+  component_hashes = {name:hash_component(value) for name, value in components.items()}
+  return _hash_bytes(json.dumps(component_hashes, sort_keys=True).encode()), component_hashes
+
+
+def _plant_index_path(industry, plant, cache_dir):
+  return os.path.join(cache_dir, industry, 'index', _hash_bytes(str(plant).encode())[:32]+'.json')
+
+
+def _entry_path(industry, key, cache_dir):
+  return os.path.join(cache_dir, industry, key[:2], key+'.pkl')
+
+
+def explain_miss(industry, plant, component_hashes, cache_dir=RESULTS_CACHE_DIR):
+  """Reason of a cache miss, from the components of the last results stored for the plant"""
+  index_path = _plant_index_path(industry, plant, cache_dir)
+  if not os.path.isfile(index_path):
+    return 'no cached results for this plant'
+  with open(index_path) as f:
+    last_hashes = json.load(f)['components']
+  changed = [name for name in component_hashes if last_hashes.get(name) != component_hashes[name]]
+  if not changed:
+    return 'cached results file missing'
+  return 'changed: '+', '.join(changed)
+
+
+def load_results(industry, plant_components, cache_dir=RESULTS_CACHE_DIR, report=True):
+  """Loads the cached results of the plants whose inputs did not change
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant_components (dict): plant id to components (see get_cache_key)
+    cache_dir (str): cache directory
+    report (bool): if True print the invalidation report of the misses
+  Returns:
+    cached (dict): plant id to results for the hits (None for plants cached as infeasible)
+    misses (dict): plant id to reason of the miss
+  """
+  cached, misses = {}, {}
+  for plant, components in plant_components.items():
+    key, component_hashes = get_cache_key(components)
+    entry_path = _entry_path(industry, key, cache_dir)
+    if os.path.isfile(entry_path):
+      with open(entry_path, 'rb') as f:
+        cached[plant] = pickle.load(f)
+    else:
+      misses[plant] = explain_miss(industry, plant, component_hashes, cache_dir)
+  if report:
+    print(f'{industry}: {len(cached)} plants from cache, {len(misses)} to solve')
+    for plant, reason in misses.items():
+      print(f'  {plant}: {reason}')
+  return cached, misses
+
+
+def store_results(industry, plant_components, results, cache_dir=RESULTS_CACHE_DIR):
+  """Stores the results of plants in the cache
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant_components (dict): plant id to components (see get_cache_key)
+    results (dict): plant id to results dictionary (or None if infeasible)
+    cache_dir (str): cache directory
+  Returns:
+    None
+  """
+  for plant, results_ref in results.items():
+    key, component_hashes = get_cache_key(plant_components[plant])
+    entry_path = _entry_path(industry, key, cache_dir)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    tmp_path = entry_path+f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      pickle.dump(results_ref, f)
+    os.replace(tmp_path, entry_path)
+    index_path = _plant_index_path(industry, plant, cache_dir)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path, 'w') as f:
+      json.dump({'plant':str(plant), 'key':key, 'components':component_hashes}, f, indent=1)
+
+
+def get_plant_components(industry, plant, ANR_data, H2_data, module, prices, backend, formulation, solver):
+  """Input components of the results of a plant
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant (str): plant id
+    ANR_data, H2_data (DataFrame): ANR and H2 data used in the optimization
+    module (module): industry script, its numerical constants and source are part of the key
+    prices (dict): fossil fuel prices used in the results of the plant
+    backend (str): solve backend, see SOLVE_FUNCTIONS of the opt_deployment_* scripts
+    formulation (str): model formulation
+    solver (str): solver preset, None if the backend does not use a solver
+  Returns:
+    components (dict): component name to value
+  """
+  import utils
+  import demand_registry
+  import deployment_model
+  import solver_config
+  solver_settings = None if solver is None else solver_config.get_solver_settings(solver)
+  return {'demand':demand_registry.get_plant(industry, plant),
+          'ANR_data':ANR_data,
+          'H2_data':H2_data,
+          'utils constants':get_constants(utils),
+          'industry constants':get_constants(module),
+          'prices':prices,
+          'model':{'version':deployment_model.FORMULATION_VERSION,
+                   'source':get_source_hashes([deployment_model, module],
+                                              [getattr(utils, name) for name in UTILS_RESULTS_FUNCTIONS]),
+                   'backend':backend,
+                   'formulation':formulation, 'solver':solver_settings}}
+
+
+def solve_with_cache(industry, plant_ids, plant_components, solve_plants):
+  """Solves the plants missing from the cache and stores their results
+  Args:
+    industry (str): 'ammonia', 'steel' or 'refining'
+    plant_ids (list): plant ids
+    plant_components (dict): plant id to components (see get_plant_components)
+    solve_plants (function): list of plant ids to list of results
+  Returns:
+    results (list): results of the plants in the order of plant_ids
+  """
+  if any(components['model']['backend'] in UNCACHED_BACKENDS for components in plant_components.values()):
+    return solve_plants(list(plant_ids))
+  cached, misses = load_results(industry, plant_components)
+  to_solve = [plant for plant in plant_ids if plant in misses]
+  solved = dict(zip(to_solve, solve_plants(to_solve))) if to_solve else {}
+  store_results(industry, plant_components, solved)
+  return [cached[plant] if plant in cached else solved[plant] for plant in plant_ids]
@@ -4,19 +4,34 @@ import os
 from itertools import product
 import numpy as np
 from matplotlib.lines import Line2D
+from utils import read_excel_cached
+import demand_registry
 
 INDUSTRIES = ['ammonia', 'process_heat', 'refining','steel']
 years = [2024, 2030, 2040]
 cambium_scenarios = ['HighRECost','LowRECostTCExpire','MidCaseTCExpire', 'MidCase', 'LowRECost',\
                     'HighNGPrice', 'LowNGPrice']
+# Process heat demand of prep_process_heat.py, the other industries are in demand_registry
+HEAT_DEMAND = {'path':'./h2_demand_industry_heat.xlsx', 'sheet':'all_years', 'state_col':'STATE'}
 
 
-def get_average_revenues(year, industry, scenario):
+def get_industry_states(industry):
+  """Abbreviations of the states with at least one plant of an industry"""
+  if industry == 'process_heat':
+    heat_df = read_excel_cached(HEAT_DEMAND['path'], sheet_name=HEAT_DEMAND['sheet'])
+    return sorted(set(heat_df[HEAT_DEMAND['state_col']].dropna()))
+  return demand_registry.get_states(industry)
+
+
+def get_average_revenues(year, industry, scenario, anr_tag='FOAK'):
   """Compute the average revenues for ANRs in ANR-H2 and electricity dedicated ANRs
+  The electricity revenues are the average over the designs and the states of the industry of the price taker sweep
+  store (electricity_price_taker.sweep), the H2 revenues are read from the industry results.
   Args: 
     year (int): year
     industry (str): indsutrial sector
     scenario (str): cambium scenario
+    anr_tag (str): ANR tag of the price taker results
   Returns:
     avg_h2 (float): Average revenue for ANR in ANR-H2 in M$/year/MWe
     avg_elec (float): Average revenue for ANR producing electricity in M$/year/MWe
@@ -25,15 +40,19 @@ def get_average_revenues(year, industry, scenario):
   assert industry in INDUSTRIES
   assert scenario in cambium_scenarios
 
+  from electricity_price_taker import read_price_taker_results
+  elec_df = read_price_taker_results(scenarios=[scenario], years=[year], tags=[anr_tag], states=get_industry_states(industry))
+  avg_elec = elec_df['Electricity sales (M$/year/MWe)'].mean() if len(elec_df) > 0 else None
+  if avg_elec is None:
+    print(f'No price taker results for {year}, {industry}, {scenario}')
+
   result_file = './results/electricity_prod_results_no_learning_'+scenario+'_'+str(year)+'.xlsx'
   try:
-    res_df = pd.read_excel(result_file, sheet_name=industry, index_col=0)
-    avg_elec = res_df['Electricity sales (M$/year/MWe)'].mean()
+    res_df = read_excel_cached(result_file, sheet_name=industry, index_col=0)
     avg_h2 = (res_df['H2 PTC revenues (M$/year/MWe)']+res_df['Avoided fossil fuel cost (M$/year/MWe)']).mean()
   except FileNotFoundError:
-    print(f'No results for {year}, {industry}, {scenario}')
+    print(f'No H2 results for {year}, {industry}, {scenario}')
     avg_h2 = None
-    avg_elec = None
   return avg_h2, avg_elec
 
 
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import utils
+import deployment_model
+import demand_registry
+
+"""Sensitivity of the results of solved deployments to the credits, WACC, fossil fuel price and CAPEX, without re-solving.
+The annualized cost components stored in the results (ANR and H2 CAPEX, O&M, conversion costs, avoided fuel costs) are
+rescaled on grids of PTC, ITC, WACC, NG price and CAPEX multipliers with NumPy broadcasting, and the breakeven prices
+are computed with the functions of the opt_deployment_* scripts.
+The deployment is kept fixed: the NG price and PTC do not change the optimal deployment, the ITC, WACC and CAPEX do.
+Grid points where the fixed deployment costs more than another candidate deployment (cheapest single H2 technology
+deployment of each design and technology) are flagged for a re-solve; unflagged points are not a proof of optimality."""
+
+# Order of the grid axes after the plant axis
+AXES = ['PTC ($/kg)', 'ITC ANR', 'ITC H2', 'WACC', 'NG price ($/MMBtu)', 'ANR CAPEX mult.', 'H2 CAPEX mult.']
+CONVERSION_LIFE = 20 # years, ammonia and steel conversion equipment
+
+
+def _crf_ratio(wacc, base_wacc, life):
+  return deployment_model.compute_crf(wacc, life)/deployment_model.compute_crf(base_wacc, life)
+
+
+def get_anr_life(crf, wacc=utils.WACC):
+  """ANR lifetime (years) from the CRF stored in the results"""
+  return -np.log(1-wacc/crf)/np.log(1+wacc)
+
+
+def get_h2_life(results_df, H2_data):
+  """H2 modules lifetime (years) of each plant from the H2 modules in the results and the lifetimes in H2_data, weighted
+  by the CAPEX of each technology, the mean lifetime where no H2 module is deployed"""
+  weighted, total = np.zeros(len(results_df)), np.zeros(len(results_df))
+  for (tech, design), row in H2_data.iterrows():
+    if tech not in results_df:
+      continue
+    capex = results_df[tech].to_numpy(dtype=float)*(results_df['ANR type'] == design).to_numpy()\
+            *row['H2Cap (MWe)']*row['CAPEX ($/MWe)']
+    weighted += capex*row['Life (y)']
+    total += capex
+  return np.where(total > 0, weighted/np.where(total > 0, total, 1), H2_data['Life (y)'].mean())
+
+
+def get_conversion_capital(industry, results_df, wacc=utils.WACC):
+  """Annualized conversion CAPEX ($/year) in the 'Conversion costs ($/year)' of the results, the rest is O&M and
+  iron ore costs that do not depend on the credits nor the WACC"""
+  crf = deployment_model.compute_crf(wacc, CONVERSION_LIFE)
+  if industry == 'ammonia':
+    import opt_deployment_ammonia
+    return np.full(len(results_df), opt_deployment_ammonia.auxNucNH3CAPEX*(1-utils.ITC_H2)*crf)
+  if industry == 'steel':
+    return results_df['Steel prod. (ton/year)'].to_numpy(dtype=float)\
+           *(utils.eaf_CAPEX+utils.shaft_CAPEX/utils.steel_to_dri_ratio)*(1-utils.ITC_H2)*crf
+  return np.zeros(len(results_df))
+
+
+def get_breakeven_functions(industry):
+  """Breakeven fossil fuel price functions (with PTC, without PTC) of an industry, they work on arrays"""
+  if industry == 'ammonia':
+    import opt_deployment_ammonia as module
+    return module.compute_ng_breakeven_price, module.compute_ng_be_without_ptc
+  if industry == 'steel':
+    import opt_deployment_steel as module
+    return module.compute_breakeven_price, module.compute_be_wo_PTC
+  import opt_deployment_refining as module
+  return module.compute_breakeven_price, module.compute_ng_be_wo_PTC
+
+
+def get_candidates(industry, results_df, ANR_data, H2_data, base_wacc=utils.WACC):
+  """Cheapest deployment of each design with a single H2 technology at each plant, with the exact packing of identical
+  H2 modules in the ANR modules
+  Returns:
+    candidates (dict): arrays of shape (plants, designs x technologies): baseline annualized ANR and H2 CAPEX ($/year),
+      ANR and H2 O&M ($/year), ANR and H2 lifetimes, inf costs where infeasible
+  """
+  params = deployment_model.get_deployment_params(ANR_data, H2_data, wacc=base_wacc)
+  G, H = params['G'], params['H']
+  h2_life = np.log(1/(1-base_wacc/params['h2_crf']))/np.log(1+base_wacc)
+  anr_life = get_anr_life(params['anr_crf'], base_wacc)
+  shape = (len(results_df), len(G)*len(H))
+  candidates = {key:np.full(shape, np.inf) for key in ['ANR CAPEX ($/year)', 'H2 CAPEX ($/year)', 'ANR O&M ($/year)', 'H2 O&M ($/year)']}
+  candidates['ANR life'] = np.repeat(anr_life, len(H))[None, :]
+  candidates['H2 life'] = np.tile(h2_life, len(G))[None, :]
+  for p, plant in enumerate(results_df['id']):
+    site = demand_registry.get_site(industry, plant)
+    D, E = site['H2 demand (kg/day)'], site['Electricity demand (MWe)']
+    for g in range(len(G)):
+      C = params['anr_cap'][g]
+      for h in range(len(H)):
+        s = params['h2_cap_elec'][h,g]
+        per_module = np.floor(C/s+1e-9)
+        if np.isnan(s) or per_module == 0:
+          continue
+        q = max(0, np.ceil(D/(params['h2_cap_h2'][h]*24)-1e-9))
+        N = max(1, np.ceil(q/per_module), np.ceil((s*q+E)/C-1e-9))
+        if N > site['max modules']:
+          continue
+        k = g*len(H)+h
+        candidates['ANR CAPEX ($/year)'][p, k] = N*C*params['anr_capex'][g]*(1-utils.ITC_ANR)*params['anr_crf'][g]
+        candidates['ANR O&M ($/year)'][p, k] = N*C*(params['anr_fom'][g]+params['anr_vom'][g]*deployment_model.HOURS_PER_YEAR)
+        candidates['H2 CAPEX ($/year)'][p, k] = q*s*params['h2_capex'][h]*(1-utils.ITC_H2)*params['h2_crf'][h]
+        candidates['H2 O&M ($/year)'][p, k] = q*s*(params['h2_fom'][h]+params['h2_vom'][h]*deployment_model.HOURS_PER_YEAR)
+  return candidates
+
+
+def compute_sensitivity(results_df, industry, ptc=None, itc_anr=None, itc_h2=None, wacc=None, ng_price=None,
+                        anr_capex_mult=1., h2_capex_mult=1., ANR_data=None, H2_data=None, base_wacc=utils.WACC,
+                        h2_life=None):
+  """Net revenues and breakeven prices of solved deployments over a grid of assumptions
+  Args:
+    results_df (DataFrame): results of an opt_deployment_* script (one row per plant), solved with the utils credits
+      and base_wacc
+    industry (str): 'ammonia', 'steel' or 'refining'
+    ptc (array): H2 PTC ($/kg), utils.h2_ptc by default
+    itc_anr, itc_h2 (array): ITC on the ANR and H2 CAPEX (and conversion CAPEX for itc_h2), utils values by default
+    wacc (array): WACC, base_wacc by default
+    ng_price (array): fossil fuel price ($/MMBtu), the price of each plant in the results by default
+    anr_capex_mult, h2_capex_mult (array): multipliers of the ANR and H2 CAPEX
+    ANR_data, H2_data (DataFrame): if given, flag the grid points where the deployment may not be optimal anymore
+    base_wacc (float): WACC of the results
+    h2_life (float): lifetime of the H2 modules (years), from the results and H2_data (utils.load_data by default)
+      with get_h2_life if None
+  Returns:
+    surface (dict): 'axes' (axis name to values), and arrays of shape (plants, *axes lengths):
+      'Net Revenues ($/year)' and 'Net Revenues with H2 PTC ($/year)' (with avoided fuel costs),
+      'Breakeven price ($/MMBtu)', 'BE wo PTC ($/MMBtu)', 'BE ANR CAPEX ($/MWe)' (ANR CAPEX for zero net revenues with
+      PTC) and 'Re-solve' if ANR_data and H2_data are given
+  """
+  defaults = [utils.h2_ptc, utils.ITC_ANR, utils.ITC_H2, base_wacc, np.nan, 1., 1.]
+  values = [ptc, itc_anr, itc_h2, wacc, ng_price, anr_capex_mult, h2_capex_mult]
+  axes = {name:np.atleast_1d(np.asarray(default if value is None else value, dtype=np.float64))
+          for name, value, default in zip(AXES, values, defaults)}
+  n = len(AXES)+1
+  def on_axis(array, axis):
+    return np.asarray(array, dtype=np.float64).reshape((1,)*axis+(-1,)+(1,)*(n-1-axis))
+  def column(name):
+    return on_axis(results_df[name].to_numpy(dtype=np.float64), 0)
+  ptc, itc_anr, itc_h2, wacc, ng_price, anr_mult, h2_mult = [on_axis(axes[name], i+1) for i, name in enumerate(AXES)]
+
+  # Baseline components
+  anr_crf = column('ANR CRF')
+  anr_life = get_anr_life(anr_crf, base_wacc)
+  if h2_life is None:
+    h2_life = on_axis(get_h2_life(results_df, utils.load_data()[1] if H2_data is None else H2_data), 0)
+  conv_capital = on_axis(get_conversion_capital(industry, results_df, base_wacc), 0)
+  fuel_price = column('State price ($/MMBtu)')
+  costs = column('ANR CAPEX ($/year)')+column('H2 CAPEX ($/year)')+column('ANR O&M ($/year)')+column('H2 O&M ($/year)')
+  # Other revenues of the results, e.g. grid sales of cogen_hourly
+  other = column('Net Revenues ($/year)')-column('Avoided NG costs ($/year)')+costs+column('Conversion costs ($/year)')
+
+  # Scaling of the annualized CAPEX with the credits, WACC and multipliers
+  anr_factor = anr_mult*(1-itc_anr)/(1-utils.ITC_ANR)*_crf_ratio(wacc, base_wacc, anr_life)
+  h2_factor = h2_mult*(1-itc_h2)/(1-utils.ITC_H2)*_crf_ratio(wacc, base_wacc, h2_life)
+  conv_factor = (1-itc_h2)/(1-utils.ITC_H2)*_crf_ratio(wacc, base_wacc, CONVERSION_LIFE)
+  anr_capex = column('ANR CAPEX ($/year)')*anr_factor
+  deployment_costs = anr_capex+column('ANR O&M ($/year)')+column('H2 CAPEX ($/year)')*h2_factor+column('H2 O&M ($/year)')
+  conversion = conv_capital*conv_factor+column('Conversion costs ($/year)')-conv_capital
+  net_before_fuel = other-deployment_costs-conversion
+  ptc_revenues = column('H2 Dem. (kg/day)')*365*ptc
+  price = np.where(np.isnan(ng_price), fuel_price, ng_price)
+  avoided = column('Avoided NG costs ($/year)')/fuel_price*price
+
+  # Breakeven prices from the net revenues before avoided fuel costs, as in the compile_*_results functions
+  be_function, be_wo_ptc_function = get_breakeven_functions(industry)
+  be_inputs = {name:column(name) for name in ['H2 Dem. (kg/day)', 'Ammonia capacity (tNH3/year)', 'Steel prod. (ton/year)']
+               if name in results_df}
+  be_inputs['Net Revenues ($/year)'] = net_before_fuel
+  be_inputs['Net Revenues with H2 PTC ($/year)'] = net_before_fuel+ptc_revenues
+  shape = np.broadcast_shapes(net_before_fuel.shape, ptc_revenues.shape, avoided.shape)
+  surface = {'axes':axes, 'id':results_df['id'].to_numpy()}
+  surface['Net Revenues ($/year)'] = np.broadcast_to(net_before_fuel+avoided, shape)
+  surface['Net Revenues with H2 PTC ($/year)'] = np.broadcast_to(net_before_fuel+avoided+ptc_revenues, shape)
+  surface['Breakeven price ($/MMBtu)'] = np.broadcast_to(be_function(be_inputs), shape)
+  surface['BE wo PTC ($/MMBtu)'] = np.broadcast_to(be_wo_ptc_function(be_inputs), shape)
+  # Net revenues are linear in the ANR CAPEX ($/MWe)
+  capex_slope = column('Depl. ANR Cap. (MWe)')*(1-itc_anr)*deployment_model.compute_crf(wacc, anr_life)
+  surface['BE ANR CAPEX ($/MWe)'] = np.broadcast_to(column('ANR CAPEX ($/MWe)')*anr_mult
+                                                    +surface['Net Revenues with H2 PTC ($/year)']/capex_slope, shape)
+
+  if ANR_data is not None and H2_data is not None:
+    candidates = get_candidates(industry, results_df, ANR_data, H2_data, base_wacc)
+    cheapest = np.full(shape, np.inf)
+    for k in range(candidates['ANR CAPEX ($/year)'].shape[1]):
+      if np.isinf(candidates['ANR CAPEX ($/year)'][:, k]).all():
+        continue
+      candidate = on_axis(candidates['ANR CAPEX ($/year)'][:, k], 0)*anr_mult*(1-itc_anr)/(1-utils.ITC_ANR)\
+                  *_crf_ratio(wacc, base_wacc, candidates['ANR life'][0, k])+on_axis(candidates['ANR O&M ($/year)'][:, k], 0)\
+                  +on_axis(candidates['H2 CAPEX ($/year)'][:, k], 0)*h2_mult*(1-itc_h2)/(1-utils.ITC_H2)\
+                  *_crf_ratio(wacc, base_wacc, candidates['H2 life'][0, k])+on_axis(candidates['H2 O&M ($/year)'][:, k], 0)
+      np.minimum(cheapest, np.where(np.isnan(candidate), np.inf, candidate), out=cheapest)
+    surface['Re-solve'] = np.broadcast_to(deployment_costs, shape) > cheapest*(1+1e-9)
+  return surface
+
+
+def surface_to_frame(surface, fields=None):
+  """Long DataFrame of a sensitivity surface, one row per plant and grid point"""
+  fields = fields or [key for key in surface if key not in ('axes', 'id')]
+  grid = np.meshgrid(surface['id'], *surface['axes'].values(), indexing='ij')
+  df = pd.DataFrame({'id':grid[0].ravel()})
+  for name, values in zip(surface['axes'], grid[1:]):
+    df[name] = values.ravel()
+  for field in fields:
+    df[field] = surface[field].ravel()
+  return df
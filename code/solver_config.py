@@ -0,0 +1,101 @@
+from pyomo.environ import SolverFactory
+
+"""Solver configuration shared by all solve functions.
+A named preset selects the solver and its settings, the generic settings (time limit, relative MIP gap, threads) are
+translated into the option names of each solver so that the models can run with CPLEX or with open-source solvers."""
+
+# Generic settings: timelimit (s), mipgap (relative), threads, options: solver specific options
+SOLVER_PRESETS = {'cplex': {'solver':'cplex', 'timelimit':240, 'mipgap':5e-3,
+                            'options':{'mip pool relgap':0.02, 'mip tolerances absmipgap':1e-4}},
+                  'highs': {'solver':'appsi_highs', 'timelimit':240, 'mipgap':5e-3},
+                  'cbc': {'solver':'cbc', 'timelimit':240, 'mipgap':5e-3},
+                  'glpk': {'solver':'glpk', 'timelimit':240, 'mipgap':5e-3}}
+
+OPTION_NAMES = {'cplex': {'timelimit':'timelimit', 'mipgap':'mip tolerances mipgap', 'threads':'threads'},
+                'appsi_highs': {'timelimit':'time_limit', 'mipgap':'mip_rel_gap', 'threads':'threads'},
+                'cbc': {'timelimit':'sec', 'mipgap':'ratio', 'threads':'threads'},
+                'glpk': {'timelimit':'tmlim', 'mipgap':'mipgap'}}
+
+SCIPY_OPTION_NAMES = {'timelimit':'time_limit', 'mipgap':'mip_rel_gap'}
+
+
+def get_solver_settings(preset, **settings):
+  """Settings of a preset updated with the given settings
+  Args:
+    preset (str): name of the preset in SOLVER_PRESETS
+    settings: timelimit, mipgap, threads or options overriding the preset, None removes a setting
+  Returns:
+    solver_settings (dict): solver name and settings
+  """
+  assert preset in SOLVER_PRESETS, f'Unknown solver preset {preset}, expected one of {list(SOLVER_PRESETS.keys())}'
+  solver_settings = dict(SOLVER_PRESETS[preset])
+  solver_settings.update(settings)
+  return solver_settings
+
+
+def translate_options(solver_name, solver_settings):
+  """Translates the generic settings into the options of a solver, settings the solver does not support are dropped
+  Returns:
+    options (dict): solver option name to value
+  """
+  names = OPTION_NAMES[solver_name]
+  options = {names[key]:value for key, value in solver_settings.items() if key in names and value is not None}
+  options.update(solver_settings.get('options') or {})
+  return options
+
+
+def get_solver(preset='cplex', **settings):
+  """Pyomo solver configured from a preset
+  Args:
+    preset (str): 'cplex', 'highs', 'cbc' or 'glpk'
+    settings: timelimit, mipgap, threads or options overriding the preset, None removes a setting
+  Returns:
+    solver: Pyomo solver with its options set
+  """
+  solver_settings = get_solver_settings(preset, **settings)
+  solver = SolverFactory(solver_settings['solver'])
+  if not solver.available(exception_flag=False):
+    raise RuntimeError(f'Solver {solver_settings["solver"]} of preset {preset} is not available')
+  for key, value in translate_options(solver_settings['solver'], solver_settings).items():
+    solver.options[key] = value
+  return solver
+
+
+def get_scipy_options(preset='highs', **settings):
+  """Options of scipy.optimize.milp (HiGHS) with the time limit and MIP gap of a preset
+  Returns:
+    options (dict): scipy.optimize.milp options
+  """
+  solver_settings = get_solver_settings(preset, **settings)
+  options = {SCIPY_OPTION_NAMES[key]:value for key, value in solver_settings.items() if key in SCIPY_OPTION_NAMES and value is not None}
+  if 'disp' in solver_settings:
+    options['disp'] = solver_settings['disp']
+  return options
+
+
+# Persistent interfaces: the model is kept in the solver and only the changed coefficients are updated between solves
+PERSISTENT_SOLVERS = {'highs':'Highs', 'cplex':'Cplex', 'cbc':'Cbc'}
+THREADS_OPTION = {'highs':('highs_options', 'threads'), 'cplex':('cplex_options', 'threads'), 'cbc':('cbc_options', 'threads')}
+
+
+def get_persistent_solver(preset='highs', **settings):
+  """Persistent (appsi) solver configured from a preset, the solver specific options of the preset are not used
+  Args:
+    preset (str): 'highs', 'cplex' or 'cbc'
+    settings: timelimit, mipgap or threads overriding the preset, None removes a setting
+  Returns:
+    solver: appsi solver
+  """
+  from pyomo.contrib import appsi
+  assert preset in PERSISTENT_SOLVERS, f'No persistent interface for preset {preset}, expected one of {list(PERSISTENT_SOLVERS.keys())}'
+  solver_settings = get_solver_settings(preset, **settings)
+  solver = getattr(appsi.solvers, PERSISTENT_SOLVERS[preset])()
+  if not solver.available():
+    raise RuntimeError(f'Persistent solver {PERSISTENT_SOLVERS[preset]} of preset {preset} is not available')
+  solver.config.time_limit = solver_settings.get('timelimit')
+  solver.config.mip_gap = solver_settings.get('mipgap')
+  solver.config.load_solution = False
+  if solver_settings.get('threads') is not None:
+    options, name = THREADS_OPTION[preset]
+    getattr(solver, options)[name] = solver_settings['threads']
+  return solver
@@ -1,6 +1,9 @@
 import pandas as pd 
 import numpy as np
+import os
 import glob
+import json
+import hashlib
 
 N=1000
 LEARNING = 'NOAK'
@@ -20,9 +23,16 @@ cashflows_color_map = {'SMR CAPEX': 'navy',
                'Avoided Fossil Fuel Costs':'darkorchid', 
                'H2 PTC':'red', 
                'Electricity (cogen)':'pink'}
+# Binary cache of the Excel sheets read by the scripts
+EXCEL_CACHE_DIR = './cache/excel'
+
 #INflation
 conversion_2021usd_to_2020usd = 0.99 #2020$/2021$ source: data.bls.gov
 conversion_2022usd_to_2020usd = 1/1.09 #2020$/2022$
+# Natural gas prices
+NG_PRICES_AEO_2024 = './input_data/eia_aeo_industrial_sector_ng_prices_2024.csv'
+NG_PRICES_AEO = './input_data/eia_aeo_industrial_sector_ng_prices.xlsx'
+NG_PRICES_CURRENT = './input_data/ng_prices_state_annual_us.xlsx'
 # CCUS costs
 ccus_cost = 50#$/ton CO2
 
@@ -107,49 +117,173 @@ def letter_annotation(ax, xoffset, yoffset, letter):
          size=12, weight='bold')
  
 def compute_average_electricity_prices(cambium_scenario, year):
-  folder = f'./input_data/cambium_{cambium_scenario.lower()}_state_hourly_electricity_prices'
-  list_csv_files = glob.glob(folder+'/Cambium*.csv')
-  state_prices = pd.DataFrame(columns=['average price ($/MWhe)', 'state'])
-  state_prices.set_index('state', inplace=True)
-  for file in list_csv_files:
-    if str(year) in file:
-      state = file.split('_')[-2]
-      avg_price = pd.read_csv(file, skiprows=5)['energy_cost_enduse'].mean()
-      state_prices.loc[state, 'average price ($/MWhe)'] = avg_price
+  import cambium_prices
+  # Averages are reported in the 2021 USD of the Cambium files, the cube stores 2020 USD
+  cambium_prices.ensure_price_cube([cambium_scenario])
+  avg_prices = cambium_prices.get_average_prices(cambium_scenario, year)/conversion_2021usd_to_2020usd
+  state_prices = avg_prices.to_frame(name='average price ($/MWhe)')
   state_prices.to_excel(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx')
 
 
 def compute_cogen(df, surplus_cap_col_name, state_col_name, cambium_scenario, year):
   try:
-    elec_prices_df = pd.read_excel(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx', index_col=0)
+    elec_prices_df = read_excel_cached(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx', index_col=0)
   except FileNotFoundError:
     compute_average_electricity_prices(cambium_scenario, year)
-    elec_prices_df = pd.read_excel(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx', index_col=0)
+    elec_prices_df = read_excel_cached(f'./results/average_electricity_prices_{cambium_scenario}_{year}.xlsx', index_col=0)
   df['Electricity revenues ($/y)'] = df.apply(lambda x: x[surplus_cap_col_name]*elec_prices_df.loc[x[state_col_name]]*8760, axis=1)
   return df
   
 
+_ng_prices = {}
+
+def load_ng_prices(source='aeo', year=2024, scenario='reference'):
+  """Loads state-level natural gas prices, each (source, year, scenario) is read once per process
+  Args: 
+    source (str): 'aeo' for EIA AEO industrial sector projections, 'current' for 2022 EIA state prices
+    year (int): year of the AEO projection, 2024 or 2030
+    scenario (str): AEO case, other cases than 'reference' use the census division prices of the cases in the
+      prices_division sheet
+  Returns: 
+    ng_prices (Series): price in $2020/MMBtu indexed by state
+  """
+  key = (source, year, scenario) if source == 'aeo' else (source,)
+  if key not in _ng_prices:
+    if source == 'current':
+      ng_prices = read_excel_cached(NG_PRICES_CURRENT, sheet_name='clean_data_2022', index_col='state')['price ($/MMBtu)']
+    elif source == 'aeo' and year == 2024 and scenario == 'reference':
+      ng_prices = pd.read_csv(NG_PRICES_AEO_2024, index_col='state')['price']
+    elif source == 'aeo' and scenario == 'reference':
+      state_prices = read_excel_cached(NG_PRICES_AEO, sheet_name='state_prices')
+      ng_prices = state_prices[state_prices['year'] == year].set_index('state')['price 2020USD/MMBtu']
+    elif source == 'aeo':
+      division_prices = read_excel_cached(NG_PRICES_AEO, sheet_name='prices_division')
+      if scenario not in set(division_prices['case']):
+        raise ValueError(f'Unknown AEO case: {scenario}, available cases: {sorted(set(division_prices["case"]))}')
+      division_prices = division_prices[(division_prices['year'] == year) & (division_prices['case'] == scenario)]
+      division_prices = division_prices.set_index('region')['price 2022USD/MMBtu']*conversion_2022usd_to_2020usd
+      state_division = read_excel_cached(NG_PRICES_AEO, sheet_name='map_census_division_state', index_col='state')['region']
+      ng_prices = state_division.map(division_prices).dropna()
+    else:
+      raise ValueError(f'Unknown natural gas price source: {source}')
+    if len(ng_prices) == 0:
+      raise ValueError(f'No natural gas prices for {key}')
+    ng_prices = ng_prices.astype(float).rename('price ($/MMBtu)')
+    _ng_prices[key] = (ng_prices, ng_prices.to_dict())
+  return _ng_prices[key][0]
+
+
+def _ng_price_map(source, year, scenario):
+  load_ng_prices(source, year, scenario)
+  return _ng_prices[(source, year, scenario) if source == 'aeo' else (source,)][1]
+
+
 def get_ng_price_current(state):
-  ng_prices_map = pd.read_excel('./input_data/ng_prices_state_annual_us.xlsx', sheet_name='clean_data_2022', index_col='state')
-  ng_price = float(ng_prices_map.loc[state, 'price ($/MMBtu)'])
+  ng_price = float(_ng_price_map('current', None, None)[state])
   return ng_price
 
 
-def get_ng_price_aeo(state):
-  state_prices = pd.read_csv('./input_data/eia_aeo_industrial_sector_ng_prices_2024.csv', index_col='state')
-  ng_price = state_prices.loc[state, 'price']
+def get_ng_price_aeo(state, year=2024, scenario='reference'):
+  ng_price = _ng_price_map('aeo', year, scenario)[state]
   return ng_price
 
 
+def get_ng_prices(states, source='aeo', year=2024, scenario='reference'):
+  """Vectorized lookup of natural gas prices
+  Args: 
+    states (Series): state abbreviations
+    source (str): 'aeo' or 'current', see load_ng_prices
+    year (int): year of the AEO projection
+    scenario (str): AEO case
+  Returns: 
+    ng_prices (Series): prices in $2020/MMBtu aligned on states, NaN for unknown states
+  """
+  ng_prices = load_ng_prices(source, year, scenario)
+  return pd.Series(ng_prices.reindex(states.to_numpy()).to_numpy(), index=states.index, name=ng_prices.name)
+
+
+def attach_ng_prices(df, state_col='state', price_col='State price ($/MMBtu)', source='aeo', year=2024, scenario='reference'):
+  """Adds the natural gas price of each row's state to a results DataFrame with one indexed join"""
+  ng_prices = load_ng_prices(source, year, scenario).rename(price_col)
+  return df.drop(columns=[price_col], errors='ignore').join(ng_prices, on=state_col)
+
+
 def update_capex_costs(ANR_data, learning_rate_anr_capex, H2_data, learning_rate_h2_capex, N=N):
-  ANR_data['CAPEX $/MWe'] = ANR_data.apply(lambda x: x['CAPEX $/MWe']*np.power(N, np.log2(1-learning_rate_anr_capex)), axis=1)
-  H2_data['CAPEX ($/MWe)'] = H2_data.apply(lambda x: x['CAPEX ($/MWe)']*np.power(N, np.log2(1-learning_rate_h2_capex)), axis=1)
+  ANR_data['CAPEX $/MWe'] = ANR_data['CAPEX $/MWe']*np.power(N, np.log2(1-learning_rate_anr_capex))
+  H2_data['CAPEX ($/MWe)'] = H2_data['CAPEX ($/MWe)']*np.power(N, np.log2(1-learning_rate_h2_capex))
   return ANR_data, H2_data
 
 
+_file_hashes = {}
+
+def file_hash(path):
+  """Returns the sha256 of the content of a file, memoized per process on path, size and modification time"""
+  stat = os.stat(path)
+  key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+  if key not in _file_hashes:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        sha.update(chunk)
+    _file_hashes[key] = sha.hexdigest()
+  return _file_hashes[key]
+
+
+def read_excel_cached(path, sheet_name=0, cache_dir=EXCEL_CACHE_DIR, **kwargs):
+  """Drop-in replacement for pd.read_excel for a single sheet, serving repeated reads from a Feather copy of the sheet.
+  The copy is keyed by the sha256 of the workbook, the sheet name and the read arguments, so editing the workbook 
+  invalidates it, and the older copies of the same sheet are removed when a new one is written. Falls back to pd.read_excel when pyarrow is not installed or the sheet cannot be stored in Arrow.
+  Args: 
+    path (str): path to the Excel workbook
+    sheet_name (str or int): sheet to read, lists and None (several sheets) are not cached
+    cache_dir (str): folder for the Feather copies
+    kwargs: other arguments passed to pd.read_excel (index_col, usecols, ...)
+  Returns: 
+    df (DataFrame): sheet data
+  """
+  try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+  except ImportError:
+    return pd.read_excel(path, sheet_name=sheet_name, **kwargs)
+  if not isinstance(sheet_name, (str, int)):
+    return pd.read_excel(path, sheet_name=sheet_name, **kwargs)
+  # Copies of the same sheet and read arguments share the prefix, the suffix depends on the content of the workbook
+  key = hashlib.sha256(json.dumps([os.path.abspath(path), sheet_name, sorted(kwargs.items())], default=str).encode()).hexdigest()
+  prefix = os.path.join(cache_dir, f'{os.path.splitext(os.path.basename(path))[0]}_{key[:16]}_')
+  cache_path = f'{prefix}{file_hash(path)[:16]}.feather'
+  if os.path.isfile(cache_path):
+    table = feather.read_table(cache_path, memory_map=True)
+    df = table.to_pandas()
+    # Restore non-string column names (e.g. years) that Arrow stores as strings
+    df.columns = json.loads(table.schema.metadata[b'columns'])
+    return df
+  df = pd.read_excel(path, sheet_name=sheet_name, **kwargs)
+  if isinstance(df.columns, pd.MultiIndex) or not all(isinstance(c, (str, int, float)) for c in df.columns):
+    return df
+  try:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+  except (pa.ArrowInvalid, pa.ArrowTypeError):
+    return df
+  columns = [c.item() if isinstance(c, np.generic) else c for c in df.columns]
+  table = table.replace_schema_metadata({**table.schema.metadata, b'columns':json.dumps(columns).encode()})
+  os.makedirs(cache_dir, exist_ok=True)
+  # Write then rename, parallel workers may fill the same entry
+  tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+  feather.write_feather(table, tmp_path, compression='uncompressed')
+  os.replace(tmp_path, cache_path)
+  for stale_path in glob.glob(glob.escape(prefix)+'*.feather'):
+    if stale_path != cache_path:
+      try:
+        os.remove(stale_path)
+      except FileNotFoundError:
+        pass
+  return df
+
+
 def load_data(anr_tag='FOAK'):
-  H2_data = pd.read_excel('./h2_tech.xlsx', sheet_name='Summary', index_col=[0,1])
-  ANR_data = pd.read_excel('./ANRs.xlsx', sheet_name=anr_tag, index_col=0)
+  H2_data = read_excel_cached('./h2_tech.xlsx', sheet_name='Summary', index_col=[0,1])
+  ANR_data = read_excel_cached('./ANRs.xlsx', sheet_name=anr_tag, index_col=0)
   #ANR_data, H2_data = update_capex_costs(ANR_data, learning_rate_anr_capex, H2_data, learning_rate_h2_capex)
   return ANR_data, H2_data
 